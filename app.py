@@ -1,14 +1,34 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, send_from_directory
+from flask import Flask, Response, request, jsonify, make_response, render_template, session, redirect, send_file, send_from_directory, stream_with_context
 import os
+import sys
+import json
+import hmac
+import time
+import re
+import hashlib
+import importlib
+import socket
+import asyncio
+import uuid
+import threading
+import multiprocessing
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask_cors import CORS
-from PIL import Image
+from image_processing import process_image
+from intent_router import IntentRouter
 from io import BytesIO
 from dotenv import load_dotenv
 from datetime import datetime
-from openai import OpenAI, BadRequestError
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from urllib.parse import parse_qs
+from itsdangerous import BadSignature
+from werkzeug.http import dump_cookie, parse_cookie
+from functools import wraps
 import logging
-import tweepy  # <-- Added import for Tweepy
+# openai, httpx, tweepy, numpy and Pillow are imported on first use: see get_clients() and friends
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
@@ -18,9 +38,8 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-# Initialize the client once at the top
-client = OpenAI(api_key=OPENAI_API_KEY)
 FLASK_SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "fallback_secret_if_env_fails")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 # Validate API keys
 if not DEEPSEEK_API_KEY:
@@ -28,50 +47,232 @@ if not DEEPSEEK_API_KEY:
 if not OPENAI_API_KEY:
     raise ValueError("❌ Missing OpenAI API Key! Set OPENAI_API_KEY in .env")
 
+# Infrastructure modules read their settings from the environment when imported, so they load after .env
+from shared_store import acquire_lease, close_shared_db, ensure_background_thread, get_shared_db, process_owner_id
+from circuit_breaker import CIRCUIT_BREAKERS, CircuitOpenError
+from concurrency_limiter import CONCURRENCY_LIMITERS, LimiterTimeout
+from rate_limiter import RATE_LIMIT_COSTS, rate_limited_response, take_rate_limit
+from image_store import (
+    IMAGE_OUTPUT_FORMAT, IMAGE_VARIANTS, find_stored_image, lookup_stored_image, save_rendered_image,
+    stored_image_url, touch_stored_image
+)
+from single_flight import ClientDisconnected, single_flight
+from response_cache import (
+    RESPONSE_CACHE_TTL, SEMANTIC_CACHE_THRESHOLD, embed_prompt, response_cache, response_cache_key,
+    sampling_params_key, semantic_cache
+)
+from conversation_memory import (
+    CONVERSATION_TOKEN_BUDGET, conversation_memory, estimate_tokens, load_history, remember_turn
+)
+from usage_ledger import (
+    QuotaExceeded, check_token_quota, estimate_request_tokens, usage_day, usage_flush_loop, usage_ledger
+)
+from tweet_outbox import (
+    TWITTER_CONFIGURED, get_twitter_api, post_tweet, reset_twitter_api, tweet_outbox_stats, tweet_reply,
+    tweet_reply_async, tweet_sender_loop
+)
 
-# Twitter API credentials (make sure these are set in your .env file)
-TWITTER_API_KEY = os.getenv("TWITTER_API_KEY")
-TWITTER_API_KEY_SECRET = os.getenv("TWITTER_API_KEY_SECRET")
-TWITTER_ACCESS_TOKEN = os.getenv("TWITTER_ACCESS_TOKEN")
-TWITTER_ACCESS_TOKEN_SECRET = os.getenv("TWITTER_ACCESS_TOKEN_SECRET")
+# Upstream HTTP clients: one keep-alive connection pool per host, per worker process
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "20"))
+UPSTREAM_KEEPALIVE = int(os.getenv("UPSTREAM_KEEPALIVE", "10"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "1"))  # plain HTTP only: SDK errors go straight to the limiters
+DEEPSEEK_TIMEOUT = float(os.getenv("DEEPSEEK_TIMEOUT", "10"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
+DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
 
-if not all([TWITTER_API_KEY, TWITTER_API_KEY_SECRET, TWITTER_ACCESS_TOKEN, TWITTER_ACCESS_TOKEN_SECRET]):
-    raise ValueError("❌ Missing Twitter API credentials! Check your .env file.")
+# OpenAI and DeepSeek (OpenAI-compatible) share the same pooled httpx transport.
+# Importing openai costs ~0.5s, so the clients are built on first use rather than at import.
+_clients = {}
+_clients_lock = threading.Lock()
+_background_lock = threading.Lock()  # guards the per-process executors and pools
 
-# Set up Tweepy authentication and initialize the Twitter API client $DP
-auth = tweepy.OAuth1UserHandler(
-    TWITTER_API_KEY,
-    TWITTER_API_KEY_SECRET,
-    TWITTER_ACCESS_TOKEN,
-    TWITTER_ACCESS_TOKEN_SECRET
-)
-twitter_api = tweepy.API(auth)
+def get_clients() -> dict:
+    """Return the pooled OpenAI / DeepSeek / httpx.Client trio"""
+    if not _clients:
+        with _clients_lock:
+            if not _clients:
+                import httpx
+                from openai import OpenAI
+
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=UPSTREAM_POOL_SIZE, max_keepalive_connections=UPSTREAM_KEEPALIVE),
+                    timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT)
+                )
+                _clients["openai"] = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    http_client=http_client,
+                    timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+                    max_retries=0
+                )
+                _clients["deepseek"] = OpenAI(
+                    api_key=DEEPSEEK_API_KEY,
+                    base_url=DEEPSEEK_BASE_URL,
+                    http_client=http_client,
+                    timeout=httpx.Timeout(DEEPSEEK_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+                    max_retries=0,
+                    default_headers={"User-Agent": "CryptoAI/1.0 (+https://yourdomain.com)"}
+                )
+                _clients["http"] = http_client
+    return _clients
 
-# Optionally verify credentials
-try:
-    twitter_api.verify_credentials()
-    logger.info("Twitter authentication OK")
-except Exception as e:
-    logger.error("Error during Twitter authentication", exc_info=True)
+# Async clients for the ASGI app, created on first use inside the worker's event loop
+_async_clients = {}
+
+def get_async_clients() -> dict:
+    """Return the pooled AsyncOpenAI / DeepSeek / httpx.AsyncClient trio"""
+    if not _async_clients:
+        import httpx
+        from openai import AsyncOpenAI
+
+        async_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=UPSTREAM_POOL_SIZE, max_keepalive_connections=UPSTREAM_KEEPALIVE),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT)
+        )
+        _async_clients["http"] = async_http_client
+        _async_clients["openai"] = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            http_client=async_http_client,
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+            max_retries=0
+        )
+        _async_clients["deepseek"] = AsyncOpenAI(
+            api_key=DEEPSEEK_API_KEY,
+            base_url=DEEPSEEK_BASE_URL,
+            http_client=async_http_client,
+            timeout=httpx.Timeout(DEEPSEEK_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+            max_retries=0,
+            default_headers={"User-Agent": "CryptoAI/1.0 (+https://yourdomain.com)"}
+        )
+    return _async_clients
+
+async def close_async_clients():
+    """Close the async connection pool (ASGI lifespan shutdown)"""
+    if _async_clients:
+        await _async_clients["http"].aclose()
+        _async_clients.clear()
+
+# Plain HTTP calls (CoinGecko, image downloads) go through one pooled requests session
+def build_http_session() -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=UPSTREAM_KEEPALIVE,
+        pool_maxsize=UPSTREAM_POOL_SIZE,
+        max_retries=Retry(
+            total=UPSTREAM_MAX_RETRIES,
+            backoff_factor=0.3,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"])
+        )
+    ))
+    return session
+
+http_session = build_http_session()
+
+# Verify upstream credentials in the background after startup instead of blocking the import
+VERIFY_CREDENTIALS = os.getenv("VERIFY_CREDENTIALS", "false").lower() == "true"
+
+def reset_process_clients():
+    """Forget connection pools inherited across fork(); the child builds its own on first use"""
+    global http_session, _clients_lock
+    _clients_lock = threading.Lock()
+    _clients.clear()
+    _async_clients.clear()
+    reset_twitter_api()
+    http_session = build_http_session()
+
+# Covers gunicorn --preload and any other fork, so no worker ever reuses the parent's sockets
+os.register_at_fork(after_in_child=reset_process_clients)
 
 # Flask App Configuration $DP
 app = Flask(__name__, template_folder="templates", static_folder="static")
 app.secret_key = FLASK_SECRET_KEY
+# Let nginx/Apache stream stored images straight from disk when fronted by one (X-Sendfile)
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "false").lower() == "true"
 CORS(app, supports_credentials=True)
+# Behind nginx/a load balancer, trust this many X-Forwarded-For hops so rate limits see the real client IP
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
+if TRUSTED_PROXIES:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 
 # Constants
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 WALLET_ADDRESS = "7CSW7ofgjD8ThrWsNAzTKKYtyqe3QSibsUYcCPFV1AFG"
 IMAGE_TRIGGERS = [
     "generate image", "create picture", "show me a",
     "visualize this", "draw me", "make artwork",
     "digital art of", "create visual", "render an image",
-    "generate photo", "create illustration"  # Added
+    "generate photo", "create illustration",  # Added
+    # Triggers match whole words, so spell out what the old substring scan caught by accident ("show me a|n")
+    "show me an", "image of", "picture of"
+]
+PRICE_KEYWORDS = ["price", "value", "how much", "current", "rate", "valuation"]
+CRYPTO_TERMS = ["bitcoin", "btc", "ethereum", "eth", "solana", "sol", "crypto", "coin"]
+WALLET_KEYWORDS = ["wallet"]
+BRIEF_KEYWORDS = ["briefly", "tldr", "tl;dr", "in one sentence", "in a sentence", "short answer", "quick question", "one word", "yes or no"]
+LONG_FORM_KEYWORDS = [
+    "explain", "essay", "in detail", "step by step", "tutorial", "guide", "compare",
+    "elaborate", "deep dive", "breakdown", "pros and cons", "history of", "write a"
 ]
 CRYPTO_IDS = {"bitcoin": "BTC", "ethereum": "ETH", "solana": "SOL"}
 COINGECKO_URL = "https://api.coingecko.com/api/v3/simple/price"
 BANNED_WORDS = {"nude", "violence", "hate", "sexual", "nsfw"}
 
+# Every trigger list compiled into one word-boundary regex; higher priority is handled first
+intent_router = (
+    IntentRouter()
+    .add("image", IMAGE_TRIGGERS, priority=30)
+    .add("price", PRICE_KEYWORDS, priority=20, requires=CRYPTO_TERMS)
+    .add("wallet", WALLET_KEYWORDS, priority=10)
+    # Reply-length hints for DeepSeek; an explicit ask for brevity beats a long-form topic
+    .add("brief", BRIEF_KEYWORDS, priority=2)
+    .add("long_form", LONG_FORM_KEYWORDS, priority=1)
+    .compile()
+)
+
+def chat_request_cost(data) -> float:
+    """A chat costs a chat, unless the message asks for an image; tweeting the reply costs a tweet on top"""
+    if not isinstance(data, dict):
+        return RATE_LIMIT_COSTS["chat"]
+    message = data.get("message")
+    image = isinstance(message, str) and "image" in intent_router.classify(message)
+    cost = RATE_LIMIT_COSTS["image" if image else "chat"]
+    return cost + RATE_LIMIT_COSTS["tweet"] if data.get("tweet") else cost
+
+def rate_limited(cost):
+    """Charge a Flask route's cost (a number, or a function of the JSON body) before running it"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            units = cost(request.get_json(silent=True)) if callable(cost) else cost
+            decision = take_rate_limit(session.get("sid"), request.remote_addr, units)
+            if decision is None:
+                return view(*args, **kwargs)
+            if decision.allowed:
+                response = make_response(view(*args, **kwargs))
+            else:
+                response = make_response(jsonify(rate_limited_response(decision)), 429)
+            response.headers.update(decision.headers())
+            return response
+        return wrapper
+    return decorator
+
+# Crypto price snapshot (one refresher across all workers, readers never hit CoinGecko)
+PRICE_REFRESH_INTERVAL = float(os.getenv("PRICE_REFRESH_INTERVAL", "30"))
+PRICE_LOCAL_TTL = float(os.getenv("PRICE_LOCAL_TTL", "1"))
+_price_cache = {"prices": None, "fetched_at": 0.0, "checked_at": 0.0}
+_price_lock = threading.Lock()
+_price_refresh_wakeup = threading.Event()
+
+# Live price fan-out: one watcher thread per worker, coalescing queues per subscriber
+PRICE_STREAM_POLL = float(os.getenv("PRICE_STREAM_POLL", "1"))
+PRICE_STREAM_HEARTBEAT = 15
+# Each Flask /prices/stream client holds a server thread for as long as it watches, so a worker takes at most
+# this many and answers 503 beyond that (0 = only under asgi_app, whose streams hold no thread)
+PRICE_STREAM_MAX_SUBSCRIBERS = int(os.getenv("PRICE_STREAM_MAX_SUBSCRIBERS", "4"))
+_price_subscribers = set()
+_price_subscribers_lock = threading.Lock()
+
 # Personality Configurations (Enhanced with image styles and richer prompts)
 PERSONALITIES = {
     "hacker": {
@@ -147,6 +348,7 @@ PERSONALITIES = {
 }
 
 @app.route("/test_image")
+@rate_limited(3 * RATE_LIMIT_COSTS["image"])
 def test_image():
     """Test image generation endpoint"""
     test_prompts = [
@@ -166,12 +368,61 @@ def test_image():
     
     return jsonify(results)
 
+# Background services and readiness: started by the first request in each worker, never at import
+_readiness = {"twitter": "unchecked", "openai": "unchecked", "deepseek": "unchecked"}
+
+def readiness_check():
+    """Verify upstream credentials once, off the request path (VERIFY_CREDENTIALS=true)"""
+    checks = {
+        "openai": lambda: get_clients()["openai"].models.list(),
+        "deepseek": lambda: get_clients()["deepseek"].models.list(),
+        "twitter": lambda: get_twitter_api().verify_credentials(),
+    }
+    for name, check in checks.items():
+        if name == "twitter" and not TWITTER_CONFIGURED:
+            _readiness[name] = "not configured"
+            continue
+        try:
+            check()
+            _readiness[name] = "ok"
+            logger.info(f"✅ {name} credentials OK")
+        except Exception as e:
+            _readiness[name] = "failed"
+            logger.error(f"❌ {name} credential check failed: {str(e)}")
+
+def start_background_services():
+    """Start this worker's background threads (cheap no-op once running)"""
+    if TWITTER_CONFIGURED:
+        # Also drains whatever an earlier process left queued
+        ensure_background_thread("tweet-sender", tweet_sender_loop)
+    if VERIFY_CREDENTIALS:
+        ensure_background_thread("readiness-check", readiness_check)
+    ensure_background_thread("usage-flush", usage_flush_loop)
+
+@app.before_request
+def before_request():
+    start_background_services()
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe (checks run only with VERIFY_CREDENTIALS); Twitter is optional, so it only degrades"""
+    if _readiness["openai"] == "failed" or _readiness["deepseek"] == "failed":
+        return jsonify({"status": "failed", "checks": _readiness}), 503
+    status = "degraded" if _readiness["twitter"] == "failed" else "ok"
+    return jsonify({"status": status, "checks": _readiness})
+
 # Routes
 @app.route("/")
 def home():
     """Serve the terminal UI"""
     return render_template("index.html")
 
+def get_session_id() -> str:
+    """Stable per-browser id kept in the signed session cookie"""
+    if "sid" not in session:
+        session["sid"] = uuid.uuid4().hex
+    return session["sid"]
+
 @app.route("/set_personality", methods=["POST"])
 def set_personality():
     """Set active personality"""
@@ -191,41 +442,206 @@ def set_personality():
         logger.error(f"Personality error: {str(e)}")
         return jsonify({"error": str(e)}), 500
     
+@app.route("/conversation", methods=["GET"])
+def conversation():
+    """This session's stored history for the active personality, and how much of it the next request sends"""
+    personality = session.get("personality", "default")
+    session_id = session.get("sid")
+    messages = conversation_memory.load(session_id, personality) if session_id else []
+    # What the next request would send, without moving the shared window as a request does
+    context = conversation_memory.history(session_id, personality, update_window=False) if session_id else []
+    return jsonify({
+        "personality": personality,
+        "messages": [{"role": message.role, "content": message.content} for message in messages],
+        "stored_tokens": sum(message.tokens for message in messages),
+        "context_messages": len(context),
+        "context_tokens": sum(message.tokens for message in context),
+        "token_budget": CONVERSATION_TOKEN_BUDGET
+    })
+
+@app.route("/conversation", methods=["DELETE"])
+def reset_conversation():
+    """Forget this session's history (all personalities)"""
+    if session.get("sid"):
+        conversation_memory.clear(session["sid"])
+    return jsonify({"message": "Conversation cleared"})
+
+def build_image_prompt(prompt: str, personality: str) -> str:
+    """Clean the user prompt and wrap it in the personality's image style"""
+    cleaned_prompt = ' '.join([word for word in prompt.split() if word.lower() not in BANNED_WORDS])[:250]
+
+    # Get style with safe fallback
+    personality_config = PERSONALITIES.get(personality, PERSONALITIES["default"])
+    style = personality_config.get("image_style", "digital art")  # Safe access
+
+    return f"8K {style} of {cleaned_prompt}. Trending crypto-art style, vibrant colors, blockchain elements, award-winning composition -nft -watermark"
+
+# Image post-processing: capped streaming download, then decode/resize/encode in a process pool
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", "2"))
+IMAGE_DOWNLOAD_MAX_BYTES = int(os.getenv("IMAGE_DOWNLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+_image_process_pool = {"pid": None, "pool": None}
+
+def get_image_process_pool() -> ProcessPoolExecutor:
+    """Return this process's Pillow worker pool (rebuilt after a fork)"""
+    if _image_process_pool["pid"] != os.getpid():
+        with _background_lock:
+            if _image_process_pool["pid"] != os.getpid():
+                # Never fork a threaded server process: start workers from a clean interpreter
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _image_process_pool["pool"] = ProcessPoolExecutor(
+                    max_workers=IMAGE_PROCESS_WORKERS, mp_context=multiprocessing.get_context(method)
+                )
+                _image_process_pool["pid"] = os.getpid()
+    return _image_process_pool["pool"]
+
+def download_image(image_url: str) -> bytes:
+    """Stream an image download, aborting once it exceeds IMAGE_DOWNLOAD_MAX_BYTES"""
+    with http_session.get(image_url, stream=True, timeout=(UPSTREAM_CONNECT_TIMEOUT, 30)) as response:
+        response.raise_for_status()
+        if int(response.headers.get("Content-Length") or 0) > IMAGE_DOWNLOAD_MAX_BYTES:
+            raise ValueError(f"Image larger than {IMAGE_DOWNLOAD_MAX_BYTES} bytes")
+        content = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            content += chunk
+            if len(content) > IMAGE_DOWNLOAD_MAX_BYTES:
+                raise ValueError(f"Image larger than {IMAGE_DOWNLOAD_MAX_BYTES} bytes")
+    return bytes(content)
+
+async def download_image_async(image_url: str) -> bytes:
+    """Async variant of download_image"""
+    async with get_async_clients()["http"].stream("GET", image_url, timeout=30) as response:
+        response.raise_for_status()
+        if int(response.headers.get("Content-Length") or 0) > IMAGE_DOWNLOAD_MAX_BYTES:
+            raise ValueError(f"Image larger than {IMAGE_DOWNLOAD_MAX_BYTES} bytes")
+        content = bytearray()
+        async for chunk in response.aiter_bytes(64 * 1024):
+            content += chunk
+            if len(content) > IMAGE_DOWNLOAD_MAX_BYTES:
+                raise ValueError(f"Image larger than {IMAGE_DOWNLOAD_MAX_BYTES} bytes")
+    return bytes(content)
+
+class StageTimings:
+    """Count / mean / max milliseconds per image pipeline stage"""
+
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def record(self, timings: dict):
+        with self.lock:
+            for stage, ms in timings.items():
+                count, total, peak = self.stages.get(stage, (0, 0.0, 0.0))
+                self.stages[stage] = (count + 1, total + ms, max(peak, ms))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                stage: {"count": count, "avg_ms": round(total / count, 1), "max_ms": round(peak, 1)}
+                for stage, (count, total, peak) in self.stages.items()
+            }
+
+image_stage_timings = StageTimings()
+
+def finish_rendered_image(image_prompt: str, image_url: str, processed: dict, timings: dict) -> str:
+    """Store a processed render, record stage timings and return the URL to hand out"""
+    timings.update(processed["timings"])
+    started = time.perf_counter()
+    url = save_rendered_image(image_prompt, image_url, processed)
+    timings["store_ms"] = (time.perf_counter() - started) * 1000
+    image_stage_timings.record(timings)
+    logger.info("⏱️ Image stages: " + ", ".join(f"{stage}={ms:.0f}" for stage, ms in timings.items()))
+    return url
+
+def image_flight_key(image_prompt: str) -> str:
+    """Single-flight key for a DALL-E request"""
+    return "image:" + hashlib.sha256(image_prompt.encode("utf-8")).hexdigest()
+
 def generate_image(prompt: str, personality: str) -> str:
-    """Generate and resize an image from DALL-E 3."""
-    try:
-        cleaned_prompt = ' '.join([word for word in prompt.split() if word.lower() not in BANNED_WORDS])[:250]
+    """Generate an image, coalescing identical concurrent requests into one DALL-E call."""
+    image_prompt = build_image_prompt(prompt, personality)
+    return single_flight.do(image_flight_key(image_prompt), lambda: render_image(image_prompt))
+
+def render_image(image_prompt: str) -> str:
+    """Generate and resize an image from DALL-E 3 (or reuse the stored render of the same prompt)."""
+    from openai import BadRequestError
 
-        # Get style with safe fallback
-        personality_config = PERSONALITIES.get(personality, PERSONALITIES["default"])
-        style = personality_config.get("image_style", "digital art")  # Safe access
+    try:
+        digest = lookup_stored_image(image_prompt)
+        if digest:
+            logger.info(f"🗄️ Image store hit: {digest}")
+            return stored_image_url(digest)
 
+        timings = {}
+        started = time.perf_counter()
         # Generate 1024x1024 image (DALL·E 3 only supports this size)
-        response = client.images.generate(
-            model="dall-e-3",
-            prompt=f"8K {style} of {cleaned_prompt}. Trending crypto-art style, vibrant colors, blockchain elements, award-winning composition -nft -watermark",
-            size="1024x1024",
-            quality="hd"
-        )
+        with CONCURRENCY_LIMITERS["dalle"].slot(), CIRCUIT_BREAKERS["dalle"].guard():
+            response = get_clients()["openai"].images.generate(
+                model="dall-e-3",
+                prompt=image_prompt,
+                size="1024x1024",
+                quality="hd"
+            )
+
+        timings["generate_ms"] = (time.perf_counter() - started) * 1000
 
         # Get the image URL
         image_url = response.data[0].url
         logger.info(f"✅ Image generated: {image_url}")
 
-        # Download and resize the image
-        img_response = requests.get(image_url)
-        img = Image.open(BytesIO(img_response.content))
+        # Download (size-capped), then decode/resize/encode off the request thread
+        started = time.perf_counter()
+        content = download_image(image_url)
+        timings["download_ms"] = (time.perf_counter() - started) * 1000
+        processed = get_image_process_pool().submit(process_image, content, IMAGE_OUTPUT_FORMAT).result()
+
+        # Keep both renders locally; DALL-E URLs expire after about an hour
+        return finish_rendered_image(image_prompt, image_url, processed, timings)
 
-        # Resize to 256x256
-        resized_img = img.resize((256, 256), Image.LANCZOS)
+    except BadRequestError as e:
+        logger.error(f"❌ Content policy violation: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"❌ Image generation failed: {str(e)}")
+        return None
 
+async def generate_image_async(prompt: str, personality: str) -> str:
+    """Async variant of generate_image for the ASGI app."""
+    image_prompt = build_image_prompt(prompt, personality)
+    return await single_flight.do_async(image_flight_key(image_prompt), lambda: render_image_async(image_prompt))
 
-        # Save resized image to buffer
-        img_buffer = BytesIO()
-        resized_img.save(img_buffer, format="PNG")
+async def render_image_async(image_prompt: str) -> str:
+    """Async variant of render_image."""
+    from openai import BadRequestError
 
-        # Convert to base64 or re-upload if needed
-        return image_url  # Use original or re-upload resized one
+    try:
+        digest = await asyncio.to_thread(lookup_stored_image, image_prompt)
+        if digest:
+            logger.info(f"🗄️ Image store hit: {digest}")
+            return stored_image_url(digest)
+
+        timings = {}
+        started = time.perf_counter()
+        async with CONCURRENCY_LIMITERS["dalle"].slot_async():
+            with CIRCUIT_BREAKERS["dalle"].guard():
+                response = await get_async_clients()["openai"].images.generate(
+                    model="dall-e-3",
+                    prompt=image_prompt,
+                    size="1024x1024",
+                    quality="hd"
+                )
+
+        timings["generate_ms"] = (time.perf_counter() - started) * 1000
+
+        image_url = response.data[0].url
+        logger.info(f"✅ Image generated: {image_url}")
+
+        # Download on the event loop, decode/resize/encode in the process pool
+        started = time.perf_counter()
+        content = await download_image_async(image_url)
+        timings["download_ms"] = (time.perf_counter() - started) * 1000
+        processed = await asyncio.wrap_future(get_image_process_pool().submit(process_image, content, IMAGE_OUTPUT_FORMAT))
+
+        return await asyncio.to_thread(finish_rendered_image, image_prompt, image_url, processed, timings)
 
     except BadRequestError as e:
         logger.error(f"❌ Content policy violation: {str(e)}")
@@ -234,162 +650,1051 @@ def generate_image(prompt: str, personality: str) -> str:
         logger.error(f"❌ Image generation failed: {str(e)}")
         return None
 
-def get_crypto_prices():
-    """Fetch crypto prices with improved error handling"""
+# Progressive images: a fast DALL-E 2 preview now, the DALL-E 3 HD render as a background job
+IMAGE_PREVIEW_MODEL = os.getenv("IMAGE_PREVIEW_MODEL", "dall-e-2")
+IMAGE_PREVIEW_SIZE = os.getenv("IMAGE_PREVIEW_SIZE", "512x512")
+IMAGE_HD_EXPECTED_MS = float(os.getenv("IMAGE_HD_EXPECTED_MS", "20000"))  # until real HD timings exist
+
+def parse_latency_budget(data: dict, field: str = "latency_budget_ms"):
+    """Client's latency budget as a float, or None if absent or malformed
+
+    latency_budget_ms is for image renders (preview first when HD would be late);
+    text replies are only shortened for an explicit reply_budget_ms.
+    """
     try:
-        params = {
-            "ids": ",".join(CRYPTO_IDS.keys()),
-            "vs_currencies": "usd",
-            "include_last_updated_at": True
-        }
-        response = requests.get(
-            COINGECKO_URL,
-            headers={"User-Agent": "Mozilla/5.0"},
-            params=params,
-            timeout=8
-        )
-        response.raise_for_status()
-        
-        return {
-            symbol: {
-                "price": f"${data['usd']:,.2f}",
-                "updated": datetime.fromtimestamp(data["last_updated_at"]).strftime("%Y-%m-%d %H:%M UTC")
-            }
-            for crypto, symbol in CRYPTO_IDS.items()
-            if (data := response.json().get(crypto))
-        }
-        
+        budget = float(data.get(field))
+    except (TypeError, ValueError):
+        return None
+    return budget if budget > 0 else None
+
+def expected_hd_image_ms() -> float:
+    """Mean observed HD generate time in this worker, or IMAGE_HD_EXPECTED_MS before the first render"""
+    generate = image_stage_timings.stats().get("generate_ms")
+    return generate["avg_ms"] if generate else IMAGE_HD_EXPECTED_MS
+
+def wants_image_preview(latency_budget_ms, image_prompt: str) -> bool:
+    """Preview first when the HD render would blow the client's budget and is not already stored"""
+    if latency_budget_ms is None or latency_budget_ms >= expected_hd_image_ms():
+        return False
+    return lookup_stored_image(image_prompt) is None
+
+def generate_image_preview(prompt: str, personality: str) -> str:
+    """Fast low-res render of the same prompt, stored alongside (not instead of) the HD one"""
+    image_prompt = build_image_prompt(prompt, personality)
+    return single_flight.do("preview:" + image_flight_key(image_prompt), lambda: render_image_preview(image_prompt))
+
+def render_image_preview(image_prompt: str) -> str:
+    from openai import BadRequestError
+
+    try:
+        preview_key = f"preview:{IMAGE_PREVIEW_MODEL}:{IMAGE_PREVIEW_SIZE}:{image_prompt}"
+        digest = lookup_stored_image(preview_key)
+        if digest:
+            return stored_image_url(digest)
+
+        timings = {}
+        started = time.perf_counter()
+        with CONCURRENCY_LIMITERS["dalle"].slot(), CIRCUIT_BREAKERS["dalle"].guard():
+            response = get_clients()["openai"].images.generate(
+                model=IMAGE_PREVIEW_MODEL,
+                prompt=image_prompt,
+                size=IMAGE_PREVIEW_SIZE
+            )
+        timings["preview_generate_ms"] = (time.perf_counter() - started) * 1000
+
+        image_url = response.data[0].url
+        logger.info(f"⚡ Image preview generated: {image_url}")
+
+        started = time.perf_counter()
+        content = download_image(image_url)
+        timings["download_ms"] = (time.perf_counter() - started) * 1000
+        processed = get_image_process_pool().submit(process_image, content, IMAGE_OUTPUT_FORMAT).result()
+        return finish_rendered_image(preview_key, image_url, processed, timings)
+
+    except BadRequestError as e:
+        logger.error(f"❌ Content policy violation: {str(e)}")
+        return None
     except Exception as e:
-        logger.error(f"Crypto price error: {str(e)}")
+        logger.error(f"❌ Image preview failed: {str(e)}")
         return None
 
-# Updated DeepSeek v2 API Call
-def call_deepseek_v2(prompt: str, personality: str) -> dict:
-    """Handle DeepSeek API calls with enhanced price checking and error handling"""
+# Asynchronous image jobs: bounded pool per worker, job state in the shared store so any worker can report it
+IMAGE_JOB_WORKERS = int(os.getenv("IMAGE_JOB_WORKERS", "2"))
+IMAGE_JOBS_PER_SESSION = int(os.getenv("IMAGE_JOBS_PER_SESSION", "2"))
+IMAGE_JOB_TIMEOUT = float(os.getenv("IMAGE_JOB_TIMEOUT", "300"))
+IMAGE_JOB_RETENTION = float(os.getenv("IMAGE_JOB_RETENTION", "86400"))
+IMAGE_JOB_FINAL_STATES = {"done", "failed", "cancelled"}
+_image_executor = {"pid": None, "pool": None}
+
+def get_image_executor() -> ThreadPoolExecutor:
+    """Return this process's image worker pool (rebuilt after a fork)"""
+    if _image_executor["pid"] != os.getpid():
+        with _background_lock:
+            if _image_executor["pid"] != os.getpid():
+                _image_executor["pool"] = ThreadPoolExecutor(max_workers=IMAGE_JOB_WORKERS, thread_name_prefix="image-job")
+                _image_executor["pid"] = os.getpid()
+    return _image_executor["pool"]
+
+def active_image_jobs(db, session_id: str) -> int:
+    """Jobs of this session still queued or running (and not yet timed out)"""
+    (active,) = db.execute(
+        "SELECT COUNT(*) FROM image_jobs WHERE session_id = ? AND status IN ('queued', 'running') AND created_at > ?",
+        (session_id, time.time() - IMAGE_JOB_TIMEOUT)
+    ).fetchone()
+    return active
+
+def enqueue_image_job(session_id: str, prompt: str, personality: str, tweet: bool = False):
+    """Queue an image job; returns the job, or None when the session is at its concurrency cap"""
+    job_id = uuid.uuid4().hex
+    db = get_shared_db()
+    db.execute("BEGIN IMMEDIATE")
     try:
-        prompt_lower = prompt.lower()
-        
-        # Enhanced price check with dual verification
-        price_keywords = ["price", "value", "how much", "current", "rate", "valuation"]
-        crypto_terms = ["bitcoin", "btc", "ethereum", "eth", "solana", "sol", "crypto", "coin"]
-        
-        if any(kw in prompt_lower for kw in price_keywords) and \
-           any(term in prompt_lower for term in crypto_terms):
-            
-            logger.info(f"💰 Crypto price query detected: {prompt}")
-            prices = get_crypto_prices()
-            
-            if prices:
-                return {
-                    "text": format_price_response(prompt_lower, prices),
-                    "image": None
-                }
-            else:
-                # Provide detailed troubleshooting guidance
-                return {
-                    "text": "⚠️ Failed to fetch real-time prices. Please:\n"
-                            "1. Check your internet connection\n"
-                            "2. Visit coinmarketcap.com directly\n"
-                            "3. Try again in 30 seconds\n"
-                            "4. Contact support if issue persists",
-                    "image": None
-                }
+        if active_image_jobs(db, session_id) >= IMAGE_JOBS_PER_SESSION:
+            db.execute("ROLLBACK")
+            return None
+        db.execute(
+            "INSERT INTO image_jobs (id, session_id, owner, prompt, personality, tweet, status, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)",
+            (job_id, session_id, process_owner_id(), prompt, personality, int(bool(tweet)), time.time())
+        )
+        # Finished (or abandoned) jobs are only kept long enough for clients to collect them
+        db.execute("DELETE FROM image_jobs WHERE created_at < ?", (time.time() - IMAGE_JOB_RETENTION,))
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+    get_image_executor().submit(run_image_job, job_id)
+    logger.info(f"🎨 Image job queued: {job_id}")
+    return get_image_job(job_id)
+
+def run_image_job(job_id: str):
+    """Execute one queued job (skipped if it was cancelled while waiting)"""
+    db = get_shared_db()
+    claimed = db.execute(
+        "UPDATE image_jobs SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued'",
+        (time.time(), job_id)
+    ).rowcount
+    if not claimed:
+        return
+
+    try:
+        prompt, personality, tweet = db.execute(
+            "SELECT prompt, personality, tweet FROM image_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        image_url = generate_image(prompt, personality)
+        finished = db.execute(
+            "UPDATE image_jobs SET status = ?, image_url = ?, error = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+            ("done" if image_url else "failed", image_url, None if image_url else "Image generation failed", time.time(), job_id)
+        ).rowcount
+        if not finished:
+            logger.info(f"🛑 Image job {job_id} was cancelled while rendering; result dropped")
+            return
+        if image_url and tweet:
+            tweet_reply("🔮 Generated image for your request:")
+    except Exception as e:
+        logger.error(f"❌ Image job {job_id} failed: {str(e)}", exc_info=True)
+        db.execute(
+            "UPDATE image_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+            (str(e)[:200], time.time(), job_id)
+        )
+
+def get_image_job(job_id: str):
+    """Return the public view of a job, including its queue position while queued"""
+    db = get_shared_db()
+    row = db.execute(
+        "SELECT id, session_id, owner, status, image_url, error, created_at, started_at, finished_at FROM image_jobs WHERE id = ?",
+        (job_id,)
+    ).fetchone()
+    if not row:
+        return None
+
+    job_id, session_id, owner, status, image_url, error, created_at, started_at, finished_at = row
+    if status not in IMAGE_JOB_FINAL_STATES and created_at < time.time() - IMAGE_JOB_TIMEOUT:
+        # The worker that owned it died or hung
+        status, error = "failed", "Image job timed out"
+
+    job = {
+        "job_id": job_id,
+        "session_id": session_id,
+        "status": status,
+        "image": image_url,
+        "error": error,
+        "created_at": created_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "position": None
+    }
+    if status == "queued":
+        (ahead,) = db.execute(
+            "SELECT COUNT(*) FROM image_jobs WHERE owner = ? AND status = 'queued' AND created_at < ?",
+            (owner, created_at)
+        ).fetchone()
+        job["position"] = ahead + 1
+    return job
+
+def cancel_image_job(job_id: str) -> bool:
+    """Cancel a queued or running job; a running DALL-E call finishes but its result is dropped"""
+    return get_shared_db().execute(
+        "UPDATE image_jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+        (time.time(), job_id)
+    ).rowcount == 1
+
+def image_job_response(job: dict) -> dict:
+    """Job payload for clients, with polling and SSE URLs"""
+    payload = {key: value for key, value in job.items() if key != "session_id"}
+    payload["status_url"] = f"/images/jobs/{job['job_id']}"
+    payload["events_url"] = f"/images/jobs/{job['job_id']}/events"
+    return payload
+
+def progressive_image_reply(session_id: str, client_ip, message: str, personality: str, tweet: bool, latency_budget_ms):
+    """Preview image plus a queued HD job when the budget calls for it; None to render the usual way
+
+    The preview is a second DALL-E call, so it is charged on top of the request's image cost, and
+    skipped while the session already has an HD job on the way.
+    """
+    if not wants_image_preview(latency_budget_ms, build_image_prompt(message, personality)):
+        return None
+    if active_image_jobs(get_shared_db(), session_id):
+        return None
+    decision = take_rate_limit(session_id, client_ip, RATE_LIMIT_COSTS["preview"])
+    if decision is not None and not decision.allowed:
+        return None
+
+    preview_url = generate_image_preview(message, personality)
+    # The HD job owns the tweet so the preview is never posted
+    job = enqueue_image_job(session_id, message, personality, tweet)
+    if not preview_url and not job:
+        return None
+    return {
+        "response": "⚡ Quick preview - HD render on the way" if job else "⚡ Quick preview (HD queue is full)",
+        "image": preview_url,
+        "job": image_job_response(job) if job else None,
+        "preview": True
+    }
+
+def lookup_cached_reply(personality: str, prompt: str, request_args: dict):
+    """Exact match first, then near-duplicate; returns (cache_key, cached text or None)"""
+    cache_key = response_cache_key(personality, prompt, request_args)
+    cached = response_cache.get(cache_key)
+    # Near-duplicates are only interchangeable without earlier turns to give them context
+    if cached is None and SEMANTIC_CACHE_THRESHOLD < 1 and len(request_args["messages"]) == len(PROMPT_PREFIXES[personality]) + 1:
+        cached = semantic_cache.get(
+            personality, embed_prompt(prompt), sampling_params_key(request_args),
+            max(response_cache.invalidation_cutoff(personality), time.time() - RESPONSE_CACHE_TTL)
+        )
+        if cached is not None:
+            logger.info(f"🧠 Semantic cache hit: {prompt}")
+    return cache_key, cached
 
-        # Enhanced wallet address detection
-        wallet_keywords = ["wallet"]
-        if any(kw in prompt_lower for kw in wallet_keywords):
-            logger.info(f"🔑 Wallet query detected: {prompt}")
+def store_cached_reply(cache_key: str, personality: str, prompt: str, request_args: dict, text: str):
+    """Remember a fresh DeepSeek reply in both caches"""
+    response_cache.set(cache_key, personality, text)
+    if SEMANTIC_CACHE_THRESHOLD < 1 and len(request_args["messages"]) == len(PROMPT_PREFIXES[personality]) + 1:
+        semantic_cache.add(personality, embed_prompt(prompt), sampling_params_key(request_args), text)
+
+# Shared DeepSeek helpers (used by both the blocking and the streaming routes)
+def detect_shortcut_response(prompt: str, personality: str, intents=None):
+    """Answer price and wallet queries locally, without calling DeepSeek"""
+    prompt_lower = prompt.lower()
+    if intents is None:
+        intents = intent_router.classify(prompt)
+
+    # Enhanced price check with dual verification (a price keyword and a crypto term)
+    if "price" in intents:
+
+        logger.info(f"💰 Crypto price query detected: {prompt}")
+        prices = get_crypto_prices()
+
+        if prices:
             return {
-                "text": PERSONALITIES.get(personality, PERSONALITIES["default"])["wallet_response"],
+                "text": format_price_response(prompt_lower, prices),
                 "image": None
             }
-
-        # Prepare DeepSeek request with improved security
-        headers = {
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-            "Content-Type": "application/json",
-            "Accept": "application/vnd.deepseek.v2+json",
-            "User-Agent": "CryptoAI/1.0 (+https://yourdomain.com)"
+        # Provide detailed troubleshooting guidance
+        return {
+            "text": "⚠️ Failed to fetch real-time prices. Please:\n"
+                    "1. Check your internet connection\n"
+                    "2. Visit coinmarketcap.com directly\n"
+                    "3. Try again in 30 seconds\n"
+                    "4. Contact support if issue persists",
+            "image": None
         }
-        
-        payload = {
-    "model": "deepseek-chat",  # Example alternative model name
-    "messages": [
-        {"role": "system", "content": PERSONALITIES[personality]["system_prompt"]},
-        {"role": "user", "content": prompt},
-    ],
-    "temperature": 0.7,
-    "max_tokens": 1000,
-    "top_p": 0.9,
-    "frequency_penalty": 0.5,
-    "presence_penalty": 0.5
-}
 
-        # Add request signature for security
-        response = requests.post(
-            DEEPSEEK_API_URL,
-            json=payload,
-            headers=headers,
-            timeout=10  # Reduced timeout for better failover
-        )
-        
-        # Validate response structure
-        response.raise_for_status()
-        response_data = response.json()
-        
-        if not isinstance(response_data.get("choices"), list) or len(response_data["choices"]) == 0:
-            raise ValueError("Invalid response structure from DeepSeek API")
-            
+    # Enhanced wallet address detection
+    if "wallet" in intents:
+        logger.info(f"🔑 Wallet query detected: {prompt}")
         return {
-            "text": response_data["choices"][0]["message"]["content"],
+            "text": PERSONALITIES.get(personality, PERSONALITIES["default"])["wallet_response"],
             "image": None
         }
-        
-    except requests.exceptions.HTTPError as e:
-        logger.error(f"DeepSeek API Error {e.response.status_code}: {e.response.text[:200]}")
+
+    return None
+
+# DeepSeek caches prompt prefixes that are byte-identical across requests, so everything fixed
+# for a personality is built once up front and anything that varies goes after it
+PROMPT_PREFIXES = {
+    name: ({"role": "system", "content": persona["system_prompt"]},)
+    for name, persona in PERSONALITIES.items()
+}
+
+class PromptCacheStats:
+    """DeepSeek prompt-cache hit/miss tokens per personality"""
+
+    def __init__(self):
+        self.personalities = {}
+        self.lock = threading.Lock()
+
+    def record(self, personality: str, usage):
+        """Add one response's usage (DeepSeek reports prompt_cache_hit_tokens / prompt_cache_miss_tokens)"""
+        hit = getattr(usage, "prompt_cache_hit_tokens", None)
+        miss = getattr(usage, "prompt_cache_miss_tokens", None)
+        if hit is None and miss is None:
+            return
+        with self.lock:
+            requests, hit_total, miss_total = self.personalities.get(personality, (0, 0, 0))
+            self.personalities[personality] = (requests + 1, hit_total + (hit or 0), miss_total + (miss or 0))
+
+    def stats(self) -> dict:
+        with self.lock:
+            counters = dict(self.personalities)
+        totals = [sum(column) for column in zip(*counters.values())] or [0, 0, 0]
+
+        def summary(requests, hit, miss):
+            return {
+                "requests": requests,
+                "hit_tokens": hit,
+                "miss_tokens": miss,
+                "hit_rate": round(hit / (hit + miss), 3) if hit + miss else None
+            }
+
         return {
-            "text": "⚠️ System overloaded - please try again in 30 seconds" if e.response.status_code == 429
-            else "⚠️ Temporary service disruption - our engineers are on it!",
-            "image": None
+            "total": summary(*totals),
+            "personalities": {name: summary(*values) for name, values in sorted(counters.items())}
         }
-        
-    except (requests.Timeout, requests.ConnectionError):
+
+prompt_cache_stats = PromptCacheStats()
+
+# Reply length policy: output length dominates DeepSeek latency, so cap it per request
+REPLY_TOKENS_BRIEF = int(os.getenv("REPLY_TOKENS_BRIEF", "150"))
+REPLY_TOKENS_DEFAULT = int(os.getenv("REPLY_TOKENS_DEFAULT", "400"))
+REPLY_TOKENS_LONG = int(os.getenv("REPLY_TOKENS_LONG", "1000"))
+REPLY_TOKENS_MIN = 64
+REPLY_SHORT_PROMPT_TOKENS = 6  # "gm", "wen moon?" and other one-liners get a brief cap
+REPLY_MS_PER_TOKEN = float(os.getenv("REPLY_MS_PER_TOKEN", "40"))  # until real reply timings exist
+REPLY_BREVITY_HINTS = os.getenv("REPLY_BREVITY_HINTS", "true").lower() == "true"
+# Terse characters need fewer tokens than the ones who lecture
+PERSONALITY_LENGTH_SCALE = {
+    "hacker": 0.7, "robot": 0.7, "gamer": 0.8, "comedian": 0.8,
+    "scientist": 1.3, "philosopher": 1.2, "wizard": 1.1
+}
+
+class LengthPlan:
+    """max_tokens for one reply, why it was chosen and the brevity instruction to append"""
+
+    __slots__ = ("max_tokens", "label", "instruction")
+
+    def __init__(self, max_tokens: int, label: str, instruction: str = ""):
+        self.max_tokens = max_tokens
+        self.label = label
+        self.instruction = instruction
+
+class ReplyLengthStats:
+    """Realized completion lengths per policy label, plus the observed milliseconds per token"""
+
+    def __init__(self, ms_per_token: float):
+        self.labels = {}
+        self.ms_per_token = ms_per_token
+        self.lock = threading.Lock()
+
+    def record(self, plan: LengthPlan, personality: str, usage, finish_reason, elapsed_ms: float, generation_ms: float = None):
+        """Add one finished reply; generation_ms runs from its first token to its last"""
+        tokens = getattr(usage, "completion_tokens", None)
+        if not tokens:
+            return
+        truncated = finish_reason == "length"
+        with self.lock:
+            count, total, caps, cut = self.labels.get(plan.label, (0, 0, 0, 0))
+            self.labels[plan.label] = (count + 1, total + tokens, caps + plan.max_tokens, cut + truncated)
+            # Generation speed only: the wait for the first token says nothing about how long a reply takes to write
+            if generation_ms is not None and tokens > 1:
+                self.ms_per_token = 0.9 * self.ms_per_token + 0.1 * (generation_ms / (tokens - 1))
+        logger.info(
+            f"📏 Reply length: {tokens}/{plan.max_tokens} tokens ({plan.label}, {personality})"
+            f"{' - truncated' if truncated else ''} in {elapsed_ms:.0f}ms"
+        )
+
+    def expected_tokens(self, plan: LengthPlan) -> int:
+        """Average realized length for the plan's label, or its cap before any were seen"""
+        with self.lock:
+            count, total, _, _ = self.labels.get(plan.label, (0, 0, 0, 0))
+        return round(total / count) if count else plan.max_tokens
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "ms_per_token": round(self.ms_per_token, 1),
+                "labels": {
+                    label: {
+                        "count": count,
+                        "avg_tokens": round(total / count, 1),
+                        "avg_max_tokens": round(caps / count, 1),
+                        "truncated": cut
+                    }
+                    for label, (count, total, caps, cut) in self.labels.items()
+                }
+            }
+
+reply_length_stats = ReplyLengthStats(REPLY_MS_PER_TOKEN)
+
+# Client disconnects: stop generating (and paying for) replies nobody will read
+def client_disconnected(environ) -> bool:
+    """True once the WSGI client has closed its socket (peeks, so pipelined bytes stay unread)"""
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except (BlockingIOError, InterruptedError):
+        return False
+    except ValueError:
+        return False  # TLS sockets refuse recv flags; terminate TLS at the proxy to get detection
+    except OSError:
+        return True
+
+class AbortStats:
+    """DeepSeek calls skipped or cut short because the client left, and the completion tokens that saved"""
+
+    def __init__(self):
+        self.counters = {"skipped": 0, "aborted": 0, "tokens_generated": 0, "tokens_saved": 0}
+        self.lock = threading.Lock()
+
+    def skip(self, plan: LengthPlan):
+        saved = reply_length_stats.expected_tokens(plan)
+        with self.lock:
+            self.counters["skipped"] += 1
+            self.counters["tokens_saved"] += saved
+        logger.info(f"✂️ Client left before the DeepSeek call started (~{saved} tokens saved)")
+
+    def abort(self, plan: LengthPlan, generated: int):
+        # A reply stops at its natural length, so the saving is what this kind of reply usually runs to
+        saved = max(0, reply_length_stats.expected_tokens(plan) - generated)
+        with self.lock:
+            self.counters["aborted"] += 1
+            self.counters["tokens_generated"] += generated
+            self.counters["tokens_saved"] += saved
+        logger.info(f"✂️ DeepSeek stream aborted after ~{generated} tokens (~{saved} saved)")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+abort_stats = AbortStats()
+
+def plan_reply_length(prompt: str, personality: str, intents=None, latency_budget_ms=None) -> LengthPlan:
+    """Pick max_tokens from the intent, the prompt length, the personality and the client's latency budget"""
+    if intents is None:
+        intents = intent_router.classify(prompt)
+    if "brief" in intents:
+        label, tokens = "brief", REPLY_TOKENS_BRIEF
+    elif "long_form" in intents:
+        label, tokens = "long", REPLY_TOKENS_LONG
+    elif estimate_tokens(prompt) <= REPLY_SHORT_PROMPT_TOKENS:
+        label, tokens = "short", REPLY_TOKENS_BRIEF
+    else:
+        label, tokens = "default", REPLY_TOKENS_DEFAULT
+    tokens *= PERSONALITY_LENGTH_SCALE.get(personality, 1.0)
+
+    if latency_budget_ms is not None:
+        affordable = latency_budget_ms / reply_length_stats.ms_per_token
+        if affordable < tokens:
+            label, tokens = f"{label}+budget", affordable
+
+    tokens = max(REPLY_TOKENS_MIN, min(int(tokens), REPLY_TOKENS_LONG))
+    instruction = ""
+    if REPLY_BREVITY_HINTS and tokens < REPLY_TOKENS_LONG:
+        # ~0.75 words per token, with headroom so the reply ends before the cap cuts it off
+        instruction = f"\n\n(Keep your reply under {max(10, int(tokens * 0.6) // 10 * 10)} words.)"
+    return LengthPlan(tokens, label, instruction)
+
+def build_deepseek_request(prompt: str, personality: str, history=(), plan: LengthPlan = None) -> dict:
+    """Build the DeepSeek chat-completion arguments: the personality's fixed prefix, earlier turns (oldest first), then the prompt
+
+    The length plan only touches the tail (the brevity instruction rides on the
+    user message), so it never breaks the cached prefix.
+    """
+    if plan is None:
+        plan = LengthPlan(REPLY_TOKENS_LONG, "unplanned")
+    return {
+        "model": "deepseek-chat",  # Example alternative model name
+        "messages": [
+            *PROMPT_PREFIXES[personality],
+            *({"role": message.role, "content": message.content} for message in history),
+            {"role": "user", "content": prompt + plan.instruction},
+        ],
+        "temperature": 0.7,
+        "max_tokens": plan.max_tokens,
+        "top_p": 0.9,
+        "frequency_penalty": 0.5,
+        "presence_penalty": 0.5
+    }
+
+def deepseek_error_text(error: Exception) -> str:
+    """Map a DeepSeek failure to the message shown to the user"""
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+    if isinstance(error, ClientDisconnected):
+        return "⚠️ Request cancelled - the client disconnected"
+
+    if isinstance(error, CircuitOpenError):
+        logger.warning(f"DeepSeek call refused: {str(error)}")
+        return "⚠️ Temporary service disruption - our engineers are on it!"
+
+    if isinstance(error, QuotaExceeded):
+        logger.warning(f"DeepSeek call refused: {str(error)}")
+        return "⚠️ Daily token quota reached - come back tomorrow (UTC)"
+
+    if isinstance(error, LimiterTimeout):
+        logger.warning(f"DeepSeek call shed: {str(error)}")
+        return "⚠️ System overloaded - please try again in 30 seconds"
+
+    if isinstance(error, APIStatusError):
+        logger.error(f"DeepSeek API Error {error.status_code}: {error.response.text[:200]}")
+        if error.status_code == 429:
+            return "⚠️ System overloaded - please try again in 30 seconds"
+        return "⚠️ Temporary service disruption - our engineers are on it!"
+
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
         logger.error("Network failure during DeepSeek API call")
+        return "⚠️ Network connection failed - check your internet"
+
+    logger.error(f"Unexpected error in DeepSeek call: {str(error)}", exc_info=error)
+    return "⚠️ Critical system error - administrators have been notified"
+
+# Chat providers: DeepSeek first, hedged onto a second OpenAI-compatible provider when its first token is late
+HEDGE_PROVIDER = os.getenv("HEDGE_PROVIDER", "openai")  # empty disables hedging
+HEDGE_OPENAI_MODEL = os.getenv("HEDGE_OPENAI_MODEL", "gpt-4o-mini")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))  # of DeepSeek's recent first-token times
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", "2000"))  # until HEDGE_MIN_SAMPLES first tokens were timed
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "300"))
+HEDGE_MAX_DELAY_MS = float(os.getenv("HEDGE_MAX_DELAY_MS", "5000"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", str(UPSTREAM_POOL_SIZE * 2)))
+
+class ChatProvider:
+    """An OpenAI-compatible chat upstream: the pooled client to use and the model to ask for"""
+
+    __slots__ = ("name", "model")
+
+    def __init__(self, name: str, model: str):
+        self.name = name
+        self.model = model
+
+    def request_args(self, request_args: dict) -> dict:
+        return {**request_args, "model": self.model}
+
+CHAT_PROVIDERS = {
+    "deepseek": ChatProvider("deepseek", "deepseek-chat"),
+    "openai": ChatProvider("openai", HEDGE_OPENAI_MODEL)
+}
+if HEDGE_PROVIDER and HEDGE_PROVIDER not in CHAT_PROVIDERS:
+    raise ValueError(f"❌ HEDGE_PROVIDER must be empty or one of {', '.join(CHAT_PROVIDERS)}")
+
+class ProviderStats:
+    """Calls, wins, errors and first-token latency per chat provider"""
+
+    def __init__(self, window: int):
+        self.counters = {}
+        self.first_token_ms = {}
+        self.window = window
+        self.lock = threading.Lock()
+
+    def count(self, provider: str, event: str):
+        with self.lock:
+            counters = self.counters.setdefault(
+                provider, {"calls": 0, "hedges": 0, "wins": 0, "cancelled": 0, "errors": 0, "short_circuited": 0}
+            )
+            counters[event] += 1
+
+    def observe(self, provider: str, ms: float):
+        with self.lock:
+            self.first_token_ms.setdefault(provider, deque(maxlen=self.window)).append(ms)
+
+    def percentile(self, provider: str, fraction: float):
+        with self.lock:
+            samples = sorted(self.first_token_ms.get(provider, ()))
+        return samples[int(fraction * (len(samples) - 1))] if samples else None
+
+    def hedge_delay_ms(self) -> float:
+        """HEDGE_PERCENTILE of DeepSeek's recent first-token times, clamped to the configured range"""
+        with self.lock:
+            enough = len(self.first_token_ms.get("deepseek", ())) >= HEDGE_MIN_SAMPLES
+        delay = self.percentile("deepseek", HEDGE_PERCENTILE) if enough else HEDGE_DELAY_MS
+        return min(max(delay, HEDGE_MIN_DELAY_MS), HEDGE_MAX_DELAY_MS)
+
+    def stats(self) -> dict:
+        with self.lock:
+            providers = {name: dict(counters) for name, counters in self.counters.items()}
+        for name, counters in providers.items():
+            p50, p90 = self.percentile(name, 0.5), self.percentile(name, 0.9)
+            counters["first_token_p50_ms"] = round(p50, 1) if p50 is not None else None
+            counters["first_token_p90_ms"] = round(p90, 1) if p90 is not None else None
+        return {"hedge_provider": HEDGE_PROVIDER or None, "hedge_delay_ms": round(self.hedge_delay_ms(), 1), "providers": providers}
+
+provider_stats = ProviderStats(HEDGE_WINDOW)
+_hedge_executor = {"pid": None, "pool": None}
+
+def get_hedge_executor() -> ThreadPoolExecutor:
+    """Return this process's pool for opening provider streams (rebuilt after a fork)"""
+    if _hedge_executor["pid"] != os.getpid():
+        with _background_lock:
+            if _hedge_executor["pid"] != os.getpid():
+                _hedge_executor["pool"] = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="chat-hedge")
+                _hedge_executor["pid"] = os.getpid()
+    return _hedge_executor["pool"]
+
+class StreamAttempt:
+    """One provider's streamed completion, read up to its first token
+
+    The provider's concurrency slot is held until the stream is closed (or the attempt cancelled).
+    """
+
+    def __init__(self, provider: ChatProvider, request_args: dict, hedge: bool = False):
+        self.provider = provider
+        self.request_args = provider.request_args(request_args)
+        self.limiter = CONCURRENCY_LIMITERS[provider.name]
+        self.stream = None
+        self.iterator = None
+        self.buffered = []
+        self.cancelled = threading.Event()
+        self.holding = False
+        self.slot_lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.admitted = None
+        provider_stats.count(provider.name, "hedges" if hedge else "calls")
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def upstream_ms(self):
+        """Time since the call left the concurrency queue: what the provider itself took (None while queued)"""
+        if self.admitted is None:
+            return None
+        return (time.perf_counter() - self.admitted) * 1000
+
+    def create_args(self) -> dict:
+        return {**self.request_args, "stream": True, "stream_options": {"include_usage": True}}
+
+    def first_chunk(self, chunk) -> bool:
+        self.buffered.append(chunk)
+        return bool(chunk.choices and chunk.choices[0].delta.content)
+
+    def admit(self):
+        self.holding = True
+        self.admitted = time.perf_counter()
+
+    def release_slot(self):
+        """Give the concurrency slot back, once, whoever gets here first"""
+        with self.slot_lock:
+            holding, self.holding = self.holding, False
+        if holding:
+            self.limiter.release()
+
+    def open(self):
+        """Start the stream and buffer chunks up to the first content delta (runs in the hedge pool)"""
+        self.limiter.acquire()
+        self.admit()
+        if self.cancelled.is_set():
+            self.release_slot()  # the race was settled while this attempt queued
+            return self
+        breaker = CIRCUIT_BREAKERS[self.provider.name]
+        try:
+            probe = breaker.acquire()
+        except CircuitOpenError:
+            self.release_slot()
+            raise
+        try:
+            self.stream = get_clients()[self.provider.name].chat.completions.create(**self.create_args())
+            if self.cancelled.is_set():
+                self.stream.close()
+                breaker.release(probe)
+                self.release_slot()
+                return self
+            self.iterator = iter(self.stream)
+            for chunk in self.iterator:
+                if self.first_chunk(chunk):
+                    break
+        except Exception as e:
+            if self.cancelled.is_set():
+                breaker.release(probe)  # we closed it: says nothing about the provider
+            else:
+                breaker.record(probe, breaker.is_fault(e), self.upstream_ms())
+                self.limiter.record(error=e)
+            self.release_slot()
+            raise
+        breaker.record(probe, False, self.upstream_ms())
+        self.limiter.record(self.upstream_ms())
+        return self
+
+    async def open_async(self):
+        """Async variant of open(); cancelling the task closes the stream"""
+        await self.limiter.acquire_async()
+        self.admit()
+        try:
+            with CIRCUIT_BREAKERS[self.provider.name].guard():
+                self.stream = await get_async_clients()[self.provider.name].chat.completions.create(**self.create_args())
+                try:
+                    self.iterator = self.stream.__aiter__()
+                    async for chunk in self.iterator:
+                        if self.first_chunk(chunk):
+                            break
+                except asyncio.CancelledError:
+                    await self.stream.close()
+                    raise
+        except BaseException as e:
+            if isinstance(e, Exception):
+                self.limiter.record(error=e)
+            self.release_slot()
+            raise
+        self.limiter.record(self.upstream_ms())
+        return self
+
+    def cancel(self):
+        """Stop a losing attempt; closing its connection stops the provider generating"""
+        self.cancelled.set()
+        if self.stream is not None:
+            self.stream.close()
+        self.release_slot()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+        self.release_slot()
+
+    async def close_async(self):
+        if self.stream is not None:
+            await self.stream.close()
+        self.release_slot()
+
+    def chunks(self):
+        yield from self.buffered
+        yield from self.iterator
+
+    async def chunks_async(self):
+        for chunk in self.buffered:
+            yield chunk
+        async for chunk in self.iterator:
+            yield chunk
+
+def settle_hedge(winner: StreamAttempt, losers) -> StreamAttempt:
+    """Record the race result; a cancelled DeepSeek attempt still tells us its first token took at least this long
+
+    First-token times are measured from admission, so time spent queued for a concurrency slot
+    doesn't inflate the hedge delay.
+    """
+    provider_stats.count(winner.provider.name, "wins")
+    provider_stats.observe(winner.provider.name, winner.upstream_ms())
+    for loser in losers:
+        provider_stats.count(loser.provider.name, "cancelled")
+        upstream_ms = loser.upstream_ms()
+        if loser.provider.name == "deepseek" and upstream_ms is not None:
+            provider_stats.observe("deepseek", upstream_ms)
+    if winner.provider.name != "deepseek":
+        logger.info(f"🏁 {winner.provider.name} answered first ({winner.elapsed_ms():.0f}ms)")
+    return winner
+
+# Failures that never reached the provider
+SHED_ERRORS = (CircuitOpenError, LimiterTimeout)
+
+def open_chat_stream(request_args: dict) -> StreamAttempt:
+    """Open DeepSeek's stream; if it has no first token by the hedge delay (or fails), race HEDGE_PROVIDER too
+
+    Whichever first token arrives first wins and the other attempt is closed.
+    """
+    primary = StreamAttempt(CHAT_PROVIDERS["deepseek"], request_args)
+    # A paused or saturated DeepSeek would only queue: hedge right away instead of after the delay
+    hedge_delay = 0 if primary.limiter.congested() else provider_stats.hedge_delay_ms() / 1000
+    pool = get_hedge_executor()
+    attempts = {pool.submit(primary.open): primary}
+    hedged = not HEDGE_PROVIDER
+    error = None
+    while attempts:
+        done, _ = wait(attempts, timeout=None if hedged else hedge_delay, return_when=FIRST_COMPLETED)
+        for future in done:
+            attempt = attempts.pop(future)
+            if future.exception() is None:
+                for loser in attempts.values():
+                    loser.cancel()
+                return settle_hedge(attempt, attempts.values())
+            error = future.exception()
+            provider_stats.count(attempt.provider.name, "short_circuited" if isinstance(error, SHED_ERRORS) else "errors")
+        if not hedged:
+            # DeepSeek is late, failed or behind an open breaker: ask the other provider as well
+            hedged = True
+            hedge = StreamAttempt(CHAT_PROVIDERS[HEDGE_PROVIDER], request_args, hedge=True)
+            attempts[pool.submit(hedge.open)] = hedge
+    raise error
+
+async def open_chat_stream_async(request_args: dict) -> StreamAttempt:
+    """Async variant of open_chat_stream"""
+    primary = StreamAttempt(CHAT_PROVIDERS["deepseek"], request_args)
+    hedge_delay = 0 if primary.limiter.congested() else provider_stats.hedge_delay_ms() / 1000
+    attempts = {asyncio.ensure_future(primary.open_async()): primary}
+    hedged = not HEDGE_PROVIDER
+    error = None
+    try:
+        while attempts:
+            done, _ = await asyncio.wait(
+                attempts, timeout=None if hedged else hedge_delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                attempt = attempts.pop(task)
+                if task.exception() is None:
+                    for loser_task, loser in attempts.items():
+                        if loser_task.done() and not loser_task.cancelled() and loser_task.exception() is None:
+                            await loser.close_async()  # opened in the same instant: already holds a stream
+                        else:
+                            loser_task.cancel()
+                    return settle_hedge(attempt, list(attempts.values()))
+                error = task.exception()
+                provider_stats.count(attempt.provider.name, "short_circuited" if isinstance(error, SHED_ERRORS) else "errors")
+            if not hedged:
+                hedged = True
+                hedge = StreamAttempt(CHAT_PROVIDERS[HEDGE_PROVIDER], request_args, hedge=True)
+                attempts[asyncio.ensure_future(hedge.open_async())] = hedge
+        raise error
+    finally:
+        # Our own caller was cancelled (client left): take every attempt down with it
+        for task in attempts:
+            task.cancel()
+
+# Updated DeepSeek v2 API Call
+def call_deepseek_v2(prompt: str, personality: str, use_cache: bool = True, intents=None, session_id=None,
+                     latency_budget_ms=None, disconnected=None) -> dict:
+    """Handle DeepSeek API calls with enhanced price checking and error handling
+
+    disconnected() is polled while the reply streams in; once it returns True
+    (and no other request shares the call) the upstream call is abandoned.
+    """
+    try:
+        if intents is None:
+            intents = intent_router.classify(prompt)
+        shortcut = detect_shortcut_response(prompt, personality, intents)
+        if shortcut:
+            return shortcut
+
+        plan = plan_reply_length(prompt, personality, intents, latency_budget_ms)
+        history = load_history(session_id, personality)
+        request_args = build_deepseek_request(prompt, personality, history, plan)
+        if use_cache:
+            cache_key, cached = lookup_cached_reply(personality, prompt, request_args)
+            if cached is not None:
+                remember_turn(session_id, personality, prompt, cached)
+                return {"text": cached, "image": None}
+        else:
+            cache_key = response_cache_key(personality, prompt, request_args)
+
+        flight_key = f"chat:{cache_key}"
+
+        def client_gone() -> bool:
+            return disconnected is not None and disconnected() and not (use_cache and single_flight.has_followers(flight_key))
+
+        def fetch():
+            if client_gone():
+                abort_stats.skip(plan)
+                raise ClientDisconnected()
+            # Streamed even though the caller wants the whole reply, so a departed client can stop it mid-generation
+            parts = []
+            deltas = stream_deepseek_v2(prompt, personality, history, plan, session_id)
+            try:
+                for delta in deltas:
+                    parts.append(delta)
+                    if client_gone():
+                        raise ClientDisconnected()
+            finally:
+                deltas.close()
+
+            # Validate response structure
+            text = "".join(parts)
+            if not text:
+                raise ValueError("Empty response from DeepSeek API")
+            if use_cache:
+                store_cached_reply(cache_key, personality, prompt, request_args, text)
+            return text
+
+        # Checked per caller: a session over its quota must not ride along on someone else's call either
+        check_token_quota(session_id)
+        # Identical concurrent prompts wait on one upstream call; a cache opt-out always makes its own
+        text = single_flight.do(flight_key, fetch) if use_cache else fetch()
+        remember_turn(session_id, personality, prompt, text)
+        return {"text": text, "image": None}
+        
+    except Exception as e:
         return {
-            "text": "⚠️ Network connection failed - check your internet",
+            "text": deepseek_error_text(e),
             "image": None
         }
-        
+
+def stream_deepseek_v2(prompt: str, personality: str, history=(), plan: LengthPlan = None, session_id=None):
+    """Yield completion deltas as they arrive (stream=True), from DeepSeek or the hedge provider if it answers first"""
+    plan = plan or plan_reply_length(prompt, personality)
+    started = time.perf_counter()
+    request_args = build_deepseek_request(prompt, personality, history, plan)
+    attempt = open_chat_stream(request_args)
+    usage = finish_reason = first_token_at = last_token_at = None
+    received = 0
+    try:
+        for chunk in attempt.chunks():
+            if chunk.usage is not None:
+                # Sent once, in a final chunk without choices
+                usage = chunk.usage
+                prompt_cache_stats.record(personality, usage)
+                usage_ledger.record(
+                    session_id, personality, getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+                )
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content
+            if delta:
+                last_token_at = time.perf_counter()
+                first_token_at = first_token_at or last_token_at
+                received += len(delta)
+                yield delta
+        reply_length_stats.record(
+            plan, personality, usage, finish_reason, (time.perf_counter() - started) * 1000,
+            (last_token_at - first_token_at) * 1000 if first_token_at else None
+        )
+    except GeneratorExit:
+        # Closed before the end: the client left, and closing the stream stops the provider generating
+        abort_stats.abort(plan, received // 4)
+        if usage is None:
+            usage_ledger.record(session_id, personality, estimate_request_tokens(request_args), received // 4, estimated=True)
+        raise
+    finally:
+        # Releases the pooled connection even when the client goes away mid-stream
+        attempt.close()
+
+async def call_deepseek_async(prompt: str, personality: str, use_cache: bool = True, intents=None, session_id=None,
+                              latency_budget_ms=None, disconnected=None) -> dict:
+    """Async variant of call_deepseek_v2 for the ASGI app"""
+    try:
+        if intents is None:
+            intents = intent_router.classify(prompt)
+        # Price lookups may still hit the network, keep them off the event loop
+        shortcut = await asyncio.to_thread(detect_shortcut_response, prompt, personality, intents)
+        if shortcut:
+            return shortcut
+
+        plan = plan_reply_length(prompt, personality, intents, latency_budget_ms)
+        history = await asyncio.to_thread(load_history, session_id, personality)
+        request_args = build_deepseek_request(prompt, personality, history, plan)
+        if use_cache:
+            cache_key, cached = lookup_cached_reply(personality, prompt, request_args)
+            if cached is not None:
+                await asyncio.to_thread(remember_turn, session_id, personality, prompt, cached)
+                return {"text": cached, "image": None}
+        else:
+            cache_key = response_cache_key(personality, prompt, request_args)
+
+        flight_key = f"chat:{cache_key}"
+
+        def client_gone() -> bool:
+            return disconnected is not None and disconnected() and not (use_cache and single_flight.has_followers(flight_key))
+
+        async def fetch():
+            if client_gone():
+                abort_stats.skip(plan)
+                raise ClientDisconnected()
+            parts = []
+            deltas = stream_deepseek_async(prompt, personality, history, plan, session_id)
+            try:
+                async for delta in deltas:
+                    parts.append(delta)
+                    if client_gone():
+                        raise ClientDisconnected()
+            finally:
+                await deltas.aclose()
+
+            text = "".join(parts)
+            if not text:
+                raise ValueError("Empty response from DeepSeek API")
+            if use_cache:
+                store_cached_reply(cache_key, personality, prompt, request_args, text)
+            return text
+
+        await asyncio.to_thread(check_token_quota, session_id)
+        text = await (single_flight.do_async(flight_key, fetch) if use_cache else fetch())
+        await asyncio.to_thread(remember_turn, session_id, personality, prompt, text)
+        return {"text": text, "image": None}
+
     except Exception as e:
-        logger.error(f"Unexpected error in call_deepseek_v2: {str(e)}", exc_info=True)
         return {
-            "text": "⚠️ Critical system error - administrators have been notified",
+            "text": deepseek_error_text(e),
             "image": None
         }
-def post_tweet(message: str):
+
+async def stream_deepseek_async(prompt: str, personality: str, history=(), plan: LengthPlan = None, session_id=None):
+    """Async variant of stream_deepseek_v2"""
+    plan = plan or plan_reply_length(prompt, personality)
+    started = time.perf_counter()
+    request_args = build_deepseek_request(prompt, personality, history, plan)
+    attempt = None
+    usage = finish_reason = first_token_at = last_token_at = None
+    received = 0
     try:
-        tweet = twitter_api.update_status(status=message)
-        print(f"Tweet posted successfully: {tweet.id}")
-        return tweet
-    except Exception as e:
-        print(f"Error posting tweet: {str(e)}")
-        return None
+        # Inside the try: a client that leaves before the first token is an abort too
+        attempt = await open_chat_stream_async(request_args)
+        async for chunk in attempt.chunks_async():
+            if chunk.usage is not None:
+                usage = chunk.usage
+                prompt_cache_stats.record(personality, usage)
+                usage_ledger.record(
+                    session_id, personality, getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+                )
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content
+            if delta:
+                last_token_at = time.perf_counter()
+                first_token_at = first_token_at or last_token_at
+                received += len(delta)
+                yield delta
+        reply_length_stats.record(
+            plan, personality, usage, finish_reason, (time.perf_counter() - started) * 1000,
+            (last_token_at - first_token_at) * 1000 if first_token_at else None
+        )
+    except (GeneratorExit, asyncio.CancelledError):
+        abort_stats.abort(plan, received // 4)
+        if usage is None and attempt is not None:
+            usage_ledger.record(session_id, personality, estimate_request_tokens(request_args), received // 4, estimated=True)
+        raise
+    finally:
+        if attempt is not None:
+            await attempt.close_async()
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 # Example usage within a Flask route:
 @app.route("/tweet", methods=["POST"])
+@rate_limited(RATE_LIMIT_COSTS["tweet"])
 def tweet():
     data = request.get_json()
     if not data or "message" not in data:
         return jsonify({"error": "No message provided"}), 400
-    message = data["message"]
-    tweet = post_tweet(message)
-    if tweet:
-        return jsonify({"message": "Tweet posted successfully", "tweet_id": tweet.id})
-    else:
-        return jsonify({"error": "Tweet failed"}), 500    
+    if not TWITTER_CONFIGURED:
+        return jsonify({"error": "Twitter is not configured"}), 503
+    queued = post_tweet(data["message"])
+    if not queued:
+        return jsonify({"error": "Empty tweet"}), 400
+    return jsonify({"message": "Tweet queued", **queued}), 202
     
-def get_crypto_prices():
-    """Fetch crypto prices with enhanced error handling"""
+def fetch_crypto_prices():
+    """Fetch crypto prices from CoinGecko with enhanced error handling"""
     try:
         logger.info("🔄 Fetching crypto prices from CoinGecko...")
         params = {
@@ -398,14 +1703,16 @@ def get_crypto_prices():
             "include_last_updated_at": True
         }
         
-        response = requests.get(
-            COINGECKO_URL,
-            headers={"User-Agent": "CryptoAI/1.0"},
-            params=params,
-            timeout=8
-        )
-        response.raise_for_status()
-        data = response.json()
+        # While the breaker is open this fails fast and readers keep the last snapshot
+        with CIRCUIT_BREAKERS["coingecko"].guard():
+            response = http_session.get(
+                COINGECKO_URL,
+                headers={"User-Agent": "CryptoAI/1.0"},
+                params=params,
+                timeout=8
+            )
+            response.raise_for_status()
+            data = response.json()
         
         prices = {}
         for crypto, symbol in CRYPTO_IDS.items():
@@ -421,11 +1728,147 @@ def get_crypto_prices():
         
         logger.info(f"✅ Successfully fetched prices: {prices}")
         return prices
-    
+
+    except CircuitOpenError as e:
+        logger.warning(f"⚠️ Crypto price fetch skipped: {str(e)}")
+        return None
     except Exception as e:
         logger.error(f"⚠️ Crypto price error: {str(e)}", exc_info=True)
         return None
-    
+
+def publish_price_snapshot(prices: dict):
+    """Store the latest prices where every worker can read them"""
+    get_shared_db().execute(
+        "INSERT OR REPLACE INTO price_snapshot (id, payload, fetched_at) VALUES (1, ?, ?)",
+        (json.dumps(prices), time.time())
+    )
+
+def read_price_snapshot():
+    """Return (prices, fetched_at) from the shared store, or (None, 0)"""
+    row = get_shared_db().execute("SELECT payload, fetched_at FROM price_snapshot WHERE id = 1").fetchone()
+    return (json.loads(row[0]), row[1]) if row else (None, 0.0)
+
+def refresh_price_snapshot() -> bool:
+    """Poll CoinGecko once and publish the result; keeps the old snapshot on failure"""
+    prices = fetch_crypto_prices()
+    if not prices:
+        return False
+    publish_price_snapshot(prices)
+    return True
+
+def price_refresher_loop():
+    """Background refresher: only the worker holding the lease polls CoinGecko"""
+    while True:
+        try:
+            if acquire_lease("price_refresher", PRICE_REFRESH_INTERVAL * 3):
+                _, fetched_at = read_price_snapshot()
+                if time.time() - fetched_at >= PRICE_REFRESH_INTERVAL * 0.9:
+                    refresh_price_snapshot()
+        except Exception as e:
+            logger.error(f"⚠️ Price refresher error: {str(e)}", exc_info=True)
+        _price_refresh_wakeup.wait(PRICE_REFRESH_INTERVAL)
+        _price_refresh_wakeup.clear()
+
+def get_crypto_prices():
+    """Return the shared price snapshot (stale-while-revalidate, no network on the hot path)"""
+    ensure_background_thread("price-refresher", price_refresher_loop)
+    now = time.time()
+
+    # Re-read the shared store at most once per PRICE_LOCAL_TTL; otherwise answer from memory
+    if now - _price_cache["checked_at"] >= PRICE_LOCAL_TTL:
+        try:
+            prices, fetched_at = read_price_snapshot()
+            if prices:
+                _price_cache.update(prices=prices, fetched_at=fetched_at)
+        except Exception as e:
+            logger.error(f"⚠️ Price snapshot read error: {str(e)}")
+        _price_cache["checked_at"] = now
+
+    if _price_cache["prices"] is None:
+        # Cold start: nobody has published yet, fetch once synchronously
+        with _price_lock:
+            if _price_cache["prices"] is None and refresh_price_snapshot():
+                prices, fetched_at = read_price_snapshot()
+                _price_cache.update(prices=prices, fetched_at=fetched_at, checked_at=now)
+    elif now - _price_cache["fetched_at"] > PRICE_REFRESH_INTERVAL * 2:
+        # Serve the stale snapshot (CoinGecko may be down) and nudge the refresher
+        _price_refresh_wakeup.set()
+
+    return _price_cache["prices"]
+
+class PriceSubscriber:
+    """Pending price deltas for one /prices/stream client (later changes overwrite earlier ones)"""
+
+    def __init__(self, symbols: set, loop=None):
+        self.symbols = symbols
+        self.loop = loop
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.async_ready = asyncio.Event() if loop else None
+
+    def publish(self, changes: dict):
+        changes = {sym: data for sym, data in changes.items() if sym in self.symbols}
+        if not changes:
+            return
+        with self.lock:
+            self.pending.update(changes)
+        if self.loop:
+            try:
+                self.loop.call_soon_threadsafe(self.async_ready.set)
+            except RuntimeError:
+                pass  # event loop already closed
+        else:
+            self.ready.set()
+
+    def take(self) -> dict:
+        if self.async_ready:
+            self.async_ready.clear()
+        self.ready.clear()
+        with self.lock:
+            changes, self.pending = self.pending, {}
+        return changes
+
+def subscribe_prices(symbols: set, loop=None, limit: int = None):
+    """Register a live price subscriber and make sure the watcher is running (None once `limit` threaded ones are in)"""
+    subscriber = PriceSubscriber(symbols, loop)
+    with _price_subscribers_lock:
+        if limit is not None and sum(1 for other in _price_subscribers if other.loop is None) >= limit:
+            return None
+        _price_subscribers.add(subscriber)
+    ensure_background_thread("price-watcher", price_watcher_loop)
+    return subscriber
+
+def unsubscribe_prices(subscriber: PriceSubscriber):
+    with _price_subscribers_lock:
+        _price_subscribers.discard(subscriber)
+
+def price_watcher_loop():
+    """Diff the shared snapshot and push only changed symbols to every subscriber"""
+    last_prices = {}
+    while True:
+        try:
+            prices = get_crypto_prices() or {}
+            changes = {
+                sym: data for sym, data in prices.items()
+                if last_prices.get(sym, {}).get("price") != data["price"]
+            }
+            if changes:
+                last_prices.update(changes)
+                with _price_subscribers_lock:
+                    subscribers = list(_price_subscribers)
+                for subscriber in subscribers:
+                    subscriber.publish(changes)
+        except Exception as e:
+            logger.error(f"⚠️ Price watcher error: {str(e)}", exc_info=True)
+        time.sleep(PRICE_STREAM_POLL)
+
+def parse_price_symbols(raw: str) -> set:
+    """Parse ?symbols=BTC,ETH (defaults to every symbol in CRYPTO_IDS)"""
+    known = set(CRYPTO_IDS.values())
+    requested = {sym.strip().upper() for sym in raw.split(",") if sym.strip()}
+    return (requested & known) or known
+
 def format_price_response(prompt: str, prices: dict) -> str:
     """Handle price conversions and formatting"""
     try:
@@ -461,6 +1904,7 @@ def format_price_response(prompt: str, prices: dict) -> str:
         return "⚠️ Error calculating prices - check coinmarketcap.com for live rates"
 
 @app.route("/test_prices")
+@rate_limited(5 * RATE_LIMIT_COSTS["chat"])
 def test_prices():
     """Test endpoint for price checks"""
     test_queries = [
@@ -482,44 +1926,179 @@ def test_prices():
     
     return jsonify(results)    
     
+@app.route("/prices/stream")
+def prices_stream():
+    """Live price ticker as Server-Sent Events (snapshot, then only changed prices)"""
+    symbols = parse_price_symbols(request.args.get("symbols", ""))
+    subscriber = subscribe_prices(symbols, limit=PRICE_STREAM_MAX_SUBSCRIBERS)
+    if not subscriber:
+        logger.warning(f"🚧 /prices/stream full ({PRICE_STREAM_MAX_SUBSCRIBERS} subscribers in worker {os.getpid()})")
+        response = jsonify({"error": "Too many price stream subscribers - serve app:asgi_app for large audiences"})
+        response.headers["Retry-After"] = str(PRICE_STREAM_HEARTBEAT)
+        return response, 503
+
+    def generate():
+        try:
+            prices = get_crypto_prices() or {}
+            yield sse_event("snapshot", {sym: data for sym, data in prices.items() if sym in symbols})
+            while True:
+                if not subscriber.ready.wait(PRICE_STREAM_HEARTBEAT):
+                    yield ": keep-alive\n\n"
+                    continue
+                changes = subscriber.take()
+                if changes:
+                    yield sse_event("prices", changes)
+        finally:
+            unsubscribe_prices(subscriber)
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # The generator's finally never runs if the client is gone before the first chunk
+    response.call_on_close(lambda: unsubscribe_prices(subscriber))
+    return response
+
+def admin_error():
+    """Return an error response unless the request carries the ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled (set ADMIN_TOKEN)"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+@app.route("/admin/cache", methods=["GET"])
+def cache_stats():
+    """Response and prompt cache hit/miss counters for this worker"""
+    if (error := admin_error()):
+        return error
+    return jsonify({
+        "pid": os.getpid(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "prompt_cache": prompt_cache_stats.stats()
+    })
+
+@app.route("/admin/upstream", methods=["GET"])
+def upstream_stats():
+    """Upstream call savings for this worker"""
+    if (error := admin_error()):
+        return error
+    return jsonify({
+        "pid": os.getpid(),
+        "single_flight": single_flight.stats(),
+        "image_pipeline": image_stage_timings.stats(),
+        "reply_lengths": reply_length_stats.stats(),
+        "client_aborts": abort_stats.stats(),
+        "chat_providers": provider_stats.stats(),
+        "concurrency": {name: limiter.stats() for name, limiter in CONCURRENCY_LIMITERS.items()}
+    })
+
+@app.route("/admin/breakers", methods=["GET"])
+def breaker_status():
+    """Circuit breaker state per upstream (shared) with this worker's recent call window"""
+    if (error := admin_error()):
+        return error
+    return jsonify({"pid": os.getpid(), "breakers": {name: breaker.stats() for name, breaker in CIRCUIT_BREAKERS.items()}})
+
+@app.route("/admin/usage", methods=["GET"])
+def token_usage():
+    """DeepSeek token usage for a day (?day=YYYY-MM-DD, UTC, default today): totals, per personality, top ?top=N sessions"""
+    if (error := admin_error()):
+        return error
+    day = request.args.get("day") or usage_day()
+    if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", day):
+        return jsonify({"error": "day must be YYYY-MM-DD"}), 400
+    top = min(max(request.args.get("top", 20, type=int), 1), 200)
+    return jsonify(usage_ledger.report(day, top))
+
+@app.route("/admin/tweets", methods=["GET"])
+def tweet_outbox_status():
+    """Tweet outbox queue depth (shared by all workers)"""
+    if (error := admin_error()):
+        return error
+    return jsonify(tweet_outbox_stats())
+
+@app.route("/admin/cache/invalidate", methods=["POST"])
+def cache_invalidate():
+    """Drop cached replies for one personality (or all of them)"""
+    if (error := admin_error()):
+        return error
+    data = request.get_json(silent=True) or {}
+    personality = data.get("personality")
+    if personality is not None and personality not in PERSONALITIES:
+        return jsonify({"error": "Invalid personality"}), 400
+    removed = response_cache.invalidate(personality)
+    semantic_cache.invalidate(personality)
+    logger.info(f"🧹 Response cache invalidated for {personality or 'all personalities'}: {removed} entries")
+    return jsonify({"personality": personality, "removed": removed, "pid": os.getpid()})
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(os.path.join(app.root_path, 'static'), 'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
 @app.route("/chat", methods=["POST"])
+@rate_limited(chat_request_cost)
 def chat():
     try:
         data = request.get_json()
-        if not data or "message" not in data:
+        if not isinstance(data, dict) or "message" not in data:
             return jsonify({"error": "No message provided"}), 400
+        if not isinstance(data["message"], str):
+            return jsonify({"error": "Message must be a string"}), 400
 
         # Retrieve the personality (default if none is set)
         personality = session.get("personality", "default")
-        user_message = data["message"].lower()
+        intents = intent_router.classify(data["message"])
 
         # Check if the incoming JSON includes a flag to tweet the response
         # This flag should be set on the client-side; e.g., {"message": "Tell me a crypto joke", "tweet": true}
         tweet_flag = data.get("tweet", False)
 
         # Handle image requests first if the message contains image triggers
-        if any(trigger in user_message for trigger in IMAGE_TRIGGERS):
+        if "image" in intents:
+            latency_budget_ms = parse_latency_budget(data)
+            if latency_budget_ms is not None:
+                reply = progressive_image_reply(
+                    get_session_id(), request.remote_addr, data["message"], personality, tweet_flag, latency_budget_ms
+                )
+                if reply:
+                    reply["personality"] = personality
+                    return jsonify(reply), 202 if reply["job"] else 200
+
+            if data.get("async_image"):
+                job = enqueue_image_job(get_session_id(), data["message"], personality, tweet_flag)
+                if not job:
+                    return jsonify({"error": "Too many image jobs in progress"}), 429
+                return jsonify({
+                    "response": "🎨 Image queued - it will appear here when ready",
+                    "image": None,
+                    "job": image_job_response(job),
+                    "personality": personality
+                }), 202
+
             image_url = generate_image(data["message"], personality)
             response_text = "🔮 Generated image for your request:" if image_url else "⚠️ Image generation failed"
             # Only auto-tweet if the tweet flag is True
             if tweet_flag:
-                post_tweet(response_text)
+                tweet_reply(response_text)
             return jsonify({
                 "response": response_text,
                 "image": image_url,
                 "personality": personality
             })
 
-        # Process a normal chat response via DeepSeek
-        result = call_deepseek_v2(data["message"], personality)
+        # Process a normal chat response via DeepSeek, abandoned if the client closes the connection first
+        environ = request.environ
+        result = call_deepseek_v2(
+            data["message"], personality, use_cache=data.get("cache", True), intents=intents, session_id=get_session_id(),
+            latency_budget_ms=parse_latency_budget(data, "reply_budget_ms"), disconnected=lambda: client_disconnected(environ)
+        )
         # Make sure the tweet does not exceed Twitter's 280-character limit
         tweet_text = result["text"][:280]
         if tweet_flag:
-            post_tweet(tweet_text)
+            tweet_reply(tweet_text)
 
         return jsonify({
             "response": result["text"],
@@ -530,6 +2109,663 @@ def chat():
     except Exception as e:
         logger.error(f"Chat error: {str(e)}", exc_info=True)
         return jsonify({"error": "Internal server error"}), 500
-    
+
+@app.route("/chat/stream", methods=["POST"])
+@rate_limited(chat_request_cost)
+def chat_stream():
+    """Stream the chat reply as Server-Sent Events (meta → delta* → done)"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or "message" not in data:
+        return jsonify({"error": "No message provided"}), 400
+    if not isinstance(data["message"], str):
+        return jsonify({"error": "Message must be a string"}), 400
+
+    personality = session.get("personality", "default")
+    message = data["message"]
+    tweet_flag = data.get("tweet", False)
+    latency_budget_ms = parse_latency_budget(data)
+    session_id = get_session_id()
+    client_ip = request.remote_addr
+    intents = intent_router.classify(message)
+    environ = request.environ
+
+    def generate():
+        yield sse_event("meta", {"personality": personality})
+        try:
+            # Image requests and price/wallet short-circuits are answered with a single event
+            if latency_budget_ms is not None and "image" in intents:
+                reply = progressive_image_reply(session_id, client_ip, message, personality, tweet_flag, latency_budget_ms)
+                if reply:
+                    yield sse_event("message", reply)
+                    yield sse_event("done", {})
+                    return
+
+            if data.get("async_image") and "image" in intents:
+                job = enqueue_image_job(session_id, message, personality, tweet_flag)
+                if not job:
+                    yield sse_event("error", {"response": "⚠️ Too many image jobs in progress - try again shortly"})
+                    return
+                yield sse_event("message", {
+                    "response": "🎨 Image queued - it will appear here when ready",
+                    "image": None,
+                    "job": image_job_response(job)
+                })
+                yield sse_event("done", {})
+                return
+
+            if "image" in intents:
+                image_url = generate_image(message, personality)
+                response_text = "🔮 Generated image for your request:" if image_url else "⚠️ Image generation failed"
+                if tweet_flag:
+                    tweet_reply(response_text)
+                yield sse_event("message", {"response": response_text, "image": image_url})
+                yield sse_event("done", {})
+                return
+
+            shortcut = detect_shortcut_response(message, personality, intents)
+            if shortcut:
+                if tweet_flag:
+                    tweet_reply(shortcut["text"][:280])
+                yield sse_event("message", {"response": shortcut["text"], "image": shortcut["image"]})
+                yield sse_event("done", {})
+                return
+
+            cache_key = None
+            plan = plan_reply_length(message, personality, intents, parse_latency_budget(data, "reply_budget_ms"))
+            history = load_history(session_id, personality)
+            request_args = build_deepseek_request(message, personality, history, plan)
+            if data.get("cache", True):
+                cache_key, cached = lookup_cached_reply(personality, message, request_args)
+                if cached is not None:
+                    remember_turn(session_id, personality, message, cached)
+                    if tweet_flag:
+                        tweet_reply(cached[:280])
+                    yield sse_event("message", {"response": cached, "image": None})
+                    yield sse_event("done", {})
+                    return
+
+            parts = []
+            # Closing the deltas closes the upstream stream: on a failed write (the server closes this
+            # generator) or as soon as a peek shows the client hung up, whichever comes first
+            deltas = stream_deepseek_v2(message, personality, history, plan, session_id)
+            try:
+                check_token_quota(session_id)
+                for delta in deltas:
+                    parts.append(delta)
+                    if client_disconnected(environ):
+                        return
+                    yield sse_event("delta", {"text": delta})
+            except Exception as e:
+                yield sse_event("error", {"response": deepseek_error_text(e)})
+                return
+            finally:
+                deltas.close()
+
+            if cache_key:
+                store_cached_reply(cache_key, personality, message, request_args, "".join(parts))
+            remember_turn(session_id, personality, message, "".join(parts))
+            if tweet_flag:
+                tweet_reply("".join(parts)[:280])
+            yield sse_event("done", {})
+
+        except Exception as e:
+            logger.error(f"Chat stream error: {str(e)}", exc_info=True)
+            yield sse_event("error", {"response": "⚠️ Critical system error - administrators have been notified"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/images/<digest>", methods=["GET"])
+def stored_image(digest):
+    """Serve a stored render (?variant=thumb for the 256x256 thumbnail); immutable, strong ETag"""
+    variant = request.args.get("variant", "full")
+    if not re.fullmatch(r"[0-9a-f]{64}", digest) or variant not in IMAGE_VARIANTS:
+        return jsonify({"error": "Unknown image"}), 404
+    stored = find_stored_image(digest, variant)
+    if not stored:
+        return jsonify({"error": "Unknown image"}), 404
+
+    path, mimetype = stored
+    touch_stored_image(digest)
+    # send_file hands the open file to the server's wsgi.file_wrapper (sendfile) or X-Sendfile
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        etag=f"{digest}-{variant}",
+        conditional=True,
+        max_age=31536000
+    )
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+@app.route("/images/jobs", methods=["POST"])
+@rate_limited(RATE_LIMIT_COSTS["image"])
+def create_image_job():
+    """Queue an image generation job and return its id immediately"""
+    data = request.get_json(silent=True)
+    if not data or not data.get("prompt"):
+        return jsonify({"error": "No prompt provided"}), 400
+
+    personality = session.get("personality", "default")
+    job = enqueue_image_job(get_session_id(), data["prompt"], personality, data.get("tweet", False))
+    if not job:
+        return jsonify({"error": f"At most {IMAGE_JOBS_PER_SESSION} image jobs per session may run at once"}), 429
+    return jsonify(image_job_response(job)), 202
+
+@app.route("/images/jobs/<job_id>", methods=["GET"])
+def image_job_status(job_id):
+    """Poll an image job"""
+    job = get_image_job(job_id)
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(image_job_response(job))
+
+@app.route("/images/jobs/<job_id>", methods=["DELETE"])
+def image_job_cancel(job_id):
+    """Cancel one of this session's image jobs"""
+    job = get_image_job(job_id)
+    if not job or job["session_id"] != session.get("sid"):
+        return jsonify({"error": "Unknown job"}), 404
+    if not cancel_image_job(job_id):
+        return jsonify({"error": f"Job already {job['status']}"}), 409
+    return jsonify(image_job_response(get_image_job(job_id)))
+
+@app.route("/images/jobs/<job_id>/events", methods=["GET"])
+def image_job_events(job_id):
+    """Server-Sent Events for a job: a status event on every change, ending with the final state"""
+    if not get_image_job(job_id):
+        return jsonify({"error": "Unknown job"}), 404
+
+    def generate():
+        last = None
+        while True:
+            job = get_image_job(job_id)
+            if not job:
+                # Pruned (or otherwise removed) while we were watching it
+                yield sse_event("gone", {"job_id": job_id, "error": "Unknown job"})
+                return
+            current = (job["status"], job["position"])
+            if current != last:
+                last = current
+                yield sse_event("status", image_job_response(job))
+            if job["status"] in IMAGE_JOB_FINAL_STATES:
+                return
+            time.sleep(0.5)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Async (ASGI) execution mode $DP
+# Serve with: gunicorn -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:5001 app:asgi_app
+# /chat, /chat/stream and the SSE routes run natively on the event loop; every other route is bridged to
+# the Flask app on a bounded pool of its own, so slow Flask calls never starve the loop's default executor.
+ASGI_BRIDGE_WORKERS = int(os.getenv("ASGI_BRIDGE_WORKERS", "16"))
+_bridge_executor = {"pid": None, "pool": None}
+
+def get_bridge_executor() -> ThreadPoolExecutor:
+    """Return this process's pool for bridged Flask requests (rebuilt after a fork)"""
+    if _bridge_executor["pid"] != os.getpid():
+        with _background_lock:
+            if _bridge_executor["pid"] != os.getpid():
+                _bridge_executor["pool"] = ThreadPoolExecutor(max_workers=ASGI_BRIDGE_WORKERS, thread_name_prefix="asgi-bridge")
+                _bridge_executor["pid"] = os.getpid()
+    return _bridge_executor["pool"]
+
+def asgi_to_wsgi_environ(scope: dict, body: bytes) -> dict:
+    """Build a WSGI environ from an ASGI HTTP scope"""
+    server = scope.get("server") or ("localhost", 80)
+    client_addr = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client_addr[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").lower()
+        value = raw_value.decode("latin-1")
+        if name == "content-length":
+            continue
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+            continue
+        key = "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def read_asgi_body(receive) -> bytes:
+    """Read the full request body from an ASGI receive channel"""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+def parse_json_body(body: bytes):
+    """Decode a JSON request body, returning None when it is missing or malformed"""
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+async def send_asgi_json(send, payload: dict, status: int = 200, headers=()):
+    """Send a complete JSON response over ASGI"""
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def call_flask_from_asgi(scope, body: bytes, send):
+    """Run the Flask WSGI app on the bridge pool and relay its (possibly streamed) response"""
+    loop = asyncio.get_running_loop()
+    executor = get_bridge_executor()
+    environ = asgi_to_wsgi_environ(scope, body)
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start["status"] = int(status.split(" ", 1)[0])
+        response_start["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        return lambda data: None
+
+    result = await loop.run_in_executor(executor, app, environ, start_response)
+    iterator = iter(result)
+    try:
+        await send({"type": "http.response.start", **response_start})
+        # Pull chunks one at a time so streamed responses (SSE) are not buffered
+        while (chunk := await loop.run_in_executor(executor, next, iterator, None)) is not None:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(result, "close"):
+            await loop.run_in_executor(executor, result.close)
+
+def open_asgi_session(scope) -> list:
+    """Load the Flask session cookie into scope["session"], issuing a session id when it has none
+
+    Returns the headers that set the new cookie, signed exactly as Flask would, so
+    first-time visitors are served natively and later Flask requests see the same sid.
+    """
+    interface = app.session_interface
+    serializer = interface.get_signing_serializer(app)
+    name = interface.get_cookie_name(app)
+    cookies = parse_cookie("; ".join(value.decode("latin-1") for key, value in scope.get("headers", []) if key == b"cookie"))
+    data = {}
+    if cookies.get(name):
+        try:
+            data = serializer.loads(cookies[name], max_age=int(app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            data = {}
+    flask_session = scope["session"] = interface.session_class(data)
+    if "sid" in flask_session:
+        return []
+
+    flask_session["sid"] = uuid.uuid4().hex
+    cookie = dump_cookie(
+        name,
+        serializer.dumps(dict(flask_session)),
+        expires=interface.get_expiration_time(app, flask_session),
+        domain=interface.get_cookie_domain(app),
+        path=interface.get_cookie_path(app),
+        secure=interface.get_cookie_secure(app),
+        httponly=interface.get_cookie_httponly(app),
+        samesite=interface.get_cookie_samesite(app),
+        partitioned=interface.get_cookie_partitioned(app)
+    )
+    return [(b"set-cookie", cookie.encode("latin-1")), (b"vary", b"Cookie")]
+
+def session_from_scope(scope):
+    """Read (active personality, session id) from the session open_asgi_session loaded"""
+    return scope["session"].get("personality", "default"), scope["session"]["sid"]
+
+def send_with_headers(send, headers: list):
+    """Wrap an ASGI send so the response start carries extra headers"""
+    if not headers:
+        return send
+
+    async def send_with_extra_headers(message):
+        if message["type"] == "http.response.start":
+            message = {**message, "headers": [*message.get("headers", []), *headers]}
+        await send(message)
+
+    return send_with_extra_headers
+
+async def chat_async(scope, body: bytes, receive, send):
+    """Async twin of the /chat route"""
+    try:
+        data = parse_json_body(body)
+        if not isinstance(data, dict) or "message" not in data:
+            return await send_asgi_json(send, {"error": "No message provided"}, 400)
+        if not isinstance(data["message"], str):
+            return await send_asgi_json(send, {"error": "Message must be a string"}, 400)
+
+        personality, session_id = session_from_scope(scope)
+        intents = intent_router.classify(data["message"])
+        tweet_flag = data.get("tweet", False)
+
+        if "image" in intents:
+            image_url = await generate_image_async(data["message"], personality)
+            response_text = "🔮 Generated image for your request:" if image_url else "⚠️ Image generation failed"
+            if tweet_flag:
+                await tweet_reply_async(response_text)
+            return await send_asgi_json(send, {
+                "response": response_text,
+                "image": image_url,
+                "personality": personality
+            })
+
+        # The body is fully read, so the next message can only be http.disconnect
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            result = await call_deepseek_async(
+                data["message"], personality, use_cache=data.get("cache", True), intents=intents, session_id=session_id,
+                latency_budget_ms=parse_latency_budget(data, "reply_budget_ms"), disconnected=disconnected.done
+            )
+        finally:
+            disconnected.cancel()
+        if tweet_flag:
+            await tweet_reply_async(result["text"][:280])
+
+        await send_asgi_json(send, {
+            "response": result["text"],
+            "image": result["image"],
+            "personality": personality
+        })
+
+    except Exception as e:
+        logger.error(f"Async chat error: {str(e)}", exc_info=True)
+        await send_asgi_json(send, {"error": "Internal server error"}, 500)
+
+async def chat_stream_async(scope, body: bytes, receive, send):
+    """Async twin of the /chat/stream route"""
+    data = parse_json_body(body)
+    if not isinstance(data, dict) or "message" not in data:
+        return await send_asgi_json(send, {"error": "No message provided"}, 400)
+    if not isinstance(data["message"], str):
+        return await send_asgi_json(send, {"error": "Message must be a string"}, 400)
+
+    personality, session_id = session_from_scope(scope)
+    message = data["message"]
+    tweet_flag = data.get("tweet", False)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no")
+        ]
+    })
+
+    async def emit(event: str, payload: dict):
+        await send({"type": "http.response.body", "body": sse_event(event, payload).encode("utf-8"), "more_body": True})
+
+    try:
+        await emit("meta", {"personality": personality})
+        intents = intent_router.classify(message)
+
+        if "image" in intents:
+            image_url = await generate_image_async(message, personality)
+            response_text = "🔮 Generated image for your request:" if image_url else "⚠️ Image generation failed"
+            if tweet_flag:
+                await tweet_reply_async(response_text)
+            await emit("message", {"response": response_text, "image": image_url})
+            await emit("done", {})
+            return
+
+        shortcut = await asyncio.to_thread(detect_shortcut_response, message, personality, intents)
+        if shortcut:
+            if tweet_flag:
+                await tweet_reply_async(shortcut["text"][:280])
+            await emit("message", {"response": shortcut["text"], "image": shortcut["image"]})
+            await emit("done", {})
+            return
+
+        cache_key = None
+        plan = plan_reply_length(message, personality, intents, parse_latency_budget(data, "reply_budget_ms"))
+        history = await asyncio.to_thread(load_history, session_id, personality)
+        request_args = build_deepseek_request(message, personality, history, plan)
+        if data.get("cache", True):
+            cache_key, cached = lookup_cached_reply(personality, message, request_args)
+            if cached is not None:
+                await asyncio.to_thread(remember_turn, session_id, personality, message, cached)
+                if tweet_flag:
+                    await tweet_reply_async(cached[:280])
+                await emit("message", {"response": cached, "image": None})
+                await emit("done", {})
+                return
+
+        parts = []
+        # Servers drop writes to a departed client without raising, so watch for http.disconnect instead
+        disconnected = asyncio.ensure_future(receive())
+        deltas = stream_deepseek_async(message, personality, history, plan, session_id)
+        try:
+            await asyncio.to_thread(check_token_quota, session_id)
+            async for delta in deltas:
+                parts.append(delta)
+                if disconnected.done():
+                    return
+                await emit("delta", {"text": delta})
+        except Exception as e:
+            await emit("error", {"response": deepseek_error_text(e)})
+            return
+        finally:
+            disconnected.cancel()
+            await deltas.aclose()
+
+        if cache_key:
+            store_cached_reply(cache_key, personality, message, request_args, "".join(parts))
+        await asyncio.to_thread(remember_turn, session_id, personality, message, "".join(parts))
+        if tweet_flag:
+            await tweet_reply_async("".join(parts)[:280])
+        await emit("done", {})
+
+    except Exception as e:
+        logger.error(f"Async chat stream error: {str(e)}", exc_info=True)
+        await emit("error", {"response": "⚠️ Critical system error - administrators have been notified"})
+    finally:
+        await send({"type": "http.response.body", "body": b""})
+
+async def prices_stream_async(scope, body: bytes, receive, send):
+    """Async twin of /prices/stream; holds no thread per subscriber"""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    symbols = parse_price_symbols(query.get("symbols", [""])[0])
+    subscriber = subscribe_prices(symbols, asyncio.get_running_loop())
+    disconnected = asyncio.ensure_future(receive())
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no")
+        ]
+    })
+    try:
+        prices = await asyncio.to_thread(get_crypto_prices) or {}
+        snapshot = {sym: data for sym, data in prices.items() if sym in symbols}
+        await send({"type": "http.response.body", "body": sse_event("snapshot", snapshot).encode("utf-8"), "more_body": True})
+
+        while not disconnected.done():
+            waiter = asyncio.ensure_future(subscriber.async_ready.wait())
+            await asyncio.wait({waiter, disconnected}, timeout=PRICE_STREAM_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                waiter.cancel()
+                break
+            if not waiter.done():
+                waiter.cancel()
+                chunk = ": keep-alive\n\n"
+            else:
+                changes = subscriber.take()
+                if not changes:
+                    continue
+                chunk = sse_event("prices", changes)
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+    finally:
+        unsubscribe_prices(subscriber)
+        disconnected.cancel()
+
+async def image_job_events_async(scope, body: bytes, receive, send):
+    """Async twin of /images/jobs/<id>/events; a watcher holds no bridge thread while the job runs"""
+    job_id = IMAGE_JOB_EVENTS_PATH.fullmatch(scope["path"]).group("job_id")
+    if not await asyncio.to_thread(get_image_job, job_id):
+        return await send_asgi_json(send, {"error": "Unknown job"}, 404)
+    disconnected = asyncio.ensure_future(receive())
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no")
+        ]
+    })
+    try:
+        last = None
+        while not disconnected.done():
+            job = await asyncio.to_thread(get_image_job, job_id)
+            if not job:
+                # Pruned (or otherwise removed) while we were watching it
+                await send({
+                    "type": "http.response.body",
+                    "body": sse_event("gone", {"job_id": job_id, "error": "Unknown job"}).encode("utf-8"),
+                    "more_body": True
+                })
+                return
+            current = (job["status"], job["position"])
+            if current != last:
+                last = current
+                chunk = sse_event("status", image_job_response(job))
+                await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+            if job["status"] in IMAGE_JOB_FINAL_STATES:
+                return
+            await asyncio.wait({disconnected}, timeout=0.5)
+    finally:
+        disconnected.cancel()
+        await send({"type": "http.response.body", "body": b""})
+
+def asgi_client_ip(scope) -> str:
+    """Client address of an ASGI request, trusting TRUSTED_PROXIES X-Forwarded-For hops like ProxyFix"""
+    client_ip = (scope.get("client") or ("", 0))[0]
+    if TRUSTED_PROXIES:
+        forwarded = [
+            hop.strip() for name, value in scope.get("headers", []) if name == b"x-forwarded-for"
+            for hop in value.decode("latin-1").split(",")
+        ]
+        if len(forwarded) >= TRUSTED_PROXIES:
+            client_ip = forwarded[-TRUSTED_PROXIES]
+    return client_ip
+
+async def rate_limit_asgi(scope, body: bytes, send):
+    """Charge a native async chat request; returns the send to respond with, or None once a 429 went out"""
+    cost = chat_request_cost(parse_json_body(body))
+    decision = await asyncio.to_thread(take_rate_limit, session_from_scope(scope)[1], asgi_client_ip(scope), cost)
+    if decision is None:
+        return send
+    headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in decision.headers().items()]
+    if not decision.allowed:
+        await send_asgi_json(send, rate_limited_response(decision), 429, headers)
+        return None
+    return send_with_headers(send, headers)
+
+ASYNC_ROUTES = {
+    ("POST", "/chat"): chat_async,
+    ("POST", "/chat/stream"): chat_stream_async,
+    ("GET", "/prices/stream"): prices_stream_async,
+}
+IMAGE_JOB_EVENTS_PATH = re.compile(r"/images/jobs/(?P<job_id>[^/]+)/events")
+
+def find_async_route(method: str, path: str):
+    """Native handler for a request, or None to bridge it to Flask"""
+    if method == "GET" and IMAGE_JOB_EVENTS_PATH.fullmatch(path):
+        return image_job_events_async
+    return ASYNC_ROUTES.get((method, path))
+
+def wants_image_job(body: bytes) -> bool:
+    """Image-job (and preview + HD job) requests have no async twin and go to Flask"""
+    data = parse_json_body(body)
+    return bool(
+        isinstance(data, dict) and isinstance(data.get("message"), str)
+        and (data.get("async_image") or parse_latency_budget(data) is not None)
+        and "image" in intent_router.classify(data["message"])
+    )
+
+async def asgi_app(scope, receive, send):
+    """ASGI entrypoint: native async chat routes, Flask for everything else"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                start_background_services()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await close_async_clients()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    body = await read_asgi_body(receive)
+    handler = find_async_route(scope["method"], scope["path"])
+    if handler in (chat_async, chat_stream_async):
+        if wants_image_job(body):
+            # Charged by the @rate_limited Flask route instead
+            return await call_flask_from_asgi(scope, body, send)
+        send = send_with_headers(send, open_asgi_session(scope))
+        if (send := await rate_limit_asgi(scope, body, send)) is None:
+            return
+    if handler:
+        await handler(scope, body, receive, send)
+    else:
+        await call_flask_from_asgi(scope, body, send)
+
+# App factory for gunicorn (see gunicorn.conf.py): with preload_app the master imports the
+# heavy dependencies and the personality tables once, and forked workers share those pages
+PRELOAD_MODULES = ("httpx", "openai", "numpy", "PIL.Image")
+
+def preload_heavy_modules():
+    """Import the lazily loaded dependencies up front"""
+    for name in PRELOAD_MODULES + (("tweepy",) if TWITTER_CONFIGURED else ()):
+        importlib.import_module(name)
+
+def create_app() -> Flask:
+    """Prepare the module's Flask app for preforking and return it (no clients, sockets or threads)"""
+    preload_heavy_modules()
+    get_shared_db()  # create the shared schema once, then drop the connection before forking
+    close_shared_db()
+    return app
+
+def init_worker():
+    """Per-worker setup after fork: build this process's clients and start its background threads"""
+    get_clients()
+    start_background_services()
+    logger.info(f"👷 Worker {os.getpid()} ready")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5001, debug=False)  # Ensure debug is False
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""Intent routing micro-benchmark.
+
+Times the compiled router in app.py against the old chained any() substring
+scans on a corpus of realistic prompts. It then grows the trigger lists with
+synthetic vocabulary to show how each approach scales:
+
+    python bench_intents.py --sizes 10 100 1000 5000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+# Dummy keys are enough: nothing here talks to an upstream
+os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import app  # noqa: E402
+from intent_router import IntentRouter  # noqa: E402
+
+CORPUS = [
+    "What's the BTC price right now?",
+    "how much is 1 ethereum in usd",
+    "Convert $250 to sol please",
+    "generate image of a bull riding a rocket to the moon",
+    "draw me a cyberpunk bitcoin miner",
+    "show me a neon solana logo",
+    "what is your wallet address?",
+    "Send me the wallet so I can tip",
+    "tell me a crypto joke",
+    "Explain proof of stake like I'm five",
+    "is now a good time to buy eth or should I wait for the next dip",
+    "what do you think about memecoins and their long-term value",
+    "create illustration of a hacker in a hoodie trading altcoins at 3am",
+    "Write a haiku about gas fees",
+    "who are you and what can you do?",
+    "gm",
+    "what's the current rate for bitcoin vs ethereum vs solana",
+    "render an image of an ape wearing diamond hands gloves",
+    "How do hardware wallets protect my private keys compared to exchanges?",
+    "Give me three reasons the market crashed today, with sources if you have them",
+]
+
+
+def naive_classify(message: str, image_triggers, price_keywords, crypto_terms, wallet_keywords) -> list:
+    """The scans the router replaced: lowercase, then one any() per vocabulary"""
+    message = message.lower()
+    intents = []
+    if any(trigger in message for trigger in image_triggers):
+        intents.append("image")
+    if any(kw in message for kw in price_keywords) and any(term in message for term in crypto_terms):
+        intents.append("price")
+    if any(kw in message for kw in wallet_keywords):
+        intents.append("wallet")
+    return intents
+
+
+def synthetic_terms(count: int, rng: random.Random) -> list:
+    """Trigger phrases that never appear in the corpus (worst case for linear scans)"""
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(count)]
+    return [f"{word} {rng.choice(words)}" if rng.random() < 0.5 else word for word in words]
+
+
+def time_per_message(fn, corpus, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for message in corpus:
+            fn(message)
+    return (time.perf_counter() - started) / (rounds * len(corpus)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 100, 1000, 5000], help="extra triggers per vocabulary")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--max-us", type=float, default=None, help="fail if the router exceeds this at any size")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print("Sample routing:")
+    for message in CORPUS[:8]:
+        print(f"  {app.intent_router.classify(message).intents!s:<28} {message}")
+
+    print(f"\n{'extra triggers':>14} | {'router µs/msg':>13} | {'any() µs/msg':>12} | {'compile ms':>10}")
+    worst = 0.0
+    for size in args.sizes:
+        image = app.IMAGE_TRIGGERS + synthetic_terms(size, rng)
+        price = app.PRICE_KEYWORDS + synthetic_terms(size, rng)
+        crypto = app.CRYPTO_TERMS + synthetic_terms(size, rng)
+        wallet = app.WALLET_KEYWORDS + synthetic_terms(size, rng)
+
+        started = time.perf_counter()
+        router = (
+            IntentRouter()
+            .add("image", image, priority=30)
+            .add("price", price, priority=20, requires=crypto)
+            .add("wallet", wallet, priority=10)
+            .compile()
+        )
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        router_us = time_per_message(router.classify, CORPUS, args.rounds)
+        naive_us = time_per_message(lambda m: naive_classify(m, image, price, crypto, wallet), CORPUS, args.rounds)
+        worst = max(worst, router_us)
+        print(f"{size:>14} | {router_us:>13.2f} | {naive_us:>12.2f} | {compile_ms:>10.1f}")
+
+    if args.max_us is not None and worst > args.max_us:
+        sys.exit(f"❌ router took {worst:.2f}µs per message (limit {args.max_us}µs)")
+
+
+if __name__ == "__main__":
+    main()
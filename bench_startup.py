@@ -0,0 +1,91 @@
+"""Startup benchmark: how long a fresh worker takes to import app.py.
+
+Each run imports the app in a clean interpreter with outbound connections
+blocked, then checks that no heavy module was imported and no network call
+was made at import time. Exits non-zero on a regression, so it can gate CI:
+
+    python bench_startup.py --runs 5 --max-ms 600
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import json
+import tempfile
+
+HEAVY_MODULES = ("openai", "httpx", "tweepy", "numpy", "PIL")
+
+CHILD = """
+import json, socket, sys, time
+attempts = []
+def blocked_connect(self, address):
+    attempts.append(str(address))
+    raise OSError("network disabled during startup benchmark")
+socket.socket.connect = blocked_connect
+started = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - started) * 1000
+started = time.perf_counter()
+app.app.test_client().get("/ready")
+first_request_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({
+    "import_ms": import_ms,
+    "first_request_ms": first_request_ms,
+    "heavy": [name for name in %r if name in sys.modules],
+    "network": attempts,
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_once(env: dict) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60
+    )
+    if result.returncode != 0:
+        sys.exit(f"❌ import failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=600, help="fail if the median import takes longer")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # Dummy keys are enough: nothing may talk to an upstream during import
+    env.setdefault("DEEPSEEK_API_KEY", "bench")
+    env.setdefault("OPENAI_API_KEY", "bench")
+    env.setdefault("SHARED_DB_PATH", os.path.join(tempfile.gettempdir(), "deep_persona_bench.db"))
+
+    runs = [run_once(env) for _ in range(args.runs)]
+    import_ms = statistics.median(run["import_ms"] for run in runs)
+    first_request_ms = statistics.median(run["first_request_ms"] for run in runs)
+    print(f"⏱️ import app: median {import_ms:.0f}ms (min {min(run['import_ms'] for run in runs):.0f}ms) over {args.runs} runs")
+    print(f"⏱️ first request: median {first_request_ms:.0f}ms")
+
+    failures = []
+    if import_ms > args.max_ms:
+        failures.append(f"median import {import_ms:.0f}ms exceeds --max-ms {args.max_ms:.0f}")
+    heavy = sorted({name for run in runs for name in run["heavy"]})
+    if heavy:
+        failures.append(f"heavy modules imported eagerly: {', '.join(heavy)}")
+    network = sorted({address for run in runs for address in run["network"]})
+    if network:
+        failures.append(f"network calls during startup: {', '.join(network)}")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ startup is lazy")
+
+
+if __name__ == "__main__":
+    main()
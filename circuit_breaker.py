@@ -0,0 +1,196 @@
+"""Circuit breakers for the upstream APIs.
+
+Each worker judges an upstream from its own recent calls, and the verdict
+(open / half-open / closed) is shared through the store so every worker
+fails fast together.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from shared_store import get_shared_db
+
+logger = logging.getLogger(__name__)
+
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))  # failed share of windowed calls that trips
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))  # slow share of windowed calls that trips
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "15"))  # seconds open before a probe, doubled per failed probe
+BREAKER_MAX_COOLDOWN = float(os.getenv("BREAKER_MAX_COOLDOWN", "300"))
+BREAKER_SYNC_INTERVAL = 0.5
+BREAKER_PROBE_TIMEOUT = 120  # a probe that never reports back frees the slot after this long
+
+
+class CircuitOpenError(Exception):
+    """The upstream's breaker is open: the call was refused without touching the network"""
+
+
+def upstream_fault(error: Exception) -> bool:
+    """Whether a failure says the upstream is unhealthy (timeouts, resets, 5xx, 429) rather than the request being bad"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+def twitter_fault(error: Exception) -> bool:
+    """As upstream_fault, except 429s: the tweet outbox already pauses for Twitter's rate limit"""
+    return getattr(getattr(error, "response", None), "status_code", None) != 429 and upstream_fault(error)
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one upstream"""
+
+    def __init__(self, name: str, slow_ms: float, min_calls: int, window: float, is_fault=upstream_fault):
+        self.name = name
+        self.slow_ms = slow_ms
+        self.min_calls = min_calls
+        self.window = window
+        self.is_fault = is_fault
+        self.outcomes = deque()  # (time, failed, slow) for calls in the window, this worker only
+        self.failures = self.slow = self.rejected = 0
+        self.state, self.open_until, self.probe_until, self.cooldown, self.trips = "closed", 0.0, 0.0, BREAKER_COOLDOWN, 0
+        self.synced_at = 0.0
+        self.lock = threading.Lock()
+
+    def sync(self, now: float):
+        """Refresh the shared state (at most every BREAKER_SYNC_INTERVAL)"""
+        self.synced_at = now
+        try:
+            row = get_shared_db().execute(
+                "SELECT state, open_until, probe_until, cooldown, trips FROM circuit_breakers WHERE name = ?", (self.name,)
+            ).fetchone()
+        except Exception as e:
+            logger.error(f"⚠️ Circuit breaker sync error ({self.name}): {str(e)}")
+            return
+        state = row or ("closed", 0.0, 0.0, BREAKER_COOLDOWN, 0)
+        with self.lock:
+            if state[0] == "closed" and self.state != "closed":
+                self.clear_window()  # recovered: failures from before the outage no longer count
+            self.state, self.open_until, self.probe_until, self.cooldown, self.trips = state
+
+    def acquire(self) -> bool:
+        """Permission for one call; True if it is the half-open probe. Raises CircuitOpenError while open"""
+        now = time.time()
+        if now - self.synced_at >= BREAKER_SYNC_INTERVAL:
+            self.sync(now)
+        if self.state == "closed":
+            return False
+        if (self.state == "open" and now < self.open_until) or (self.state == "half_open" and now < self.probe_until):
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        # Cooldown over: exactly one call across all workers gets to test the upstream
+        cursor = get_shared_db().execute(
+            "UPDATE circuit_breakers SET state = 'half_open', probe_until = ? "
+            "WHERE name = ? AND ((state = 'open' AND open_until <= ?) OR (state = 'half_open' AND probe_until <= ?))",
+            (now + BREAKER_PROBE_TIMEOUT, self.name, now, now)
+        )
+        self.sync(now)
+        if cursor.rowcount != 1:
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        logger.info(f"🔌 {self.name} circuit half-open: probing")
+        return True
+
+    def record(self, probe: bool, failed: bool, elapsed_ms: float):
+        """Report how a permitted call went"""
+        now = time.time()
+        slow = elapsed_ms > self.slow_ms
+        if probe:
+            if failed or slow:
+                self.trip(now, min(self.cooldown * 2, BREAKER_MAX_COOLDOWN))
+            else:
+                self.close(now)
+            return
+
+        with self.lock:
+            self.outcomes.append((now, failed, slow))
+            self.failures += failed
+            self.slow += slow
+            while self.outcomes and self.outcomes[0][0] < now - self.window:
+                _, old_failed, old_slow = self.outcomes.popleft()
+                self.failures -= old_failed
+                self.slow -= old_slow
+            calls = len(self.outcomes)
+            tripped = self.state == "closed" and calls >= self.min_calls and (
+                self.failures / calls >= BREAKER_ERROR_RATE or self.slow / calls >= BREAKER_SLOW_RATE
+            )
+        if tripped:
+            self.trip(now, BREAKER_COOLDOWN)
+
+    def release(self, probe: bool):
+        """The call was abandoned without a verdict (cancelled by us): let another call probe"""
+        if probe:
+            get_shared_db().execute(
+                "UPDATE circuit_breakers SET state = 'open', open_until = ? WHERE name = ? AND state = 'half_open'",
+                (time.time(), self.name)
+            )
+            self.synced_at = 0.0
+
+    def trip(self, now: float, cooldown: float):
+        get_shared_db().execute(
+            "INSERT INTO circuit_breakers (name, state, open_until, probe_until, cooldown, trips, changed_at) "
+            "VALUES (?, 'open', ?, 0, ?, 1, ?) "
+            "ON CONFLICT(name) DO UPDATE SET state = 'open', open_until = excluded.open_until, probe_until = 0, "
+            "cooldown = excluded.cooldown, trips = circuit_breakers.trips + 1, changed_at = excluded.changed_at",
+            (self.name, now + cooldown, cooldown, now)
+        )
+        with self.lock:
+            self.clear_window()
+        self.sync(now)
+        logger.warning(f"🔌 {self.name} circuit opened for {cooldown:.0f}s")
+
+    def close(self, now: float):
+        get_shared_db().execute(
+            "UPDATE circuit_breakers SET state = 'closed', probe_until = 0, cooldown = ?, changed_at = ? WHERE name = ?",
+            (BREAKER_COOLDOWN, now, self.name)
+        )
+        self.sync(now)
+        logger.info(f"🔌 {self.name} circuit closed: upstream recovered")
+
+    def clear_window(self):
+        self.outcomes.clear()
+        self.failures = self.slow = 0
+
+    @contextmanager
+    def guard(self):
+        """Wrap one upstream call: refuses it while open, then records its outcome and latency"""
+        probe = self.acquire()
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(probe, self.is_fault(e), (time.perf_counter() - started) * 1000)
+            raise
+        except BaseException:
+            self.release(probe)
+            raise
+        self.record(probe, False, (time.perf_counter() - started) * 1000)
+
+    def stats(self) -> dict:
+        now = time.time()
+        self.sync(now)
+        with self.lock:
+            return {
+                "state": self.state,
+                "open_for": round(self.open_until - now, 1) if self.state == "open" and self.open_until > now else 0,
+                "cooldown": self.cooldown,
+                "trips": self.trips,
+                "window_calls": len(self.outcomes),
+                "window_failures": self.failures,
+                "window_slow": self.slow,
+                "slow_ms": self.slow_ms,
+                "rejected": self.rejected
+            }
+
+
+# DeepSeek/OpenAI chat latency is time to first token; the rest are whole calls
+CIRCUIT_BREAKERS = {
+    "deepseek": CircuitBreaker("deepseek", slow_ms=8000, min_calls=10, window=30),
+    "openai": CircuitBreaker("openai", slow_ms=8000, min_calls=10, window=30),
+    "dalle": CircuitBreaker("dalle", slow_ms=90000, min_calls=3, window=300),
+    "coingecko": CircuitBreaker("coingecko", slow_ms=5000, min_calls=3, window=300),
+    "twitter": CircuitBreaker("twitter", slow_ms=15000, min_calls=3, window=600, is_fault=twitter_fault)
+}
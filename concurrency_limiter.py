@@ -0,0 +1,277 @@
+"""Adaptive concurrency limits per upstream.
+
+AIMD in-flight limits (per worker), like TCP congestion control. Excess
+calls queue FIFO until a deadline; a Retry-After pause is shared by every
+worker through the store.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+
+from shared_store import get_shared_db
+
+logger = logging.getLogger(__name__)
+
+LIMITER_CHAT_MAX = int(os.getenv("LIMITER_CHAT_MAX", os.getenv("UPSTREAM_POOL_SIZE", "20")))  # in-flight ceiling per worker
+LIMITER_DALLE_MAX = int(os.getenv("LIMITER_DALLE_MAX", "4"))
+LIMITER_QUEUE_TIMEOUT = float(os.getenv("LIMITER_QUEUE_TIMEOUT", "10"))  # seconds a call may wait for a slot
+LIMITER_MAX_QUEUE = int(os.getenv("LIMITER_MAX_QUEUE", "100"))
+LIMITER_LATENCY_TOLERANCE = float(os.getenv("LIMITER_LATENCY_TOLERANCE", "2"))  # recent/usual latency ratio that backs off
+LIMITER_THROTTLE_BACKOFF = 0.5  # limit multiplier on a 429
+LIMITER_LATENCY_BACKOFF = 0.9  # limit multiplier when latency climbs
+LIMITER_DEFAULT_RETRY_AFTER = 1.0  # pause after a 429 without a Retry-After header
+LIMITER_SYNC_INTERVAL = 0.5
+
+
+class LimiterTimeout(Exception):
+    """No concurrency slot for the upstream became free before the call's deadline"""
+
+
+def throttle_retry_after(error: Exception):
+    """Seconds to back off if the error is a 429/503 throttle (Retry-After, else a default), or None"""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status not in (429, 503):
+        return None
+    header = (getattr(response, "headers", None) or {}).get("retry-after")
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return LIMITER_DEFAULT_RETRY_AFTER
+
+
+class LimiterWaiter:
+    """A queued call: a thread waiting on an Event, or a coroutine on a Future"""
+
+    __slots__ = ("event", "loop", "future", "admitted")
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+        self.admitted = False
+
+    def admit(self):
+        self.admitted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            try:
+                self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+            except RuntimeError:
+                pass  # event loop already closed
+
+
+class ConcurrencyLimiter:
+    """AIMD in-flight limit for one upstream: +1 per limit's worth of healthy calls, cut on 429s and latency spikes"""
+
+    def __init__(self, name: str, initial: int, max_limit: int):
+        self.name = name
+        self.limit = float(initial)
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.waiters = deque()
+        self.paused_until = 0.0
+        self.synced_at = 0.0
+        self.recent_ms = self.usual_ms = None
+        self.last_decrease = 0.0
+        self.counters = {"admitted": 0, "queued": 0, "queue_timeouts": 0, "throttled": 0, "decreases": 0}
+        self.lock = threading.Lock()
+
+    def sync(self, now: float):
+        """Pick up a Retry-After pause set by any worker (at most every LIMITER_SYNC_INTERVAL)"""
+        self.synced_at = now
+        try:
+            row = get_shared_db().execute("SELECT paused_until FROM upstream_pauses WHERE name = ?", (self.name,)).fetchone()
+        except Exception as e:
+            logger.error(f"⚠️ Concurrency limiter sync error ({self.name}): {str(e)}")
+            return
+        if row and row[0] > self.paused_until:
+            with self.lock:
+                self.paused_until = row[0]
+
+    def admit_waiters(self, now: float):
+        """Hand free slots to queued calls, oldest first (caller holds the lock)"""
+        while self.waiters and self.in_flight < int(self.limit) and now >= self.paused_until:
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+            self.waiters.popleft().admit()
+
+    def try_enter(self, loop=None):
+        """Take a slot now (returns None) or join the queue (returns the waiter)"""
+        now = time.time()
+        if now - self.synced_at >= LIMITER_SYNC_INTERVAL:
+            self.sync(now)
+        with self.lock:
+            if not self.waiters and self.in_flight < int(self.limit) and now >= self.paused_until:
+                self.in_flight += 1
+                self.counters["admitted"] += 1
+                return None
+            if len(self.waiters) >= LIMITER_MAX_QUEUE:
+                self.counters["queue_timeouts"] += 1
+                raise LimiterTimeout(f"{self.name} queue is full")
+            waiter = LimiterWaiter(loop)
+            self.waiters.append(waiter)
+            self.counters["queued"] += 1
+            return waiter
+
+    def congested(self) -> bool:
+        """Whether a new call would have to queue: paused by a Retry-After or already at the limit"""
+        now = time.time()
+        if now - self.synced_at >= LIMITER_SYNC_INTERVAL:
+            self.sync(now)
+        with self.lock:
+            return bool(self.waiters) or self.in_flight >= int(self.limit) or now < self.paused_until
+
+    def give_up(self, waiter: LimiterWaiter) -> bool:
+        """Leave the queue; False if a slot was handed over meanwhile (the caller now holds it)"""
+        with self.lock:
+            if waiter.admitted:
+                return False
+            self.waiters.remove(waiter)
+            self.counters["queue_timeouts"] += 1
+            return True
+
+    def next_wakeup(self, deadline: float) -> float:
+        """How long a queued call may sleep: nobody signals the end of a pause, so the queue re-checks itself"""
+        now = time.time()
+        with self.lock:
+            self.admit_waiters(now)
+            pause = self.paused_until - now
+        wakeup = min(deadline - now, LIMITER_SYNC_INTERVAL * 2)
+        if pause > 0:
+            wakeup = min(wakeup, pause)
+        return max(0.0, wakeup)
+
+    def acquire(self, timeout: float = LIMITER_QUEUE_TIMEOUT):
+        """Block until a slot is free; raises LimiterTimeout at the deadline"""
+        waiter = self.try_enter()
+        if waiter is None:
+            return
+        deadline = time.time() + timeout
+        while not waiter.event.wait(self.next_wakeup(deadline)):
+            if time.time() >= deadline and self.give_up(waiter):
+                raise LimiterTimeout(f"No {self.name} slot within {timeout:g}s")
+
+    async def acquire_async(self, timeout: float = LIMITER_QUEUE_TIMEOUT):
+        """Async variant of acquire()"""
+        waiter = self.try_enter(asyncio.get_running_loop())
+        if waiter is None:
+            return
+        deadline = time.time() + timeout
+        try:
+            while not waiter.future.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), self.next_wakeup(deadline))
+                except asyncio.TimeoutError:
+                    if time.time() >= deadline and self.give_up(waiter):
+                        raise LimiterTimeout(f"No {self.name} slot within {timeout:g}s")
+        except asyncio.CancelledError:
+            if not self.give_up(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.admit_waiters(time.time())
+
+    def record(self, latency_ms: float = None, error: Exception = None):
+        """Feed back one finished call: additive increase when healthy, multiplicative decrease when not"""
+        now = time.time()
+        retry_after = throttle_retry_after(error) if error is not None else None
+        if retry_after is not None and retry_after > 0:
+            try:
+                get_shared_db().execute(
+                    "INSERT INTO upstream_pauses (name, paused_until) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET paused_until = MAX(paused_until, excluded.paused_until)",
+                    (self.name, now + retry_after)
+                )
+            except Exception as e:
+                logger.error(f"⚠️ Concurrency limiter pause not shared ({self.name}): {str(e)}")
+        with self.lock:
+            # Calls already in flight when the upstream pushed back will fail too: cut once per round trip
+            settled = now - self.last_decrease > (self.recent_ms or 1000) / 1000
+            if retry_after is not None:
+                self.counters["throttled"] += 1
+                self.paused_until = max(self.paused_until, now + retry_after)
+                if settled:
+                    self.decrease(now, LIMITER_THROTTLE_BACKOFF)
+                    logger.warning(f"🚦 {self.name} throttled: limit {self.limit:.1f}, pausing {retry_after:.1f}s")
+                return
+            if latency_ms is None:
+                return
+            self.recent_ms = latency_ms if self.recent_ms is None else 0.7 * self.recent_ms + 0.3 * latency_ms
+            self.usual_ms = latency_ms if self.usual_ms is None else 0.98 * self.usual_ms + 0.02 * latency_ms
+            if self.recent_ms > self.usual_ms * LIMITER_LATENCY_TOLERANCE:
+                if settled:
+                    self.decrease(now, LIMITER_LATENCY_BACKOFF)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.admit_waiters(now)
+
+    def decrease(self, now: float, factor: float):
+        self.limit = max(1.0, self.limit * factor)
+        self.last_decrease = now
+        self.counters["decreases"] += 1
+
+    @contextmanager
+    def slot(self, timeout: float = LIMITER_QUEUE_TIMEOUT):
+        """Hold a slot around one whole call, feeding its latency (or throttle) back into the limit"""
+        self.acquire(timeout)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(error=e)
+            raise
+        else:
+            self.record((time.perf_counter() - started) * 1000)
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self, timeout: float = LIMITER_QUEUE_TIMEOUT):
+        """Async variant of slot()"""
+        await self.acquire_async(timeout)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(error=e)
+            raise
+        else:
+            self.record((time.perf_counter() - started) * 1000)
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self.lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "waiting": len(self.waiters),
+                "paused_for": round(self.paused_until - now, 1) if self.paused_until > now else 0,
+                "recent_ms": round(self.recent_ms, 1) if self.recent_ms is not None else None,
+                "usual_ms": round(self.usual_ms, 1) if self.usual_ms is not None else None,
+                **self.counters
+            }
+
+
+# Chat limits cover a whole stream; latency fed back is time to first token
+CONCURRENCY_LIMITERS = {
+    "deepseek": ConcurrencyLimiter("deepseek", initial=8, max_limit=LIMITER_CHAT_MAX),
+    "openai": ConcurrencyLimiter("openai", initial=8, max_limit=LIMITER_CHAT_MAX),
+    "dalle": ConcurrencyLimiter("dalle", initial=2, max_limit=LIMITER_DALLE_MAX)
+}
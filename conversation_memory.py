@@ -0,0 +1,204 @@
+"""Per-session conversation history.
+
+Turns are persisted in the shared store so any worker can continue a
+conversation; recently active sessions are cached per worker (LRU) and
+trimmed to a token budget before they are sent upstream.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shared_store import get_shared_db
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "1500"))  # history tokens sent per request
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "40"))  # kept per session and personality
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000"))  # cached per worker (LRU)
+CONVERSATION_IDLE_TTL = float(os.getenv("CONVERSATION_IDLE_TTL", str(24 * 3600)))
+CONVERSATION_TRIM_TO = float(os.getenv("CONVERSATION_TRIM_TO", "0.5"))  # share of the budget kept when the window slides
+CONVERSATION_PRUNE_INTERVAL = 60
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return max(1, len(text) // 4)
+
+
+class ChatMessage:
+    """One stored conversation message"""
+
+    __slots__ = ("id", "role", "content", "tokens")
+
+    def __init__(self, message_id: int, role: str, content: str, tokens: int):
+        self.id = message_id
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+
+class Conversation:
+    """Cached tail of one session's history for one personality"""
+
+    __slots__ = ("messages", "last_id")
+
+    def __init__(self):
+        self.messages = []
+        self.last_id = 0
+
+
+class ConversationMemory:
+    """Per-session chat history with LRU-cached sessions and token-budgeted prompts"""
+
+    def __init__(self, max_sessions: int, max_messages: int):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.last_prune = 0.0
+
+    def load(self, session_id: str, personality: str) -> list:
+        """Return the session's messages, pulling turns other workers stored since the last read
+
+        Ids only ever grow, so the oldest id still stored tells whether any worker
+        cleared, pruned or trimmed the session since: cached messages below it are gone.
+        """
+        key = (session_id, personality)
+        with self.lock:
+            conversation = self.sessions.get(key)
+            if conversation is None:
+                conversation = self.sessions[key] = Conversation()
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            last_id = conversation.last_id
+
+        db = get_shared_db()
+        (first_id,) = db.execute(
+            "SELECT MIN(id) FROM conversation_messages WHERE session_id = ? AND personality = ?",
+            (session_id, personality)
+        ).fetchone()
+        rows = db.execute(
+            "SELECT id, role, content, tokens FROM conversation_messages "
+            "WHERE session_id = ? AND personality = ? AND id > ? ORDER BY id",
+            (session_id, personality, last_id)
+        ).fetchall()
+        with self.lock:
+            if first_id is None:
+                conversation.messages.clear()
+            elif conversation.messages and conversation.messages[0].id < first_id:
+                conversation.messages = [message for message in conversation.messages if message.id >= first_id]
+            for row in rows:
+                if row[0] > conversation.last_id:
+                    conversation.messages.append(ChatMessage(*row))
+                    conversation.last_id = row[0]
+            del conversation.messages[:-self.max_messages]
+            return list(conversation.messages)
+
+    def history(self, session_id: str, personality: str, budget: int = CONVERSATION_TOKEN_BUDGET,
+                update_window: bool = True) -> list:
+        """Whole turns from the session's window start that fit in the token budget, oldest first
+
+        The window start only moves once the window outgrows the budget, and then
+        jumps far enough to leave CONVERSATION_TRIM_TO of it, so consecutive
+        requests share a byte-identical prefix that DeepSeek serves from its
+        prompt cache instead of shifting by one turn every time. With
+        update_window=False the moved start is only computed (read-only views).
+        """
+        messages = self.load(session_id, personality)
+        turns = []  # newest first
+        # Walk back one (user, assistant) turn at a time so no reply loses its question
+        for index in range(len(messages) - 1, 0, -2):
+            user, assistant = messages[index - 1], messages[index]
+            if user.role != "user" or assistant.role != "assistant":
+                break
+            turns.append((user, assistant))
+
+        db = get_shared_db()
+        row = db.execute(
+            "SELECT start_id FROM conversation_windows WHERE session_id = ? AND personality = ?",
+            (session_id, personality)
+        ).fetchone()
+        window = [turn for turn in turns if turn[0].id >= (row[0] if row else 0)]
+        if sum(user.tokens + assistant.tokens for user, assistant in window) > budget:
+            window, used = [], 0
+            for turn in turns:
+                used += turn[0].tokens + turn[1].tokens
+                if used > (budget * CONVERSATION_TRIM_TO if window else budget):
+                    break
+                window.append(turn)
+            start_id = window[-1][0].id if window else turns[0][1].id + 1
+            if update_window:
+                db.execute(
+                    "INSERT INTO conversation_windows (session_id, personality, start_id) VALUES (?, ?, ?) "
+                    "ON CONFLICT (session_id, personality) DO UPDATE SET start_id = excluded.start_id",
+                    (session_id, personality, start_id)
+                )
+        return [message for turn in reversed(window) for message in turn]
+
+    def record(self, session_id: str, personality: str, prompt: str, reply: str):
+        """Store one completed turn"""
+        now = time.time()
+        db = get_shared_db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT INTO conversation_messages (session_id, personality, role, content, tokens, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (session_id, personality, "user", prompt, estimate_tokens(prompt), now),
+                    (session_id, personality, "assistant", reply, estimate_tokens(reply), now)
+                ]
+            )
+            db.execute(
+                "DELETE FROM conversation_messages WHERE session_id = ? AND personality = ? AND id NOT IN "
+                "(SELECT id FROM conversation_messages WHERE session_id = ? AND personality = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, personality, session_id, personality, self.max_messages)
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        if now - self.last_prune > CONVERSATION_PRUNE_INTERVAL:
+            self.last_prune = now
+            self.prune(now)
+
+    def prune(self, now: float):
+        """Forget sessions idle for longer than CONVERSATION_IDLE_TTL"""
+        get_shared_db().execute(
+            "DELETE FROM conversation_messages WHERE (session_id, personality) IN ("
+            "SELECT session_id, personality FROM conversation_messages "
+            "GROUP BY session_id, personality HAVING MAX(created_at) < ?)",
+            (now - CONVERSATION_IDLE_TTL,)
+        )
+        get_shared_db().execute(
+            "DELETE FROM conversation_windows WHERE (session_id, personality) NOT IN ("
+            "SELECT DISTINCT session_id, personality FROM conversation_messages)"
+        )
+
+    def clear(self, session_id: str):
+        get_shared_db().execute("DELETE FROM conversation_messages WHERE session_id = ?", (session_id,))
+        get_shared_db().execute("DELETE FROM conversation_windows WHERE session_id = ?", (session_id,))
+        with self.lock:
+            for key in [key for key in self.sessions if key[0] == session_id]:
+                del self.sessions[key]
+
+
+conversation_memory = ConversationMemory(CONVERSATION_MAX_SESSIONS, CONVERSATION_MAX_MESSAGES)
+
+
+def load_history(session_id, personality: str) -> list:
+    """Budgeted history for a request (empty for callers without a session)"""
+    return conversation_memory.history(session_id, personality) if session_id else []
+
+
+def remember_turn(session_id, personality: str, prompt: str, reply: str):
+    """Record a DeepSeek exchange in the session's history"""
+    if session_id and reply:
+        try:
+            conversation_memory.record(session_id, personality, prompt, reply)
+        except Exception as e:
+            logger.error(f"⚠️ Conversation memory write failed: {str(e)}")
@@ -0,0 +1,45 @@
+"""Gunicorn settings for production (picked up automatically from the working directory).
+
+    gunicorn            # or: gunicorn -c gunicorn.conf.py
+
+The app is IO-bound (DeepSeek, DALL·E, CoinGecko, Twitter), so a few
+preloaded gthread workers with many threads each beat many sync workers:
+the master imports app.py and its heavy dependencies once, workers share
+those pages copy-on-write, and each worker builds its own network clients
+in post_fork.
+"""
+import multiprocessing
+import os
+
+wsgi_app = "app:create_app()"
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5001')}")
+
+preload_app = True
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count() * 2, 8))))
+# Threads mostly wait on upstream sockets; each open SSE stream (/chat/stream, /prices/stream) holds one,
+# and /prices/stream takes at most PRICE_STREAM_MAX_SUBSCRIBERS of them per worker
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# DALL·E 3 HD renders can take a minute; streaming responses send bytes while they work
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to bound slow leaks, staggered so they don't restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+
+# Heartbeat files on tmpfs so a slow disk can't get workers killed
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    """Give each worker its own HTTP pools, Twitter client and background threads"""
+    from app import init_worker
+
+    init_worker()
@@ -0,0 +1,61 @@
+"""Pillow post-processing for generated images.
+
+Runs inside the image process pool, so it only imports Pillow and stays
+independent of the Flask app module. Pillow itself is imported on first
+use so that importing OUTPUT_FORMATS from the web app stays cheap.
+"""
+import hashlib
+import time
+from io import BytesIO
+
+# format name -> (file extension, Pillow encoder, encoder options)
+OUTPUT_FORMATS = {
+    "png": ("png", "PNG", {}),
+    "webp": ("webp", "WEBP", {"quality": 85, "method": 4}),
+    "jpeg": ("jpg", "JPEG", {"quality": 88, "optimize": True}),
+}
+
+
+def encode_image(img, output_format: str) -> bytes:
+    """Encode a PIL image in one of OUTPUT_FORMATS"""
+    _, encoder, options = OUTPUT_FORMATS[output_format]
+    if encoder == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buffer = BytesIO()
+    img.save(buffer, format=encoder, **options)
+    return buffer.getvalue()
+
+
+def process_image(content: bytes, output_format: str = "png", thumb_size: int = 256) -> dict:
+    """Hash, decode, downscale and encode a downloaded render, timing each stage"""
+    from PIL import Image
+
+    timings = {}
+
+    started = time.perf_counter()
+    digest = hashlib.sha256(content).hexdigest()
+    img = Image.open(BytesIO(content))
+    if output_format == "png":
+        # Full size is kept as downloaded, so JPEG sources can decode at a reduced scale (no-op for PNG)
+        img.draft("RGB", (thumb_size * 2, thumb_size * 2))
+    img.load()
+    timings["decode_ms"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    # reducing_gap lets Pillow use the fast integer reduce() before the final LANCZOS pass
+    thumbnail = img.resize((thumb_size, thumb_size), Image.LANCZOS, reducing_gap=2.0)
+    timings["resize_ms"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    # The PNG download is kept byte-for-byte; other formats are re-encoded to save space
+    full = content if output_format == "png" else encode_image(img, output_format)
+    thumb = encode_image(thumbnail, output_format)
+    timings["encode_ms"] = (time.perf_counter() - started) * 1000
+
+    return {
+        "digest": digest,
+        "format": output_format,
+        "full": full,
+        "thumb": thumb,
+        "timings": timings,
+    }
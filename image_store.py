@@ -0,0 +1,121 @@
+"""Content-addressed store for generated images.
+
+Renders are kept as <sha256>.<ext> plus <sha256>.thumb.<ext> on disk and
+indexed in the shared store by prompt, so any worker can serve or reuse
+them. The least recently used are evicted once the total size is over
+IMAGE_STORE_MAX_BYTES.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from image_processing import OUTPUT_FORMATS
+from shared_store import get_shared_db
+
+logger = logging.getLogger(__name__)
+
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "png").lower()
+IMAGE_MIMETYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+if IMAGE_OUTPUT_FORMAT not in OUTPUT_FORMATS:
+    raise ValueError(f"❌ IMAGE_OUTPUT_FORMAT must be one of {', '.join(OUTPUT_FORMATS)}")
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(tempfile.gettempdir(), "deep_persona_images"))
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(500 * 1024 * 1024)))
+IMAGE_VARIANTS = ("full", "thumb")
+
+
+def image_prompt_key(image_prompt: str) -> str:
+    return hashlib.sha256(image_prompt.encode("utf-8")).hexdigest()
+
+
+def stored_image_path(digest: str, variant: str = "full", output_format: str = "png") -> str:
+    suffix = "" if variant == "full" else f".{variant}"
+    return os.path.join(IMAGE_STORE_DIR, digest[:2], f"{digest}{suffix}.{OUTPUT_FORMATS[output_format][0]}")
+
+
+def find_stored_image(digest: str, variant: str = "full"):
+    """Return (path, mimetype) of a stored render in whichever format it was saved, or None"""
+    for output_format in [IMAGE_OUTPUT_FORMAT] + [f for f in OUTPUT_FORMATS if f != IMAGE_OUTPUT_FORMAT]:
+        path = stored_image_path(digest, variant, output_format)
+        if os.path.exists(path):
+            return path, IMAGE_MIMETYPES[output_format]
+    return None
+
+
+def stored_image_url(digest: str) -> str:
+    return f"/images/{digest}"
+
+
+def lookup_stored_image(image_prompt: str):
+    """Return the digest already rendered for this exact prompt+style, if it is still on disk"""
+    row = get_shared_db().execute(
+        "SELECT digest FROM image_prompts WHERE prompt_key = ?", (image_prompt_key(image_prompt),)
+    ).fetchone()
+    if row and find_stored_image(row[0]):
+        touch_stored_image(row[0])
+        return row[0]
+    return None
+
+
+def touch_stored_image(digest: str):
+    get_shared_db().execute("UPDATE image_files SET last_access = ? WHERE digest = ?", (time.time(), digest))
+
+
+def store_image(image_prompt: str, processed: dict) -> str:
+    """Persist the full-size and thumbnail renders under the content hash"""
+    digest = processed["digest"]
+    os.makedirs(os.path.dirname(stored_image_path(digest)), exist_ok=True)
+    for variant in IMAGE_VARIANTS:
+        path = stored_image_path(digest, variant, processed["format"])
+        if not os.path.exists(path):
+            # Write-then-rename so concurrent workers never serve a partial file
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(processed[variant])
+            os.replace(temp_path, path)
+
+    db = get_shared_db()
+    now = time.time()
+    db.execute(
+        "INSERT OR REPLACE INTO image_files (digest, size_bytes, last_access) VALUES (?, ?, ?)",
+        (digest, len(processed["full"]) + len(processed["thumb"]), now)
+    )
+    db.execute(
+        "INSERT OR REPLACE INTO image_prompts (prompt_key, digest, created_at) VALUES (?, ?, ?)",
+        (image_prompt_key(image_prompt), digest, now)
+    )
+    evict_image_store()
+    return digest
+
+
+def save_rendered_image(image_prompt: str, image_url: str, processed: dict) -> str:
+    """Store a fresh render and return its local URL (the upstream URL if the disk write fails)"""
+    try:
+        return stored_image_url(store_image(image_prompt, processed))
+    except Exception as e:
+        logger.error(f"⚠️ Image store write failed: {str(e)}")
+        return image_url
+
+
+def evict_image_store():
+    """Delete least-recently-used images until the store fits IMAGE_STORE_MAX_BYTES"""
+    db = get_shared_db()
+    (total,) = db.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM image_files").fetchone()
+    while total > IMAGE_STORE_MAX_BYTES:
+        victims = db.execute("SELECT digest, size_bytes FROM image_files ORDER BY last_access LIMIT 16").fetchall()
+        if not victims:
+            return
+        for digest, size_bytes in victims:
+            for variant in IMAGE_VARIANTS:
+                for output_format in OUTPUT_FORMATS:
+                    try:
+                        os.remove(stored_image_path(digest, variant, output_format))
+                    except FileNotFoundError:
+                        pass
+            db.execute("DELETE FROM image_files WHERE digest = ?", (digest,))
+            db.execute("DELETE FROM image_prompts WHERE digest = ?", (digest,))
+            logger.info(f"🧹 Evicted stored image {digest}")
+            total -= size_bytes
+            if total <= IMAGE_STORE_MAX_BYTES:
+                return
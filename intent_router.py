@@ -0,0 +1,105 @@
+"""Keyword intent routing in a single regex pass.
+
+Every trigger vocabulary is merged into one pattern built from a prefix
+trie, so a message is scanned once no matter how many triggers exist and
+each position costs at most the depth of the trie. Terms match on word
+boundaries and also match their plural (+s / +es).
+"""
+import re
+
+
+class IntentMatch:
+    """Intents found in one message, highest priority first, with the terms that matched"""
+
+    __slots__ = ("intents", "terms")
+
+    def __init__(self, intents: tuple, terms: dict):
+        self.intents = intents
+        self.terms = terms
+
+    def __contains__(self, intent: str) -> bool:
+        return intent in self.terms
+
+    def __bool__(self) -> bool:
+        return bool(self.intents)
+
+    def __repr__(self) -> str:
+        return f"IntentMatch({self.intents!r})"
+
+    @property
+    def primary(self):
+        return self.intents[0] if self.intents else None
+
+
+def trie_pattern(terms) -> str:
+    """Regex alternation for the terms, factored on shared prefixes"""
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A term ending here makes the rest optional; greedy, so the longest term wins ("eth" vs "ethereum")
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class IntentRouter:
+    """Register vocabularies with add(), then classify() messages"""
+
+    def __init__(self):
+        self.intents = {}  # name -> (priority, vocabulary groups that must all match)
+        self.term_groups = {}  # term -> {group name}
+        self.ranked = []  # (name, groups), highest priority first
+        self.pattern = None
+
+    def add(self, name: str, triggers, priority: int = 0, requires=None):
+        """Register an intent; with `requires`, a term from that vocabulary must also appear"""
+        groups = [self._add_vocabulary(name, triggers)]
+        if requires is not None:
+            groups.append(self._add_vocabulary(f"{name}:requires", requires))
+        self.intents[name] = (priority, tuple(groups))
+        self.pattern = None
+        return self
+
+    def _add_vocabulary(self, group: str, terms) -> str:
+        for term in terms:
+            term = " ".join(term.lower().split())
+            if term:
+                self.term_groups.setdefault(term, set()).add(group)
+        return group
+
+    def compile(self):
+        # Spaces inside a term accept any run of whitespace
+        body = trie_pattern(self.term_groups).replace(r"\ ", r"\s+")
+        self.pattern = re.compile(rf"(?<!\w)({body})(?:e?s)?(?!\w)")
+        ranked = sorted(self.intents.items(), key=lambda item: -item[1][0])
+        self.ranked = [(name, groups) for name, (_, groups) in ranked]
+        return self
+
+    def classify(self, message: str) -> IntentMatch:
+        """Every intent satisfied by the message, in one scan"""
+        if self.pattern is None:
+            self.compile()
+        found = {}
+        for term in self.pattern.findall(message.lower()):
+            groups = self.term_groups.get(term)
+            if groups is None:
+                term = " ".join(term.split())  # matched across a run of whitespace
+                groups = self.term_groups[term]
+            for group in groups:
+                found.setdefault(group, []).append(term)
+
+        terms = {}
+        if found:
+            for name, groups in self.ranked:
+                if all(group in found for group in groups):
+                    terms[name] = [term for group in groups for term in found[group]]
+        return IntentMatch(tuple(terms), terms)
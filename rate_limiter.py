@@ -0,0 +1,105 @@
+"""Token-bucket rate limits per session and per client IP.
+
+The buckets live in the shared store so the limits hold across workers.
+Each route spends its cost in units; a chat that turns into an image pays
+for the image.
+"""
+import logging
+import os
+import time
+
+from shared_store import get_shared_db
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_SESSION_BURST = float(os.getenv("RATE_LIMIT_SESSION_BURST", "30"))  # units a session may spend at once
+RATE_LIMIT_SESSION_RATE = float(os.getenv("RATE_LIMIT_SESSION_RATE", "0.5"))  # units refilled per second
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "120"))  # shared by everyone behind one address
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", "2"))
+RATE_LIMIT_COSTS = {
+    "chat": float(os.getenv("RATE_LIMIT_CHAT_COST", "1")),
+    "image": float(os.getenv("RATE_LIMIT_IMAGE_COST", "10")),
+    "preview": float(os.getenv("RATE_LIMIT_PREVIEW_COST", "2")),
+    "tweet": float(os.getenv("RATE_LIMIT_TWEET_COST", "5"))
+}
+RATE_LIMIT_PRUNE_INTERVAL = 300
+if 3 * RATE_LIMIT_COSTS["image"] > min(RATE_LIMIT_SESSION_BURST, RATE_LIMIT_IP_BURST):
+    raise ValueError("❌ RATE_LIMIT_SESSION_BURST and RATE_LIMIT_IP_BURST must cover /test_image (three images)")
+_rate_limit_pruned = {"at": 0.0}
+
+
+class RateLimitDecision:
+    """Outcome of charging one request, as RateLimit-* / Retry-After headers (for the tighter bucket)"""
+
+    __slots__ = ("allowed", "limit", "remaining", "reset", "retry_after")
+
+    def __init__(self, allowed: bool, limit: float, remaining: float, reset: float, retry_after: float):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+
+    def headers(self) -> dict:
+        headers = {
+            "RateLimit-Limit": str(int(self.limit)),
+            "RateLimit-Remaining": str(int(self.remaining)),
+            "RateLimit-Reset": str(int(-(-self.reset // 1)))
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, int(-(-self.retry_after // 1))))
+        return headers
+
+
+def take_rate_limit(session_id, client_ip, cost: float):
+    """Spend `cost` from the session's and the IP's buckets, all or nothing; None when limiting is off"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    buckets = [(f"ip:{client_ip}", RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_RATE)]
+    if session_id:
+        buckets.append((f"sid:{session_id}", RATE_LIMIT_SESSION_BURST, RATE_LIMIT_SESSION_RATE))
+    now = time.time()
+    try:
+        db = get_shared_db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for key, burst, rate in buckets:
+                row = db.execute("SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+                levels.append(burst if row is None else min(burst, row[0] + (now - row[1]) * rate))
+            allowed = all(tokens >= cost for tokens in levels)
+            if allowed:
+                levels = [tokens - cost for tokens in levels]
+                db.executemany(
+                    "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    [(key, tokens, now) for (key, _, _), tokens in zip(buckets, levels)]
+                )
+            if now - _rate_limit_pruned["at"] > RATE_LIMIT_PRUNE_INTERVAL:
+                # A bucket untouched this long has refilled completely, so its row says nothing
+                _rate_limit_pruned["at"] = now
+                full_after = max(RATE_LIMIT_IP_BURST / RATE_LIMIT_IP_RATE, RATE_LIMIT_SESSION_BURST / RATE_LIMIT_SESSION_RATE)
+                db.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - full_after,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    except Exception as e:
+        # The limiter protects upstream quota; it must not take the app down with the store
+        logger.error(f"⚠️ Rate limit check failed, allowing request: {str(e)}")
+        return None
+
+    (key, burst, rate), tokens = min(zip(buckets, levels), key=lambda item: item[1] / item[0][1])
+    retry_after = max(max(0.0, cost - level) / bucket_rate for (_, _, bucket_rate), level in zip(buckets, levels))
+    decision = RateLimitDecision(allowed, burst, max(0.0, tokens), (burst - tokens) / rate, retry_after)
+    if not allowed:
+        logger.warning(f"🚧 Rate limited {key} (cost {cost:g}, retry in {retry_after:.1f}s)")
+    return decision
+
+
+def rate_limited_response(decision: RateLimitDecision) -> dict:
+    return {
+        "error": "Rate limit exceeded",
+        "response": f"⚠️ Slow down - try again in {max(1, int(-(-decision.retry_after // 1)))}s",
+        "retry_after": round(decision.retry_after, 1)
+    }
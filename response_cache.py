@@ -0,0 +1,271 @@
+"""DeepSeek reply caches: exact match and near-duplicate.
+
+The exact cache is a per-worker LRU with TTL whose invalidations are shared
+through the store. The semantic cache embeds prompts as hashed n-gram
+vectors (numpy, imported on first use) and only answers when the content
+words match too.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from shared_store import get_shared_db
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+
+
+class ResponseCache:
+    """LRU cache of DeepSeek replies with per-entry expiry and hit/miss counters"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (created_at, personality, text)
+        self.invalidated = {}  # personality ("*" = all) -> timestamp, synced from the shared store
+        self.synced_at = 0.0
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def sync_invalidations(self):
+        """Pick up invalidations issued through any worker (at most once per second)"""
+        now = time.time()
+        if now - self.synced_at < 1:
+            return
+        self.synced_at = now
+        try:
+            rows = get_shared_db().execute("SELECT personality, invalidated_at FROM cache_invalidations").fetchall()
+            self.invalidated = dict(rows)
+        except Exception as e:
+            logger.error(f"⚠️ Cache invalidation sync error: {str(e)}")
+
+    def invalidation_cutoff(self, personality: str) -> float:
+        """Entries created at or before this time have been invalidated"""
+        return max(self.invalidated.get(personality, 0.0), self.invalidated.get("*", 0.0))
+
+    def get(self, key: str):
+        self.sync_invalidations()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                created_at, personality, text = entry
+                if created_at + self.ttl < time.time() or created_at <= self.invalidation_cutoff(personality):
+                    del self.entries[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def set(self, key: str, personality: str, text: str):
+        with self.lock:
+            self.entries[key] = (time.time(), personality, text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, personality: str = None) -> int:
+        """Drop entries here and tell the other workers to do the same"""
+        now = time.time()
+        get_shared_db().execute(
+            "INSERT OR REPLACE INTO cache_invalidations (personality, invalidated_at) VALUES (?, ?)",
+            (personality or "*", now)
+        )
+        with self.lock:
+            self.invalidated[personality or "*"] = now
+            keys = [key for key, entry in self.entries.items() if personality is None or entry[1] == personality]
+            for key in keys:
+                del self.entries[key]
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase and collapse whitespace so trivially different prompts share a cache key"""
+    return " ".join(prompt.lower().split())
+
+
+def sampling_params_key(request_args: dict) -> str:
+    """Stable string for the model and sampling parameters of a request"""
+    return json.dumps({name: value for name, value in request_args.items() if name != "messages"}, sort_keys=True)
+
+
+def response_cache_key(personality: str, prompt: str, request_args: dict) -> str:
+    """Key on the personality's prompt prefix, any earlier turns, the normalized user prompt and the sampling parameters"""
+    raw = json.dumps([
+        request_args["messages"][:-1],
+        normalize_prompt(prompt),
+        sampling_params_key(request_args)
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Semantic (near-duplicate) response cache: hashed n-gram vectors, one matrix per personality
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "500"))
+SEMANTIC_DIM = 4096
+SEMANTIC_ALIASES = {
+    "btc": "bitcoin", "eth": "ethereum", "sol": "solana",
+    "whats": "what is", "what's": "what is", "u": "you", "ur": "your"
+}
+
+
+# Filler and ways of asking ("what is", "explain", "tell me about") that never change what is being
+# asked; everything else (including "not", "or" and "who"/"why"/"how") is a content word that must
+# match exactly for a near-duplicate hit
+SEMANTIC_STOPWORDS = frozenset({
+    "a", "an", "the", "is", "are", "was", "were", "be", "do", "does", "can", "could", "would",
+    "please", "pls", "me", "tell", "you", "i", "to", "of", "hey", "hi", "what", "explain", "about"
+})
+
+
+def semantic_words(prompt: str) -> list:
+    """Normalized, alias-expanded words of a prompt"""
+    text = re.sub(r"[^\w\s']", " ", normalize_prompt(prompt))
+    return " ".join(SEMANTIC_ALIASES.get(word, word) for word in text.split()).replace("'", "").split()
+
+
+def content_words(words) -> list:
+    """Content words in order, plural-folded ("prices" == "price"); all words if there are none"""
+    return [
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in words if word not in SEMANTIC_STOPWORDS
+    ] or words
+
+
+def embed_prompt(prompt: str):
+    """Embed a prompt as (L2-normalized hashed bag of content words and their bigrams, content terms)
+
+    Long prompts that differ in one decisive word ("a poem about shakespeare" /
+    "... eminem") still score high, so a hit also needs the same content terms. With
+    the terms equal, the bigrams make the score about word order: "is bitcoin better
+    than ethereum" and "is ethereum better than bitcoin" share every term but miss.
+    """
+    import numpy as np
+
+    words = content_words(semantic_words(prompt))
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    buckets = np.fromiter((zlib.crc32(f.encode("utf-8")) % SEMANTIC_DIM for f in features), dtype=np.int64, count=len(features))
+    vector = np.bincount(buckets, minlength=SEMANTIC_DIM).astype(np.float32)
+    np.log1p(vector, out=vector)  # sublinear term frequency
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector), frozenset(words)
+
+
+class SemanticIndex:
+    """Fixed-capacity vector matrix for one personality; evicts the least recently used row"""
+
+    def __init__(self, capacity: int):
+        import numpy as np
+
+        self.vectors = np.zeros((capacity, SEMANTIC_DIM), dtype=np.float32)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.entries = [None] * capacity  # (created_at, params_key, content terms, text)
+        self.size = 0
+
+    def search(self, embedding, params_key: str, cutoff: float):
+        """Best live entry with the same content terms: (text, score), or (None, best score) if none qualifies"""
+        if not self.size:
+            return None, 0.0
+        vector, terms = embedding
+        scores = self.vectors[:self.size] @ vector
+        for row in scores.argsort()[::-1][:3]:
+            created_at, entry_params, entry_terms, text = self.entries[row]
+            if entry_params == params_key and created_at > cutoff and entry_terms == terms:
+                self.last_used[row] = time.time()
+                return text, float(scores[row])
+        return None, float(scores.max())
+
+    def add(self, embedding, params_key: str, text: str):
+        vector, terms = embedding
+        row = self.size if self.size < len(self.entries) else int(self.last_used.argmin())
+        self.size = max(self.size, row + 1)
+        self.vectors[row] = vector
+        self.last_used[row] = time.time()
+        self.entries[row] = (time.time(), params_key, terms, text)
+
+
+class SemanticCache:
+    """Near-duplicate prompt cache with hit-rate and lookup-latency stats"""
+
+    def __init__(self, capacity: int, threshold: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.lookup_seconds = 0.0
+        self.max_lookup_seconds = 0.0
+
+    def get(self, personality: str, embedding, params_key: str, cutoff: float):
+        started = time.perf_counter()
+        with self.lock:
+            index = self.indexes.get(personality)
+            text, score = index.search(embedding, params_key, cutoff) if index else (None, 0.0)
+            if text is not None and score >= self.threshold:
+                self.hits += 1
+            else:
+                text = None
+                self.misses += 1
+            elapsed = time.perf_counter() - started
+            self.lookup_seconds += elapsed
+            self.max_lookup_seconds = max(self.max_lookup_seconds, elapsed)
+        return text
+
+    def add(self, personality: str, embedding, params_key: str, text: str):
+        with self.lock:
+            if personality not in self.indexes:
+                self.indexes[personality] = SemanticIndex(self.capacity)
+            self.indexes[personality].add(embedding, params_key, text)
+
+    def invalidate(self, personality: str = None):
+        with self.lock:
+            if personality is None:
+                self.indexes.clear()
+            else:
+                self.indexes.pop(personality, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "personalities": len(self.indexes),
+                "entries": sum(index.size for index in self.indexes.values()),
+                "capacity_per_personality": self.capacity,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "avg_lookup_us": round(self.lookup_seconds / lookups * 1e6, 1) if lookups else 0.0,
+                "max_lookup_us": round(self.max_lookup_seconds * 1e6, 1)
+            }
+
+
+semantic_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
@@ -0,0 +1,178 @@
+"""Cross-worker state in one SQLite file.
+
+Every gunicorn worker opens its own connection (one per thread) to the
+same WAL-mode database, so leases, breakers, rate buckets, job state and
+the tweet outbox are shared without a separate server process.
+"""
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+
+SHARED_DB_PATH = os.getenv("SHARED_DB_PATH", os.path.join(tempfile.gettempdir(), "deep_persona.db"))
+SHARED_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS price_snapshot (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    payload TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inflight (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    result TEXT
+);
+CREATE TABLE IF NOT EXISTS image_jobs (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    personality TEXT NOT NULL,
+    tweet INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    image_url TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS image_jobs_by_session ON image_jobs (session_id, status);
+CREATE INDEX IF NOT EXISTS image_jobs_by_owner ON image_jobs (owner, status, created_at);
+CREATE INDEX IF NOT EXISTS image_jobs_by_age ON image_jobs (created_at);
+CREATE TABLE IF NOT EXISTS image_files (
+    digest TEXT PRIMARY KEY,
+    size_bytes INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS image_prompts (
+    prompt_key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache_invalidations (
+    personality TEXT PRIMARY KEY,
+    invalidated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tweet_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    tweet_id TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tweet_outbox_due ON tweet_outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS tweet_outbox_by_hash ON tweet_outbox (text_hash, created_at);
+CREATE TABLE IF NOT EXISTS tweet_rate_limit (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    blocked_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversation_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    personality TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversation_by_session ON conversation_messages (session_id, personality, id);
+CREATE INDEX IF NOT EXISTS conversation_by_age ON conversation_messages (created_at);
+CREATE TABLE IF NOT EXISTS circuit_breakers (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    open_until REAL NOT NULL,
+    probe_until REAL NOT NULL,
+    cooldown REAL NOT NULL,
+    trips INTEGER NOT NULL,
+    changed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversation_windows (
+    session_id TEXT NOT NULL,
+    personality TEXT NOT NULL,
+    start_id INTEGER NOT NULL,
+    PRIMARY KEY (session_id, personality)
+);
+CREATE TABLE IF NOT EXISTS upstream_pauses (
+    name TEXT PRIMARY KEY,
+    paused_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS token_usage (
+    day TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    personality TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    estimated INTEGER NOT NULL,
+    PRIMARY KEY (day, session_id, personality)
+);
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+_db_local = threading.local()
+_background_threads = {}
+_background_lock = threading.Lock()
+
+
+def get_shared_db() -> sqlite3.Connection:
+    """Return this thread's connection to the shared store"""
+    conn = getattr(_db_local, "conn", None)
+    if conn is None or _db_local.pid != os.getpid():
+        conn = sqlite3.connect(SHARED_DB_PATH, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SHARED_DB_SCHEMA)
+        _db_local.conn, _db_local.pid = conn, os.getpid()
+    return conn
+
+
+def close_shared_db():
+    """Close this thread's shared-store connection (the gunicorn master does this before forking)"""
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _db_local.conn = None
+
+
+def ensure_background_thread(name: str, target):
+    """Start a named daemon thread once per process (again in each forked worker)"""
+    if _background_threads.get(name) == os.getpid():
+        return
+    with _background_lock:
+        if _background_threads.get(name) != os.getpid():
+            threading.Thread(target=target, name=name, daemon=True).start()
+            _background_threads[name] = os.getpid()
+
+
+def process_owner_id() -> str:
+    """Identify this worker process in shared-store rows"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def acquire_lease(name: str, ttl: float) -> bool:
+    """Take or renew a named cross-worker lease; True if this process holds it"""
+    now = time.time()
+    owner = process_owner_id()
+    cursor = get_shared_db().execute(
+        "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+        "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+        (name, owner, now + ttl, now)
+    )
+    return cursor.rowcount == 1
@@ -0,0 +1,211 @@
+"""Single-flight coalescing of identical upstream calls.
+
+Concurrent callers with the same key share one call: followers in the same
+worker wait on the leader directly, followers in other workers poll the
+shared store for its result.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+from shared_store import get_shared_db, process_owner_id
+
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "60"))
+SINGLE_FLIGHT_GRACE = 2.0  # seconds a finished result stays claimable by late followers in other workers
+SINGLE_FLIGHT_POLL = 0.1
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its reply was ready"""
+
+
+class Flight:
+    """One in-progress upstream call that local followers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Run a call once per key; concurrent callers with the same key receive the leader's result"""
+
+    def __init__(self):
+        self.flights = {}
+        self.async_flights = {}
+        self.async_followers = {}
+        self.lock = threading.Lock()
+        self.counters = {"leader_calls": 0, "local_waiters": 0, "remote_waiters": 0, "remote_timeouts": 0}
+
+    def count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    # Cross-worker coordination through the shared store
+    def claim(self, key: str) -> bool:
+        now = time.time()
+        db = get_shared_db()
+        db.execute("DELETE FROM inflight WHERE expires_at < ?", (now - SINGLE_FLIGHT_TIMEOUT,))
+        cursor = db.execute(
+            "INSERT INTO inflight (key, owner, expires_at, done, result) VALUES (?, ?, ?, 0, NULL) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at, done = 0, result = NULL "
+            "WHERE inflight.expires_at < ?",
+            (key, process_owner_id(), now + SINGLE_FLIGHT_TIMEOUT, now)
+        )
+        return cursor.rowcount == 1
+
+    def poll(self, key: str):
+        """Return (finished, result) for a flight led by another worker"""
+        row = get_shared_db().execute("SELECT done, result FROM inflight WHERE key = ?", (key,)).fetchone()
+        if row and row[0]:
+            return True, json.loads(row[1])
+        return False, None
+
+    def publish(self, key: str, result):
+        get_shared_db().execute(
+            "UPDATE inflight SET done = 1, result = ?, expires_at = ? WHERE key = ? AND owner = ?",
+            (json.dumps(result), time.time() + SINGLE_FLIGHT_GRACE, key, process_owner_id())
+        )
+
+    def release(self, key: str):
+        get_shared_db().execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, process_owner_id()))
+
+    def wait_for_remote(self, key: str, deadline: float):
+        """Block until this worker may lead (False, None) or another worker's result arrives (True, result)"""
+        while not self.claim(key):
+            finished, result = self.poll(key)
+            if finished:
+                self.count("remote_waiters")
+                return True, result
+            if time.time() > deadline:
+                self.count("remote_timeouts")
+                return False, None
+            time.sleep(SINGLE_FLIGHT_POLL)
+        return False, None
+
+    def lead(self, key: str, fn):
+        """Run fn as the cross-worker leader and publish its (JSON-serializable) result"""
+        finished, result = self.wait_for_remote(key, time.time() + SINGLE_FLIGHT_TIMEOUT)
+        if finished:
+            return result
+        self.count("leader_calls")
+        try:
+            result = fn()
+        except Exception:
+            self.release(key)
+            raise
+        self.publish(key, result)
+        return result
+
+    def has_followers(self, key: str) -> bool:
+        """Whether other requests in this worker are waiting on the flight for key"""
+        with self.lock:
+            flight = self.flights.get(key)
+            return bool(flight and flight.followers) or bool(self.async_followers.get(key))
+
+    def do(self, key: str, fn):
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = Flight()
+                    break
+                self.counters["local_waiters"] += 1
+                flight.followers += 1
+
+            try:
+                if not flight.done.wait(SINGLE_FLIGHT_TIMEOUT):
+                    raise TimeoutError("Timed out waiting for a coalesced upstream call")
+            finally:
+                with self.lock:
+                    flight.followers -= 1
+            if isinstance(flight.error, ClientDisconnected):
+                continue  # The leader's client went away; retry (and maybe lead)
+            if flight.error:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self.lead(key, fn)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.flights.pop(key, None)
+            flight.done.set()
+
+    async def lead_async(self, key: str, fn):
+        deadline = time.time() + SINGLE_FLIGHT_TIMEOUT
+        while not await asyncio.to_thread(self.claim, key):
+            finished, result = await asyncio.to_thread(self.poll, key)
+            if finished:
+                self.count("remote_waiters")
+                return result
+            if time.time() > deadline:
+                self.count("remote_timeouts")
+                break
+            await asyncio.sleep(SINGLE_FLIGHT_POLL)
+
+        self.count("leader_calls")
+        try:
+            result = await fn()
+        except BaseException:
+            await asyncio.to_thread(self.release, key)
+            raise
+        await asyncio.to_thread(self.publish, key, result)
+        return result
+
+    async def do_async(self, key: str, fn):
+        """Async variant of do(); fn returns a coroutine"""
+        while True:
+            future = self.async_flights.get(key)
+            if future is None:
+                break
+            self.count("local_waiters")
+            self.async_followers[key] = self.async_followers.get(key, 0) + 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), SINGLE_FLIGHT_TIMEOUT)
+            except ClientDisconnected:
+                continue
+            except asyncio.CancelledError:
+                # The leader's client went away; retry (and maybe lead) unless we were cancelled ourselves
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+            finally:
+                self.async_followers[key] -= 1
+                if not self.async_followers[key]:
+                    del self.async_followers[key]
+
+        future = asyncio.get_running_loop().create_future()
+        self.async_flights[key] = future
+        try:
+            result = await self.lead_async(key, fn)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody was waiting
+            raise
+        finally:
+            self.async_flights.pop(key, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+            counters["in_flight"] = len(self.flights) + len(self.async_flights)
+        counters["upstream_calls_saved"] = counters["local_waiters"] + counters["remote_waiters"]
+        return counters
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,113 @@
+"""Shared fixtures: a fresh SQLite store per test and fake DeepSeek / OpenAI clients.
+
+Settings are read from the environment when the modules are imported, so
+fake credentials and scratch paths are set here before any test imports
+app.py (load_dotenv() never overrides variables that are already set).
+"""
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_scratch = tempfile.mkdtemp(prefix="deep_persona_tests_")
+os.environ.update({
+    "DEEPSEEK_API_KEY": "test-deepseek-key",
+    "OPENAI_API_KEY": "test-openai-key",
+    "TWITTER_API_KEY": "test",
+    "TWITTER_API_KEY_SECRET": "test",
+    "TWITTER_ACCESS_TOKEN": "test",
+    "TWITTER_ACCESS_TOKEN_SECRET": "test",
+    "ADMIN_TOKEN": "test-admin",
+    "VERIFY_CREDENTIALS": "false",
+    "SHARED_DB_PATH": os.path.join(_scratch, "shared.db"),
+    "IMAGE_STORE_DIR": os.path.join(_scratch, "images"),
+})
+
+import shared_store  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def shared_db(tmp_path, monkeypatch):
+    """Point every worker thread at an empty store for the duration of the test"""
+    shared_store.close_shared_db()
+    monkeypatch.setattr(shared_store, "SHARED_DB_PATH", str(tmp_path / "shared.db"))
+    yield shared_store.get_shared_db()
+    shared_store.close_shared_db()
+
+
+class FakeClock:
+    """Stand-in for the time module: time() only moves when the test says so"""
+
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def chat_chunk(text=None, usage=None, finish_reason=None):
+    """One streamed chat.completions chunk, shaped like the OpenAI SDK's"""
+    choices = [] if text is None else [
+        SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason=finish_reason)
+    ]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeChatClient:
+    """Sync OpenAI-compatible client whose streamed reply (or error) is set by the test"""
+
+    def __init__(self, reply: str = "", prompt_tokens: int = 20, completion_tokens: int = 10):
+        self.reply = reply
+        self.error = None
+        self.usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, prompt_cache_hit_tokens=0
+        )
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.error is not None:
+            raise self.error
+        words = self.reply.split(" ")
+        chunks = [chat_chunk(word if index == 0 else f" {word}") for index, word in enumerate(words)]
+        chunks[-1].choices[0].finish_reason = "stop"
+        return FakeStream(chunks + [chat_chunk(usage=self.usage)])
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Fake DeepSeek and hedge-provider clients behind app.get_clients()"""
+    import app
+
+    clients = {"deepseek": FakeChatClient("Fresh from DeepSeek"), "openai": FakeChatClient("Fresh from OpenAI")}
+    monkeypatch.setattr(app, "get_clients", lambda: clients)
+    return clients
@@ -0,0 +1,131 @@
+"""The ASGI entrypoint: native routes on the event loop, everything else bridged to Flask"""
+import asyncio
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture(autouse=True)
+def no_background_services(monkeypatch):
+    monkeypatch.setattr(app_module, "start_background_services", lambda: None)
+    monkeypatch.setattr(app_module, "get_image_executor", lambda: SimpleNamespace(submit=lambda *args: None))
+
+
+def call_asgi(method: str, path: str, body: bytes = b"", headers=()):
+    """Run one request through asgi_app and return the messages it sent"""
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": b"", "root_path": "",
+        "headers": list(headers), "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        "scheme": "http", "http_version": "1.1"
+    }
+    incoming = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if incoming:
+            return incoming.pop(0)
+        await asyncio.Event().wait()  # the client never hangs up
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app_module.asgi_app(scope, receive, send))
+    return sent
+
+
+def response_body(sent) -> str:
+    return b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body").decode()
+
+
+def sse_events(sent) -> list:
+    return [
+        (raw.split("\n")[0].removeprefix("event: "), json.loads(raw.split("\n")[1].removeprefix("data: ")))
+        for raw in response_body(sent).strip().split("\n\n")
+    ]
+
+
+@pytest.fixture
+def native_chat(monkeypatch):
+    """Answer native /chat calls without DeepSeek, recording the session each one ran under"""
+    sessions = []
+
+    async def call_deepseek_async(prompt, personality, session_id=None, **kwargs):
+        sessions.append(session_id)
+        return {"text": "Fresh from DeepSeek", "image": None}
+
+    monkeypatch.setattr(app_module, "call_deepseek_async", call_deepseek_async)
+    return sessions
+
+
+def response_headers(sent) -> dict:
+    return {name.decode(): value.decode() for name, value in sent[0]["headers"]}
+
+
+def chat_body(message: str = "tell me a joke") -> bytes:
+    return json.dumps({"message": message}).encode()
+
+
+def test_first_chat_gets_its_session_cookie_natively(native_chat):
+    sent = call_asgi("POST", "/chat", chat_body())
+
+    assert json.loads(response_body(sent))["response"] == "Fresh from DeepSeek"
+    cookie = response_headers(sent)["set-cookie"].split(";", 1)[0]
+    assert cookie.startswith("session=")
+    with app_module.app.test_request_context(headers={"Cookie": cookie}):
+        assert app_module.session["sid"] == native_chat[0]
+
+    sent = call_asgi("POST", "/chat", chat_body(), headers=[(b"cookie", cookie.encode())])
+    assert "set-cookie" not in response_headers(sent)
+    assert native_chat[1] == native_chat[0]
+
+
+def test_tampered_session_cookie_is_replaced(native_chat):
+    sent = call_asgi("POST", "/chat", chat_body(), headers=[(b"cookie", b"session=forged.value")])
+
+    assert "set-cookie" in response_headers(sent)
+    assert native_chat[0] is not None
+
+
+def test_bridged_routes_run_on_the_bridge_pool(monkeypatch):
+    threads = []
+
+    def ready():
+        threads.append(threading.current_thread().name)
+        return app_module.jsonify({"status": "ok"})
+
+    monkeypatch.setitem(app_module.app.view_functions, "ready", ready)
+    sent = call_asgi("GET", "/ready")
+
+    assert sent[0]["status"] == 200
+    assert json.loads(response_body(sent)) == {"status": "ok"}
+    assert threads[0].startswith("asgi-bridge")
+
+
+def test_job_events_are_served_on_the_event_loop(shared_db):
+    job = app_module.enqueue_image_job("session-a", "draw me a cat", "default", tweet=False)
+    shared_db.execute("UPDATE image_jobs SET status = 'done', image_url = '/images/cat'")
+
+    sent = call_asgi("GET", f"/images/jobs/{job['job_id']}/events")
+    assert sent[0]["status"] == 200
+    events = sse_events(sent)
+    assert [(event, data["status"]) for event, data in events] == [("status", "done")]
+    assert sent[-1] == {"type": "http.response.body", "body": b""}
+
+
+def test_job_events_end_with_gone_when_the_job_disappears(shared_db, monkeypatch):
+    job = app_module.enqueue_image_job("session-a", "draw me a cat", "default", tweet=False)
+    lookups = iter([True, None])
+    real_lookup = app_module.get_image_job
+    monkeypatch.setattr(app_module, "get_image_job", lambda job_id: next(lookups) and real_lookup(job_id))
+
+    events = sse_events(call_asgi("GET", f"/images/jobs/{job['job_id']}/events"))
+    assert events == [("gone", {"job_id": job["job_id"], "error": "Unknown job"})]
+
+
+def test_unknown_job_events_are_a_404():
+    sent = call_asgi("GET", "/images/jobs/missing/events")
+    assert sent[0]["status"] == 404
@@ -0,0 +1,208 @@
+"""The chat routes end to end, against fake DeepSeek / OpenAI clients"""
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app as app_module
+import rate_limiter
+import tweet_outbox
+import usage_ledger as usage_ledger_module
+from circuit_breaker import CircuitBreaker
+from concurrency_limiter import ConcurrencyLimiter
+from conversation_memory import conversation_memory
+from response_cache import response_cache, semantic_cache
+from usage_ledger import usage_ledger
+
+
+@pytest.fixture
+def client(upstream, monkeypatch):
+    """Flask test client with fresh per-worker state and no background threads"""
+    monkeypatch.setattr(app_module, "start_background_services", lambda: None)
+    monkeypatch.setattr(tweet_outbox, "ensure_background_thread", lambda name, target: None)
+    monkeypatch.setattr(app_module, "provider_stats", app_module.ProviderStats(app_module.HEDGE_WINDOW))
+    for name in ("deepseek", "openai"):
+        monkeypatch.setitem(app_module.CIRCUIT_BREAKERS, name, CircuitBreaker(name, slow_ms=8000, min_calls=10, window=30))
+        monkeypatch.setitem(app_module.CONCURRENCY_LIMITERS, name, ConcurrencyLimiter(name, initial=8, max_limit=20))
+    response_cache.entries.clear()
+    response_cache.invalidated.clear()
+    semantic_cache.indexes.clear()
+    conversation_memory.sessions.clear()
+    usage_ledger.pending.clear()
+    return app_module.app.test_client()
+
+
+def session_id(client) -> str:
+    with client.session_transaction() as flask_session:
+        return flask_session["sid"]
+
+
+def sse_events(response) -> list:
+    events = []
+    for raw in response.get_data(as_text=True).strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in raw.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_chat_replies_and_records_usage_and_history(client, upstream):
+    response = client.post("/chat", json={"message": "tell me a joke"})
+
+    assert response.status_code == 200
+    assert response.get_json()["response"] == "Fresh from DeepSeek"
+    assert upstream["openai"].calls == []
+    assert upstream["deepseek"].calls[0]["messages"][-1]["content"].startswith("tell me a joke")
+    assert usage_ledger.session_tokens(session_id(client)) == 30
+    history = conversation_memory.history(session_id(client), "default")
+    assert [message.content for message in history] == ["tell me a joke", "Fresh from DeepSeek"]
+
+
+@pytest.mark.parametrize("route", ["/chat", "/chat/stream"])
+def test_non_string_message_is_a_json_400(client, upstream, route):
+    response = client.post(route, json={"message": 123})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Message must be a string"}
+    assert client.post(route, json=["message"]).get_json() == {"error": "No message provided"}
+    assert upstream["deepseek"].calls == []
+
+
+def test_repeated_prompt_is_served_from_cache_unless_opted_out(client, upstream):
+    client.post("/chat", json={"message": "tell me a joke"})
+    client.delete("/conversation")  # earlier turns are part of the cache key
+
+    assert client.post("/chat", json={"message": "Tell me a  joke"}).get_json()["response"] == "Fresh from DeepSeek"
+    assert len(upstream["deepseek"].calls) == 1
+
+    client.delete("/conversation")
+    upstream["deepseek"].reply = "A different joke"
+    response = client.post("/chat", json={"message": "tell me a joke", "cache": False})
+    assert response.get_json()["response"] == "A different joke"
+    assert len(upstream["deepseek"].calls) == 2
+
+
+def test_session_over_its_quota_is_refused_before_any_upstream_call(client, upstream, monkeypatch):
+    monkeypatch.setattr(usage_ledger_module, "USAGE_SESSION_DAILY_TOKENS", 25)
+    client.post("/chat", json={"message": "tell me a joke"})
+
+    response = client.post("/chat", json={"message": "tell me another joke"})
+    assert response.get_json()["response"] == "⚠️ Daily token quota reached - come back tomorrow (UTC)"
+    assert len(upstream["deepseek"].calls) == 1
+
+
+def test_rate_limited_chat_gets_429_with_retry_after(client, upstream, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_IP_BURST", 2)
+    assert client.post("/chat", json={"message": "one"}).status_code == 200
+    assert client.post("/chat", json={"message": "two"}).status_code == 200
+
+    response = client.post("/chat", json={"message": "three"})
+    assert response.status_code == 429
+    assert response.get_json()["error"] == "Rate limit exceeded"
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.headers["RateLimit-Remaining"] == "0"
+    assert len(upstream["deepseek"].calls) == 2
+
+
+def test_deepseek_failure_is_answered_by_the_hedge_provider(client, upstream):
+    upstream["deepseek"].error = ConnectionError("connection reset")
+
+    response = client.post("/chat", json={"message": "tell me a joke"})
+    assert response.get_json()["response"] == "Fresh from OpenAI"
+    assert upstream["openai"].calls[0]["model"] == app_module.HEDGE_OPENAI_MODEL
+    assert app_module.provider_stats.stats()["providers"]["openai"]["wins"] == 1
+
+
+def test_congested_deepseek_is_hedged_without_waiting_for_the_delay(client, upstream):
+    limiter = app_module.CONCURRENCY_LIMITERS["deepseek"]
+    limiter.limit = 1.0
+    limiter.acquire()
+    try:
+        started = time.perf_counter()
+        response = client.post("/chat", json={"message": "tell me a joke"})
+        elapsed = time.perf_counter() - started
+    finally:
+        limiter.release()
+
+    assert response.get_json()["response"] == "Fresh from OpenAI"
+    assert elapsed < app_module.HEDGE_MIN_DELAY_MS / 1000
+    assert upstream["deepseek"].calls == []
+
+
+def test_failed_auto_tweet_still_returns_the_reply(client, monkeypatch):
+    def broken(message):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(tweet_outbox, "post_tweet", broken)
+    response = client.post("/chat", json={"message": "tell me a joke", "tweet": True})
+    assert response.status_code == 200
+    assert response.get_json()["response"] == "Fresh from DeepSeek"
+
+
+def test_auto_tweet_is_queued_in_the_outbox(client):
+    client.post("/chat", json={"message": "tell me a joke", "tweet": True})
+    assert tweet_outbox.tweet_outbox_stats()["pending"] == 1
+
+
+def test_chat_stream_sends_deltas_then_done(client, upstream):
+    response = client.post("/chat/stream", json={"message": "tell me a joke"})
+
+    assert response.mimetype == "text/event-stream"
+    events = sse_events(response)
+    assert events[0] == ("meta", {"personality": "default"})
+    assert "".join(data["text"] for event, data in events if event == "delta") == "Fresh from DeepSeek"
+    assert events[-1] == ("done", {})
+    assert usage_ledger.session_tokens(session_id(client)) == 30
+
+
+def test_chat_stream_reports_upstream_errors_as_an_event(client, upstream):
+    upstream["deepseek"].error = ConnectionError("connection reset")
+    upstream["openai"].error = ConnectionError("connection reset")
+
+    events = sse_events(client.post("/chat/stream", json={"message": "tell me a joke"}))
+    assert events[-1][0] == "error"
+
+
+def test_image_job_cancelled_while_rendering_is_not_tweeted(client, monkeypatch):
+    tweeted = []
+    monkeypatch.setattr(tweet_outbox, "post_tweet", tweeted.append)
+    monkeypatch.setattr(app_module, "get_image_executor", lambda: SimpleNamespace(submit=lambda *args: None))
+    job = app_module.enqueue_image_job("session-a", "draw me a cat", "default", tweet=True)
+
+    def render_then_cancel(prompt, personality):
+        app_module.cancel_image_job(job["job_id"])
+        return "/images/cat"
+
+    monkeypatch.setattr(app_module, "generate_image", render_then_cancel)
+    app_module.run_image_job(job["job_id"])
+
+    assert app_module.get_image_job(job["job_id"])["status"] == "cancelled"
+    assert tweeted == []
+
+
+def test_job_events_end_with_gone_when_the_job_disappears(client, shared_db, monkeypatch):
+    monkeypatch.setattr(app_module, "get_image_executor", lambda: SimpleNamespace(submit=lambda *args: None))
+    job = app_module.enqueue_image_job("session-a", "draw me a cat", "default", tweet=False)
+    monkeypatch.setattr(app_module.time, "sleep", lambda seconds: shared_db.execute("DELETE FROM image_jobs"))
+
+    events = sse_events(client.get(f"/images/jobs/{job['job_id']}/events"))
+    assert [event for event, data in events] == ["status", "gone"]
+    assert events[-1][1] == {"job_id": job["job_id"], "error": "Unknown job"}
+
+
+def test_price_stream_is_capped_per_worker(client, monkeypatch):
+    monkeypatch.setattr(app_module, "ensure_background_thread", lambda name, target: None)
+    monkeypatch.setattr(app_module, "PRICE_STREAM_MAX_SUBSCRIBERS", 1)
+    monkeypatch.setattr(app_module, "_price_subscribers", set())
+    app_module.subscribe_prices({"BTC"}, loop=SimpleNamespace())  # async subscribers hold no thread and do not count
+
+    response = client.get("/prices/stream")
+    assert response.status_code == 200
+    response.close()
+    assert len(app_module._price_subscribers) == 1
+
+    held = app_module.subscribe_prices({"BTC"})
+    response = client.get("/prices/stream")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(app_module.PRICE_STREAM_HEARTBEAT)
+    app_module.unsubscribe_prices(held)
@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import BREAKER_COOLDOWN, CircuitBreaker, CircuitOpenError, twitter_fault, upstream_fault
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class ResponseError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(clock, monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return clock
+
+
+def breaker():
+    return CircuitBreaker("test", slow_ms=1000, min_calls=4, window=30)
+
+
+def test_fault_classification():
+    assert upstream_fault(TimeoutError())
+    assert upstream_fault(StatusError(503))
+    assert upstream_fault(StatusError(429))
+    assert upstream_fault(ResponseError(502))
+    assert not upstream_fault(StatusError(400))
+    assert not upstream_fault(ResponseError(403))
+    assert not twitter_fault(ResponseError(429))
+    assert twitter_fault(ResponseError(503))
+
+
+def test_failures_below_min_calls_do_not_trip():
+    first = breaker()
+    for _ in range(3):
+        first.record(False, True, 10)
+    assert first.acquire() is False
+    assert first.stats()["state"] == "closed"
+
+
+def test_trip_is_shared_with_other_workers():
+    first, second = breaker(), breaker()
+    for _ in range(4):
+        assert first.acquire() is False
+        first.record(False, True, 10)
+
+    with pytest.raises(CircuitOpenError):
+        first.acquire()
+    with pytest.raises(CircuitOpenError):
+        second.acquire()
+    assert second.stats()["trips"] == 1
+
+
+def test_slow_calls_trip_the_breaker():
+    first = breaker()
+    for _ in range(4):
+        first.record(False, False, 5000)
+    assert first.stats()["state"] == "open"
+
+
+def test_client_errors_do_not_count_against_the_upstream():
+    first = breaker()
+    for _ in range(10):
+        with pytest.raises(StatusError):
+            with first.guard():
+                raise StatusError(400)
+    assert first.stats()["window_failures"] == 0
+    assert first.acquire() is False
+
+
+def test_one_probe_after_the_cooldown_then_recovery(frozen_time):
+    first, second = breaker(), breaker()
+    for _ in range(4):
+        first.record(False, True, 10)
+
+    frozen_time.advance(BREAKER_COOLDOWN)
+    assert first.acquire() is True
+    with pytest.raises(CircuitOpenError):
+        second.acquire()
+
+    first.record(True, False, 10)
+    frozen_time.advance(1)
+    assert second.acquire() is False
+    assert second.stats()["state"] == "closed"
+
+
+def test_failed_probe_doubles_the_cooldown(frozen_time):
+    first = breaker()
+    for _ in range(4):
+        first.record(False, True, 10)
+
+    frozen_time.advance(BREAKER_COOLDOWN)
+    with pytest.raises(StatusError):
+        with first.guard():
+            raise StatusError(503)
+
+    stats = first.stats()
+    assert stats["state"] == "open"
+    assert stats["cooldown"] == 2 * BREAKER_COOLDOWN
+    frozen_time.advance(BREAKER_COOLDOWN)
+    with pytest.raises(CircuitOpenError):
+        first.acquire()
+
+
+def test_abandoned_probe_lets_another_call_probe(frozen_time):
+    first, second = breaker(), breaker()
+    for _ in range(4):
+        first.record(False, True, 10)
+
+    frozen_time.advance(BREAKER_COOLDOWN)
+    with pytest.raises(KeyboardInterrupt):
+        with first.guard():
+            raise KeyboardInterrupt
+    assert second.acquire() is True
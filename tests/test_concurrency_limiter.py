@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import pytest
+
+from concurrency_limiter import LIMITER_DEFAULT_RETRY_AFTER, ConcurrencyLimiter, LimiterTimeout, throttle_retry_after
+
+
+class ThrottleError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        headers = {"retry-after": retry_after} if retry_after is not None else {}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+
+def test_throttle_retry_after_reads_the_header():
+    assert throttle_retry_after(ThrottleError(400)) is None
+    assert throttle_retry_after(TimeoutError()) is None
+    assert throttle_retry_after(ThrottleError(429)) == LIMITER_DEFAULT_RETRY_AFTER
+    assert throttle_retry_after(ThrottleError(503, "3")) == 3.0
+    assert throttle_retry_after(ThrottleError(429, formatdate(time.time() + 30, usegmt=True))) == pytest.approx(30, abs=2)
+    assert throttle_retry_after(ThrottleError(429, "soon")) == LIMITER_DEFAULT_RETRY_AFTER
+
+
+def test_calls_over_the_limit_time_out_in_the_queue():
+    limiter = ConcurrencyLimiter("test", initial=2, max_limit=4)
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter.congested()
+
+    with pytest.raises(LimiterTimeout):
+        limiter.acquire(timeout=0.05)
+    assert limiter.stats()["waiting"] == 0
+    assert limiter.stats()["queue_timeouts"] == 1
+
+
+def test_release_hands_the_slot_to_the_oldest_waiter():
+    limiter = ConcurrencyLimiter("test", initial=1, max_limit=4)
+    limiter.acquire()
+    admitted = threading.Event()
+
+    def queued_call():
+        limiter.acquire(timeout=5)
+        admitted.set()
+
+    thread = threading.Thread(target=queued_call)
+    thread.start()
+    while not limiter.waiters:
+        time.sleep(0.001)
+    assert not admitted.is_set()
+
+    limiter.release()
+    thread.join(timeout=5)
+    assert admitted.is_set()
+    assert limiter.stats()["in_flight"] == 1
+
+
+def test_healthy_calls_raise_the_limit_additively():
+    limiter = ConcurrencyLimiter("test", initial=2, max_limit=3)
+    limiter.record(100)
+    assert limiter.limit == 2.5
+    for _ in range(10):
+        limiter.record(100)
+    assert limiter.limit == 3
+
+
+def test_latency_spike_lowers_the_limit():
+    limiter = ConcurrencyLimiter("test", initial=8, max_limit=8)
+    limiter.record(100)
+    limiter.record(1000)
+    assert limiter.limit < 8
+    assert limiter.stats()["decreases"] == 1
+
+
+def test_throttle_halves_the_limit_and_pauses_every_worker():
+    first = ConcurrencyLimiter("test", initial=8, max_limit=8)
+    second = ConcurrencyLimiter("test", initial=8, max_limit=8)
+    assert not second.congested()
+
+    first.record(error=ThrottleError(429, "30"))
+    assert first.limit == 4
+    assert first.stats()["paused_for"] == pytest.approx(30, abs=1)
+
+    second.synced_at = 0.0  # as if the sync interval had passed
+    assert second.congested()
+    with pytest.raises(LimiterTimeout):
+        second.acquire(timeout=0.05)
+
+
+def test_throttles_already_in_flight_only_cut_once():
+    limiter = ConcurrencyLimiter("test", initial=8, max_limit=8)
+    for _ in range(3):
+        limiter.record(error=ThrottleError(429, "0"))
+    assert limiter.limit == 4
+    assert limiter.stats()["throttled"] == 3
+
+
+def test_slot_releases_and_records_errors():
+    limiter = ConcurrencyLimiter("test", initial=8, max_limit=8)
+    with pytest.raises(ThrottleError):
+        with limiter.slot():
+            raise ThrottleError(429, "0")
+    assert limiter.stats()["in_flight"] == 0
+    assert limiter.limit == 4
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    limiter = ConcurrencyLimiter("test", initial=1, max_limit=1)
+    limiter.acquire()
+
+    async def scenario():
+        task = asyncio.ensure_future(limiter.acquire_async(timeout=5))
+        await asyncio.sleep(0.01)
+        assert len(limiter.waiters) == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert limiter.stats()["waiting"] == 0
+    assert limiter.stats()["in_flight"] == 1
+
+
+def test_async_waiter_is_admitted_on_release():
+    limiter = ConcurrencyLimiter("test", initial=1, max_limit=1)
+    limiter.acquire()
+
+    async def scenario():
+        task = asyncio.ensure_future(limiter.acquire_async(timeout=5))
+        await asyncio.sleep(0.01)
+        limiter.release()
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(scenario())
+    assert limiter.stats()["in_flight"] == 1
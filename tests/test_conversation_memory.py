@@ -0,0 +1,106 @@
+from conversation_memory import ConversationMemory, load_history
+
+
+def turn(number: int):
+    """A 20-token exchange (10 tokens each way)"""
+    return f"question {number}".ljust(40, "?"), f"answer {number}".ljust(40, "!")
+
+
+def record_turns(memory, numbers, session_id="session-a", personality="hacker"):
+    for number in numbers:
+        memory.record(session_id, personality, *turn(number))
+
+
+def contents(messages):
+    return [message.content for message in messages]
+
+
+def test_history_alternates_user_and_assistant_oldest_first():
+    memory = ConversationMemory(max_sessions=10, max_messages=40)
+    record_turns(memory, range(3))
+
+    history = memory.history("session-a", "hacker", budget=1000)
+    assert [message.role for message in history] == ["user", "assistant"] * 3
+    assert contents(history) == [text for number in range(3) for text in turn(number)]
+
+
+def test_sessions_and_personalities_are_kept_apart():
+    memory = ConversationMemory(max_sessions=10, max_messages=40)
+    record_turns(memory, [1], personality="hacker")
+    record_turns(memory, [2], personality="pirate")
+    record_turns(memory, [3], session_id="session-b")
+
+    assert contents(memory.history("session-a", "hacker", budget=1000)) == list(turn(1))
+    assert contents(memory.history("session-a", "pirate", budget=1000)) == list(turn(2))
+    assert contents(memory.history("session-b", "hacker", budget=1000)) == list(turn(3))
+
+
+def test_window_slides_in_jumps_so_the_prefix_stays_stable():
+    memory = ConversationMemory(max_sessions=10, max_messages=40)
+    record_turns(memory, range(5))
+    assert len(memory.history("session-a", "hacker", budget=100)) == 10
+
+    # Over budget: the window restarts with half the budget's worth of recent turns
+    record_turns(memory, [5])
+    trimmed = memory.history("session-a", "hacker", budget=100)
+    assert contents(trimmed) == [text for number in (4, 5) for text in turn(number)]
+
+    # ...and then grows again without shifting, so the earlier prompt is a prefix of the next
+    record_turns(memory, [6])
+    grown = memory.history("session-a", "hacker", budget=100)
+    assert contents(grown[:len(trimmed)]) == contents(trimmed)
+    assert len(grown) == len(trimmed) + 2
+
+
+def test_read_only_history_leaves_the_window_alone(shared_db):
+    memory = ConversationMemory(max_sessions=10, max_messages=40)
+    record_turns(memory, range(6))
+
+    assert len(memory.history("session-a", "hacker", budget=100, update_window=False)) == 4
+    assert shared_db.execute("SELECT COUNT(*) FROM conversation_windows").fetchone() == (0,)
+    memory.history("session-a", "hacker", budget=100)
+    assert shared_db.execute("SELECT COUNT(*) FROM conversation_windows").fetchone() == (1,)
+
+
+def test_turns_recorded_by_another_worker_are_picked_up():
+    first = ConversationMemory(max_sessions=10, max_messages=40)
+    second = ConversationMemory(max_sessions=10, max_messages=40)
+    record_turns(first, [1])
+    assert contents(second.history("session-a", "hacker", budget=1000)) == list(turn(1))
+
+    record_turns(second, [2])
+    assert contents(first.history("session-a", "hacker", budget=1000)) == list(turn(1) + turn(2))
+
+
+def test_clear_by_another_worker_empties_the_cached_copy():
+    first = ConversationMemory(max_sessions=10, max_messages=40)
+    second = ConversationMemory(max_sessions=10, max_messages=40)
+    record_turns(first, range(2))
+    assert len(first.load("session-a", "hacker")) == 4
+
+    second.clear("session-a")
+    assert first.load("session-a", "hacker") == []
+    record_turns(second, [9])
+    assert contents(first.history("session-a", "hacker", budget=1000)) == list(turn(9))
+
+
+def test_only_the_newest_messages_are_stored(shared_db):
+    memory = ConversationMemory(max_sessions=10, max_messages=4)
+    record_turns(memory, range(3))
+
+    assert contents(memory.load("session-a", "hacker")) == list(turn(1) + turn(2))
+    assert shared_db.execute("SELECT COUNT(*) FROM conversation_messages").fetchone() == (4,)
+
+
+def test_least_recently_used_sessions_leave_the_cache():
+    memory = ConversationMemory(max_sessions=2, max_messages=40)
+    for session_id in ("session-a", "session-b", "session-c"):
+        record_turns(memory, [1], session_id=session_id)
+        memory.load(session_id, "hacker")
+
+    assert list(memory.sessions) == [("session-b", "hacker"), ("session-c", "hacker")]
+    assert contents(memory.load("session-a", "hacker")) == list(turn(1))
+
+
+def test_requests_without_a_session_have_no_history():
+    assert load_history(None, "hacker") == []
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+import image_store
+from image_store import find_stored_image, lookup_stored_image, save_rendered_image, store_image
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(image_store, "IMAGE_STORE_DIR", str(tmp_path / "images"))
+    monkeypatch.setattr(image_store, "time", clock)
+    return tmp_path / "images"
+
+
+def render(seed: str, size: int = 100) -> dict:
+    digest = image_store.image_prompt_key(f"render:{seed}")
+    return {"digest": digest, "full": b"F" * size, "thumb": b"T" * (size // 10), "format": "png"}
+
+
+def test_stored_render_is_found_by_prompt():
+    processed = render("cat")
+    assert lookup_stored_image("a cat") is None
+
+    assert save_rendered_image("a cat", "https://upstream/cat.png", processed) == f"/images/{processed['digest']}"
+    assert lookup_stored_image("a cat") == processed["digest"]
+    path, mimetype = find_stored_image(processed["digest"], "thumb")
+    assert mimetype == "image/png"
+    with open(path, "rb") as f:
+        assert f.read() == processed["thumb"]
+
+
+def test_same_render_for_two_prompts_is_stored_once(store_dir):
+    processed = render("cat")
+    store_image("a cat", processed)
+    store_image("a cat, again", processed)
+    assert lookup_stored_image("a cat, again") == lookup_stored_image("a cat")
+    assert sum(len(files) for _, _, files in os.walk(store_dir)) == 2
+
+
+def test_least_recently_used_images_are_evicted(clock, monkeypatch):
+    monkeypatch.setattr(image_store, "IMAGE_STORE_MAX_BYTES", 250)
+    store_image("old", render("old"))
+    clock.advance(1)
+    store_image("kept", render("kept"))
+    clock.advance(1)
+    assert lookup_stored_image("old")  # touching it makes "kept" the oldest
+    clock.advance(1)
+    store_image("new", render("new"))
+
+    assert lookup_stored_image("kept") is None
+    assert find_stored_image(render("kept")["digest"]) is None
+    assert lookup_stored_image("old") and lookup_stored_image("new")
+
+
+def test_disk_failure_falls_back_to_the_upstream_url(monkeypatch):
+    def broken(image_prompt, processed):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(image_store, "store_image", broken)
+    assert save_rendered_image("a cat", "https://upstream/cat.png", render("cat")) == "https://upstream/cat.png"
@@ -0,0 +1,67 @@
+import pytest
+
+from app import CRYPTO_TERMS, IMAGE_TRIGGERS, PRICE_KEYWORDS, WALLET_KEYWORDS, intent_router
+from bench_intents import CORPUS, naive_classify
+from intent_router import IntentRouter
+
+# Image requests the substring scan used to route to DALL·E, which must still get there
+BASELINE_IMAGE_REQUESTS = [
+    "generate image of a bull riding a rocket",
+    "Create picture of a moon lambo",
+    "show me a neon solana logo",
+    "show me an image of a cat",
+    "Show me an ape in a hoodie",
+    "visualize this: a bear market",
+    "draw me a cyberpunk bitcoin miner",
+    "make artwork for my nft",
+    "digital art of a golden coin",
+    "create visual for the pitch deck",
+    "render an image of diamond hands",
+    "generate photo of a trading desk",
+    "create illustration of a whale",
+]
+
+# Messages where the substring scan matched by accident ("coin" in "memecoins"), with what they route to now
+SUBSTRING_FALSE_POSITIVES = {
+    "what do you think about memecoins and their long-term value": [],
+}
+
+
+def routed(message: str) -> list:
+    return [intent for intent in intent_router.classify(message).intents if intent in ("image", "price", "wallet")]
+
+
+@pytest.mark.parametrize("message", BASELINE_IMAGE_REQUESTS)
+def test_baseline_image_requests_still_route_to_images(message):
+    assert naive_classify(message, IMAGE_TRIGGERS, PRICE_KEYWORDS, CRYPTO_TERMS, WALLET_KEYWORDS)[:1] == ["image"]
+    assert routed(message)[:1] == ["image"]
+
+
+@pytest.mark.parametrize("message", ["show me an image of the eth logo", "a picture of a pirate ship", "image of a sunset"])
+def test_image_of_and_picture_of_are_image_requests(message):
+    assert "image" in intent_router.classify(message)
+
+
+def test_corpus_classifies_as_the_substring_scan_did():
+    for message in CORPUS:
+        expected = naive_classify(message, IMAGE_TRIGGERS, PRICE_KEYWORDS, CRYPTO_TERMS, WALLET_KEYWORDS)
+        assert routed(message) == SUBSTRING_FALSE_POSITIVES.get(message, expected), message
+
+
+def test_substrings_inside_other_words_do_not_match():
+    assert routed("is this the solution?") == []
+    assert routed("generate a story about coins") == []
+    assert routed("show me all your personalities") == []
+
+
+def test_plurals_and_whitespace_runs_match():
+    assert routed("generate images of apes") == ["image"]
+    assert routed("BTC  prices?") == ["price"]
+    assert intent_router.classify("draw   me a cat").terms["image"] == ["draw me"]
+
+
+def test_compound_intents_need_every_vocabulary():
+    router = IntentRouter().add("price", ["price"], requires=["btc"]).add("coin", ["btc"], priority=5).compile()
+    assert router.classify("price of btc").intents == ("coin", "price")
+    assert router.classify("price of gold").intents == ()
+    assert router.classify("price of gold").primary is None
@@ -0,0 +1,79 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import RATE_LIMIT_IP_BURST, RATE_LIMIT_SESSION_BURST, RATE_LIMIT_SESSION_RATE, take_rate_limit
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_ENABLED", True)
+    return clock
+
+
+def test_session_burst_runs_out_then_reports_retry_after():
+    for _ in range(int(RATE_LIMIT_SESSION_BURST)):
+        assert take_rate_limit("session-a", "10.0.0.1", 1).allowed
+
+    decision = take_rate_limit("session-a", "10.0.0.1", 1)
+    assert not decision.allowed
+    assert decision.remaining == 0
+    assert decision.retry_after == pytest.approx(1 / RATE_LIMIT_SESSION_RATE)
+    assert decision.headers()["Retry-After"] == str(int(1 / RATE_LIMIT_SESSION_RATE))
+
+
+def test_bucket_refills_with_time(frozen_time):
+    assert take_rate_limit("session-a", "10.0.0.1", RATE_LIMIT_SESSION_BURST).allowed
+    assert not take_rate_limit("session-a", "10.0.0.1", 1).allowed
+
+    frozen_time.advance(2 / RATE_LIMIT_SESSION_RATE)
+    assert take_rate_limit("session-a", "10.0.0.1", 2).allowed
+    assert not take_rate_limit("session-a", "10.0.0.1", 1).allowed
+
+
+def test_ip_bucket_is_shared_by_every_session_behind_the_address():
+    spent = 0
+    session = 0
+    while spent + 10 <= RATE_LIMIT_IP_BURST:
+        assert take_rate_limit(f"session-{session}", "10.0.0.1", 10).allowed
+        spent += 10
+        session += 1
+
+    assert not take_rate_limit("fresh-session", "10.0.0.1", 10).allowed
+    assert take_rate_limit("fresh-session", "10.0.0.2", 10).allowed
+
+
+def test_denied_request_charges_neither_bucket(shared_db):
+    assert take_rate_limit("session-a", "10.0.0.1", RATE_LIMIT_SESSION_BURST - 1).allowed
+    assert not take_rate_limit("session-a", "10.0.0.1", 5).allowed
+
+    levels = dict(shared_db.execute("SELECT key, tokens FROM rate_buckets").fetchall())
+    assert levels == {"ip:10.0.0.1": RATE_LIMIT_IP_BURST - RATE_LIMIT_SESSION_BURST + 1, "sid:session-a": 1}
+
+
+def test_headers_report_the_tighter_bucket():
+    decision = take_rate_limit("session-a", "10.0.0.1", 10)
+    headers = decision.headers()
+    assert headers["RateLimit-Limit"] == str(int(RATE_LIMIT_SESSION_BURST))
+    assert headers["RateLimit-Remaining"] == str(int(RATE_LIMIT_SESSION_BURST - 10))
+    assert "Retry-After" not in headers
+
+
+def test_disabled_limiter_allows_everything(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_ENABLED", False)
+    assert take_rate_limit("session-a", "10.0.0.1", 10_000) is None
+
+
+def test_store_failure_fails_open(monkeypatch):
+    def broken_db():
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(rate_limiter, "get_shared_db", broken_db)
+    assert take_rate_limit("session-a", "10.0.0.1", 1) is None
+
+
+def test_rate_limited_response_rounds_retry_after_up():
+    decision = rate_limiter.RateLimitDecision(False, 30, 0, 60, 2.2)
+    body = rate_limiter.rate_limited_response(decision)
+    assert body["retry_after"] == 2.2
+    assert body["response"] == "⚠️ Slow down - try again in 3s"
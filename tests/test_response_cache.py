@@ -0,0 +1,128 @@
+import pytest
+
+import response_cache as response_cache_module
+from response_cache import (
+    SEMANTIC_CACHE_THRESHOLD, ResponseCache, SemanticCache, embed_prompt, normalize_prompt, response_cache_key,
+    sampling_params_key
+)
+
+
+def chat_args(prompt: str, temperature: float = 0.7, history=()):
+    messages = [{"role": "system", "content": "You are a hacker."}, *history, {"role": "user", "content": prompt}]
+    return {"model": "deepseek-chat", "messages": messages, "temperature": temperature}
+
+
+@pytest.fixture
+def frozen_time(clock, monkeypatch):
+    monkeypatch.setattr(response_cache_module, "time", clock)
+    return clock
+
+
+def test_keys_ignore_case_and_spacing_but_not_parameters_or_history():
+    key = response_cache_key("hacker", "Hello  World", chat_args("Hello  World"))
+    assert normalize_prompt("  Hello \n World ") == "hello world"
+    assert response_cache_key("hacker", "hello world", chat_args("hello world")) == key
+    assert response_cache_key("hacker", "hello world", chat_args("hello world", temperature=0.2)) != key
+    earlier = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "yo"}]
+    assert response_cache_key("hacker", "hello world", chat_args("hello world", history=earlier)) != key
+    assert "messages" not in sampling_params_key(chat_args("hello world"))
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.set("a", "hacker", "A")
+    cache.set("b", "hacker", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "hacker", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_the_ttl(frozen_time):
+    cache = ResponseCache(max_entries=10, ttl=60)
+    cache.set("a", "hacker", "A")
+    frozen_time.advance(59)
+    assert cache.get("a") == "A"
+    frozen_time.advance(2)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_invalidation_reaches_other_workers(frozen_time):
+    first = ResponseCache(max_entries=10, ttl=60)
+    second = ResponseCache(max_entries=10, ttl=60)
+    second.set("hacker-key", "hacker", "old hacker reply")
+    second.set("pirate-key", "pirate", "old pirate reply")
+    assert second.get("hacker-key") == "old hacker reply"
+
+    frozen_time.advance(1)
+    assert first.invalidate("hacker") == 0
+    frozen_time.advance(1)
+    assert second.get("hacker-key") is None
+    assert second.get("pirate-key") == "old pirate reply"
+
+    second.set("hacker-key", "hacker", "new hacker reply")
+    assert second.get("hacker-key") == "new hacker reply"
+
+
+@pytest.mark.parametrize("first, second", [
+    ("What's the price of BTC?", "what is the price of bitcoin"),
+    ("Hey, what is the bitcoin price?", "what is the bitcoin price"),
+    ("Tell me, whats the ETH price right now?", "what is the ethereum price right now"),
+    ("hey can u explain what a blockchain is", "can you explain what a blockchain is please"),
+    ("what is bitcoin?", "explain bitcoin"),
+    ("what is bitcoin?", "tell me what bitcoin is"),
+    ("what is bitcoin?", "Tell me about BTC"),
+])
+def test_paraphrases_hit_the_semantic_cache(first, second):
+    cache = SemanticCache(capacity=8, threshold=SEMANTIC_CACHE_THRESHOLD)
+    cache.add("hacker", embed_prompt(first), "params", "cached reply")
+    assert cache.get("hacker", embed_prompt(second), "params", cutoff=0) == "cached reply"
+
+
+@pytest.mark.parametrize("first, second", [
+    ("write a short poem about shakespeare", "write a short poem about eminem"),
+    ("is bitcoin better than ethereum", "is bitcoin worse than ethereum"),
+    ("what is the price of bitcoin", "what is not the price of bitcoin"),
+    ("what is bitcoin", "who is bitcoin"),
+    ("is bitcoin better than ethereum", "is ethereum better than bitcoin"),
+])
+def test_a_different_question_misses_the_semantic_cache(first, second):
+    cache = SemanticCache(capacity=8, threshold=SEMANTIC_CACHE_THRESHOLD)
+    cache.add("hacker", embed_prompt(first), "params", "cached reply")
+    assert cache.get("hacker", embed_prompt(second), "params", cutoff=0) is None
+
+
+def test_semantic_hit_needs_the_same_personality_parameters_and_freshness():
+    cache = SemanticCache(capacity=8, threshold=SEMANTIC_CACHE_THRESHOLD)
+    embedding = embed_prompt("what is the price of bitcoin")
+    cache.add("hacker", embedding, "params", "cached reply")
+
+    assert cache.get("pirate", embedding, "params", cutoff=0) is None
+    assert cache.get("hacker", embedding, "other params", cutoff=0) is None
+    assert cache.get("hacker", embedding, "params", cutoff=float("inf")) is None
+    assert cache.get("hacker", embedding, "params", cutoff=0) == "cached reply"
+    assert cache.stats()["hits"] == 1
+
+
+def test_threshold_is_respected():
+    strict = SemanticCache(capacity=8, threshold=1.01)
+    embedding = embed_prompt("what is the price of bitcoin")
+    strict.add("hacker", embedding, "params", "cached reply")
+    assert strict.get("hacker", embedding, "params", cutoff=0) is None
+
+
+def test_full_index_evicts_the_least_recently_used_prompt():
+    cache = SemanticCache(capacity=2, threshold=SEMANTIC_CACHE_THRESHOLD)
+    prompts = ["price of bitcoin", "price of ethereum", "price of solana"]
+    cache.add("hacker", embed_prompt(prompts[0]), "params", "btc")
+    cache.add("hacker", embed_prompt(prompts[1]), "params", "eth")
+    assert cache.get("hacker", embed_prompt(prompts[0]), "params", cutoff=0) == "btc"
+    cache.add("hacker", embed_prompt(prompts[2]), "params", "sol")
+
+    assert cache.get("hacker", embed_prompt(prompts[1]), "params", cutoff=0) is None
+    assert cache.get("hacker", embed_prompt(prompts[0]), "params", cutoff=0) == "btc"
+    assert cache.get("hacker", embed_prompt(prompts[2]), "params", cutoff=0) == "sol"
@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+import shared_store
+from shared_store import acquire_lease, ensure_background_thread, get_shared_db
+
+
+@pytest.fixture
+def owner(clock, monkeypatch):
+    """Switch which worker is asking, on a frozen clock"""
+    monkeypatch.setattr(shared_store, "time", clock)
+
+    def become(name: str):
+        monkeypatch.setattr(shared_store, "process_owner_id", lambda: name)
+
+    return become
+
+
+def test_store_runs_in_wal_mode(shared_db):
+    assert shared_db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_each_thread_gets_its_own_connection_to_the_same_store(shared_db):
+    shared_db.execute("INSERT INTO leases (name, owner, expires_at) VALUES ('x', 'main', 0)")
+    seen = {}
+
+    def reader():
+        seen["conn"] = get_shared_db()
+        seen["rows"] = seen["conn"].execute("SELECT owner FROM leases").fetchall()
+        shared_store.close_shared_db()
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    thread.join()
+    assert seen["conn"] is not shared_db
+    assert seen["rows"] == [("main",)]
+    assert get_shared_db() is shared_db
+
+
+def test_lease_is_held_by_one_worker_until_it_expires(owner, clock):
+    owner("worker-a")
+    assert acquire_lease("sender", ttl=30)
+    owner("worker-b")
+    assert not acquire_lease("sender", ttl=30)
+
+    owner("worker-a")
+    clock.advance(20)
+    assert acquire_lease("sender", ttl=30)  # renewed
+    owner("worker-b")
+    clock.advance(20)
+    assert not acquire_lease("sender", ttl=30)
+
+    clock.advance(11)
+    assert acquire_lease("sender", ttl=30)
+    owner("worker-a")
+    assert not acquire_lease("sender", ttl=30)
+
+
+def test_background_thread_starts_once_per_process(monkeypatch):
+    monkeypatch.setattr(shared_store, "_background_threads", {})
+    started = threading.Semaphore(0)
+    release = threading.Event()
+
+    def loop():
+        started.release()
+        release.wait(5)
+
+    ensure_background_thread("test-loop", loop)
+    ensure_background_thread("test-loop", loop)
+    release.set()
+    assert started.acquire(timeout=5)
+    assert not started.acquire(timeout=0.1)
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import single_flight as single_flight_module
+from single_flight import SingleFlight
+
+
+def run_concurrently(count: int, target):
+    results, errors = [None] * count, [None] * count
+
+    def worker(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return "reply"
+
+    threads, results, errors = run_concurrently(5, lambda: flights.do("key", fetch))
+    while flights.stats()["local_waiters"] < 4:
+        time.sleep(0.001)
+    assert flights.has_followers("key")
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert results == ["reply"] * 5
+    assert errors == [None] * 5
+    assert flights.stats()["upstream_calls_saved"] == 4
+    assert not flights.has_followers("key")
+
+
+def test_leader_error_reaches_every_follower_and_frees_the_key():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    threads, results, errors = run_concurrently(3, lambda: flights.do("key", fetch))
+    while flights.stats()["local_waiters"] < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert flights.do("key", lambda: "recovered") == "recovered"
+
+
+def test_distinct_keys_do_not_wait_on_each_other():
+    flights = SingleFlight()
+    assert flights.do("a", lambda: "A") == "A"
+    assert flights.do("b", lambda: "B") == "B"
+    assert flights.stats()["leader_calls"] == 2
+
+
+def test_result_published_by_another_worker_is_reused(monkeypatch):
+    other_worker, this_worker = SingleFlight(), SingleFlight()
+    monkeypatch.setattr(single_flight_module, "process_owner_id", lambda: "worker-b")
+    assert other_worker.claim("key")
+
+    def publish_later():
+        time.sleep(0.2)
+        monkeypatch.setattr(single_flight_module, "process_owner_id", lambda: "worker-b")
+        other_worker.publish("key", {"text": "from worker b"})
+
+    monkeypatch.setattr(single_flight_module, "process_owner_id", lambda: "worker-a")
+    publisher = threading.Thread(target=publish_later)
+    publisher.start()
+    result = this_worker.do("key", lambda: pytest.fail("the upstream was called twice"))
+    publisher.join()
+
+    assert result == {"text": "from worker b"}
+    assert this_worker.stats()["remote_waiters"] == 1
+
+
+def test_failed_leader_lets_another_worker_lead(monkeypatch):
+    other_worker, this_worker = SingleFlight(), SingleFlight()
+    monkeypatch.setattr(single_flight_module, "process_owner_id", lambda: "worker-b")
+
+    def broken():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        other_worker.do("key", broken)
+
+    monkeypatch.setattr(single_flight_module, "process_owner_id", lambda: "worker-a")
+    assert this_worker.do("key", lambda: "fresh") == "fresh"
+
+
+def test_async_callers_share_one_upstream_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "reply"
+
+    async def scenario():
+        return await asyncio.gather(*(flights.do_async("key", fetch) for _ in range(4)))
+
+    assert asyncio.run(scenario()) == ["reply"] * 4
+    assert calls == [1]
+    assert flights.stats()["local_waiters"] == 3
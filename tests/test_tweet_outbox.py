@@ -0,0 +1,145 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+import tweepy
+
+import tweet_outbox
+from circuit_breaker import CircuitBreaker, twitter_fault
+from tweet_outbox import drain_tweet_outbox, post_tweet, tweet_outbox_stats, tweet_reply, tweets_blocked_until
+
+
+def twitter_response(status_code: int, reason: str, headers: dict = None):
+    return SimpleNamespace(status_code=status_code, reason=reason, headers=headers or {}, json=lambda: {})
+
+
+class FakeTwitterApi:
+    """Tweepy API stand-in: each update_status pops the next outcome (an exception or None for success)"""
+
+    def __init__(self, *outcomes, headers=None):
+        self.outcomes = list(outcomes)
+        self.sent = []
+        self.last_response = SimpleNamespace(headers=headers or {})
+
+    def update_status(self, status: str):
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if outcome is not None:
+            raise outcome
+        self.sent.append(status)
+        return SimpleNamespace(id=1000 + len(self.sent))
+
+
+@pytest.fixture(autouse=True)
+def outbox(monkeypatch):
+    """No sender thread (tests drain by hand) and a fresh Twitter breaker"""
+    monkeypatch.setattr(tweet_outbox, "ensure_background_thread", lambda name, target: None)
+    monkeypatch.setitem(
+        tweet_outbox.CIRCUIT_BREAKERS, "twitter",
+        CircuitBreaker("twitter", slow_ms=15000, min_calls=3, window=600, is_fault=twitter_fault)
+    )
+
+
+def use_api(monkeypatch, api):
+    monkeypatch.setattr(tweet_outbox, "get_twitter_api", lambda: api)
+    return api
+
+
+def outbox_rows(db):
+    return db.execute("SELECT text, status, attempts, tweet_id FROM tweet_outbox ORDER BY id").fetchall()
+
+
+def test_post_tweet_only_queues():
+    queued = post_tweet("  hello world  ")
+    assert queued["status"] == "pending"
+    assert not queued["duplicate"]
+    assert tweet_outbox_stats()["pending"] == 1
+
+
+def test_identical_text_is_queued_once():
+    first = post_tweet("Hello   World")
+    second = post_tweet("hello world")
+    assert second == {"outbox_id": first["outbox_id"], "status": "pending", "duplicate": True}
+
+
+def test_long_and_empty_texts(shared_db):
+    assert post_tweet("   ") is None
+    post_tweet("x" * 300)
+    assert outbox_rows(shared_db)[0][0] == "x" * 280
+
+
+def test_drain_sends_oldest_first(shared_db, monkeypatch):
+    api = use_api(monkeypatch, FakeTwitterApi())
+    post_tweet("first")
+    post_tweet("second")
+
+    assert drain_tweet_outbox() == 2
+    assert api.sent == ["first", "second"]
+    assert outbox_rows(shared_db) == [("first", "sent", 1, "1001"), ("second", "sent", 1, "1002")]
+    assert post_tweet("first")["duplicate"]
+
+
+def test_rate_limit_pauses_sending_for_every_worker(shared_db, monkeypatch):
+    reset = time.time() + 600
+    limited = tweepy.TooManyRequests(twitter_response(429, "Too Many Requests", {"x-rate-limit-reset": str(reset)}))
+    api = use_api(monkeypatch, FakeTwitterApi(limited))
+    post_tweet("first")
+    post_tweet("second")
+
+    assert drain_tweet_outbox() == 1
+    assert tweets_blocked_until() == reset
+    assert drain_tweet_outbox() == 0
+    assert api.sent == []
+    assert [row[1:3] for row in outbox_rows(shared_db)] == [("pending", 0), ("pending", 0)]
+    assert tweet_outbox_stats()["rate_limited_for"] > 500
+
+
+def test_exhausted_window_pauses_after_a_success(monkeypatch):
+    reset = time.time() + 300
+    api = use_api(monkeypatch, FakeTwitterApi(headers={"x-rate-limit-remaining": "0", "x-rate-limit-reset": str(reset)}))
+    post_tweet("first")
+    post_tweet("second")
+
+    assert drain_tweet_outbox() == 1
+    assert api.sent == ["first"]
+    assert tweets_blocked_until() == reset
+
+
+def test_rejected_tweet_fails_without_retry(shared_db, monkeypatch):
+    use_api(monkeypatch, FakeTwitterApi(tweepy.Forbidden(twitter_response(403, "Forbidden"))))
+    post_tweet("duplicate status")
+
+    drain_tweet_outbox()
+    assert outbox_rows(shared_db) == [("duplicate status", "failed", 1, None)]
+
+
+def test_transient_error_is_retried_later(shared_db, monkeypatch):
+    api = use_api(monkeypatch, FakeTwitterApi(ConnectionError("reset by peer")))
+    post_tweet("hello")
+
+    drain_tweet_outbox()
+    assert outbox_rows(shared_db) == [("hello", "pending", 1, None)]
+    assert drain_tweet_outbox() == 0  # backing off
+
+    shared_db.execute("UPDATE tweet_outbox SET next_attempt_at = 0")
+    drain_tweet_outbox()
+    assert api.sent == ["hello"]
+    assert outbox_rows(shared_db) == [("hello", "sent", 2, "1001")]
+
+
+def test_open_breaker_leaves_the_tweet_untouched(shared_db, monkeypatch):
+    api = use_api(monkeypatch, FakeTwitterApi())
+    breaker = tweet_outbox.CIRCUIT_BREAKERS["twitter"]
+    breaker.trip(time.time(), 60)
+    post_tweet("hello")
+
+    assert drain_tweet_outbox() == 1
+    assert api.sent == []
+    assert outbox_rows(shared_db) == [("hello", "pending", 0, None)]
+
+
+def test_tweet_reply_never_raises(monkeypatch):
+    def broken(message):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(tweet_outbox, "post_tweet", broken)
+    assert tweet_reply("hello") is None
@@ -0,0 +1,94 @@
+import pytest
+
+import usage_ledger as usage_ledger_module
+from usage_ledger import QuotaExceeded, UsageLedger, check_token_quota, estimate_request_tokens, usage_day
+
+
+def test_pending_usage_counts_towards_the_session_before_a_flush():
+    ledger = UsageLedger()
+    ledger.record("session-a", "hacker", 100, 50)
+    ledger.record("session-a", "pirate", 10, 5)
+    ledger.record("session-b", "hacker", 1000, 1000)
+
+    assert ledger.session_tokens("session-a") == 165
+    assert ledger.flush() == 3
+    assert ledger.pending == {}
+    assert ledger.session_tokens("session-a") == 165
+
+
+def test_workers_flushing_the_same_key_add_up():
+    first, second = UsageLedger(), UsageLedger()
+    first.record("session-a", "hacker", 100, 50)
+    second.record("session-a", "hacker", 30, 20, estimated=True)
+    first.flush()
+    second.flush()
+
+    assert UsageLedger().session_tokens("session-a") == 200
+    report = UsageLedger().report(usage_day(), top=10)
+    assert report["total"] == {
+        "requests": 2,
+        "prompt_tokens": 130,
+        "completion_tokens": 70,
+        "total_tokens": 200,
+        "estimated_requests": 1
+    }
+
+
+def test_failed_write_keeps_the_counters_for_the_next_flush(monkeypatch):
+    ledger = UsageLedger()
+    ledger.record("session-a", "hacker", 100, 50)
+
+    def broken_write(rows):
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(ledger, "write", broken_write)
+    with pytest.raises(RuntimeError):
+        ledger.flush()
+    ledger.record("session-a", "hacker", 1, 1)
+    assert ledger.pending[(usage_day(), "session-a", "hacker")] == [2, 101, 51, 0]
+
+    monkeypatch.undo()
+    assert ledger.flush() == 1
+    assert ledger.session_tokens("session-a") == 152
+
+
+def test_report_groups_by_personality_and_ranks_sessions():
+    ledger = UsageLedger()
+    ledger.record("light", "hacker", 10, 10)
+    ledger.record("heavy", "hacker", 500, 500)
+    ledger.record("heavy", "pirate", 100, 0)
+    ledger.record(None, "wizard", 1, 1)
+
+    report = ledger.report(usage_day(), top=2)
+    assert set(report["personalities"]) == {"hacker", "pirate", "wizard"}
+    assert report["personalities"]["hacker"]["total_tokens"] == 1020
+    assert [row["session_id"] for row in report["top_sessions"]] == ["heavy", "light"]
+    assert report["total"]["requests"] == 4
+
+
+def test_quota_is_enforced_per_session(monkeypatch):
+    ledger = UsageLedger()
+    monkeypatch.setattr(usage_ledger_module, "usage_ledger", ledger)
+    monkeypatch.setattr(usage_ledger_module, "USAGE_SESSION_DAILY_TOKENS", 1000)
+
+    ledger.record("session-a", "hacker", 600, 300)
+    check_token_quota("session-a")
+    ledger.record("session-a", "hacker", 60, 40)
+    with pytest.raises(QuotaExceeded):
+        check_token_quota("session-a")
+    check_token_quota("session-b")
+    check_token_quota(None)
+
+
+def test_zero_quota_disables_the_check(monkeypatch):
+    ledger = UsageLedger()
+    monkeypatch.setattr(usage_ledger_module, "usage_ledger", ledger)
+    monkeypatch.setattr(usage_ledger_module, "USAGE_SESSION_DAILY_TOKENS", 0)
+    ledger.record("session-a", "hacker", 10**9, 10**9)
+    check_token_quota("session-a")
+
+
+def test_estimate_request_tokens_sums_every_message():
+    request_args = {"messages": [{"role": "system", "content": "x" * 40}, {"role": "user", "content": "y" * 40}]}
+    assert estimate_request_tokens(request_args) == 2 * estimate_request_tokens({"messages": request_args["messages"][:1]})
+    assert estimate_request_tokens(request_args) > 0
@@ -0,0 +1,243 @@
+"""Tweet outbox.
+
+post_tweet only writes a row to the shared store; one sender across all
+workers (whichever holds the lease) drains it, with retries, de-duplication
+and a shared pause while Twitter's rate limit is exhausted. Tweepy is
+imported on first use.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+
+from circuit_breaker import CIRCUIT_BREAKERS, CircuitOpenError
+from shared_store import acquire_lease, ensure_background_thread, get_shared_db
+
+logger = logging.getLogger(__name__)
+
+# Twitter API credentials (make sure these are set in your .env file)
+TWITTER_API_KEY = os.getenv("TWITTER_API_KEY")
+TWITTER_API_KEY_SECRET = os.getenv("TWITTER_API_KEY_SECRET")
+TWITTER_ACCESS_TOKEN = os.getenv("TWITTER_ACCESS_TOKEN")
+TWITTER_ACCESS_TOKEN_SECRET = os.getenv("TWITTER_ACCESS_TOKEN_SECRET")
+
+TWITTER_CONFIGURED = all([TWITTER_API_KEY, TWITTER_API_KEY_SECRET, TWITTER_ACCESS_TOKEN, TWITTER_ACCESS_TOKEN_SECRET])
+if not TWITTER_CONFIGURED:
+    logger.warning("⚠️ Missing Twitter API credentials - tweeting is disabled. Check your .env file.")
+
+_twitter_lock = threading.Lock()
+_twitter_api = {}
+
+
+def get_twitter_api():
+    """Return the Tweepy client, created on first use (None when Twitter is not configured)"""
+    if not TWITTER_CONFIGURED:
+        return None
+    if "api" not in _twitter_api:
+        with _twitter_lock:
+            if "api" not in _twitter_api:
+                import tweepy
+
+                # Set up Tweepy authentication and initialize the Twitter API client $DP
+                auth = tweepy.OAuth1UserHandler(
+                    TWITTER_API_KEY,
+                    TWITTER_API_KEY_SECRET,
+                    TWITTER_ACCESS_TOKEN,
+                    TWITTER_ACCESS_TOKEN_SECRET
+                )
+                _twitter_api["api"] = tweepy.API(auth)
+    return _twitter_api["api"]
+
+
+def reset_twitter_api():
+    """Forget the Tweepy client inherited across fork()"""
+    _twitter_api.clear()
+
+
+# Outbox: one row per queued tweet, sent oldest-first by the lease holder
+TWEET_OUTBOX_POLL = float(os.getenv("TWEET_OUTBOX_POLL", "2"))
+TWEET_BATCH_SIZE = int(os.getenv("TWEET_BATCH_SIZE", "5"))
+TWEET_MAX_ATTEMPTS = int(os.getenv("TWEET_MAX_ATTEMPTS", "6"))
+TWEET_BACKOFF_BASE = float(os.getenv("TWEET_BACKOFF_BASE", "5"))
+TWEET_BACKOFF_MAX = float(os.getenv("TWEET_BACKOFF_MAX", "900"))
+TWEET_DEDUPE_WINDOW = float(os.getenv("TWEET_DEDUPE_WINDOW", str(24 * 3600)))
+TWEET_RATE_LIMIT_FALLBACK = 15 * 60  # Twitter's window when no x-rate-limit-reset header is sent
+_tweet_outbox_wakeup = threading.Event()
+
+
+def tweet_text_hash(message: str) -> str:
+    return hashlib.sha256(" ".join(message.split()).lower().encode("utf-8")).hexdigest()
+
+
+def post_tweet(message: str):
+    """Queue a tweet in the outbox; identical texts pending or sent within TWEET_DEDUPE_WINDOW are dropped"""
+    message = message.strip()[:280]
+    if not message or not TWITTER_CONFIGURED:
+        return None
+    text_hash = tweet_text_hash(message)
+    now = time.time()
+    db = get_shared_db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        duplicate = db.execute(
+            "SELECT id, status FROM tweet_outbox WHERE text_hash = ? AND status IN ('pending', 'sent') AND created_at > ?",
+            (text_hash, now - TWEET_DEDUPE_WINDOW)
+        ).fetchone()
+        if duplicate:
+            db.execute("COMMIT")
+            logger.info(f"🐦 Duplicate tweet skipped (outbox #{duplicate[0]})")
+            return {"outbox_id": duplicate[0], "status": duplicate[1], "duplicate": True}
+        cursor = db.execute(
+            "INSERT INTO tweet_outbox (text, text_hash, status, next_attempt_at, created_at) VALUES (?, ?, 'pending', ?, ?)",
+            (message, text_hash, now, now)
+        )
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+    ensure_background_thread("tweet-sender", tweet_sender_loop)
+    _tweet_outbox_wakeup.set()
+    return {"outbox_id": cursor.lastrowid, "status": "pending", "duplicate": False}
+
+
+def tweet_reply(message: str):
+    """Auto-tweet a reply; an outbox failure is logged but never costs the user their answer"""
+    try:
+        return post_tweet(message)
+    except Exception as e:
+        logger.error(f"⚠️ Auto-tweet not queued: {str(e)}", exc_info=True)
+        return None
+
+
+async def tweet_reply_async(message: str):
+    """Auto-tweet a reply from async code"""
+    return await asyncio.to_thread(tweet_reply, message)
+
+
+def tweet_rate_limit_reset(response) -> float:
+    """Epoch seconds at which Twitter's rate-limit window reopens"""
+    try:
+        return float(response.headers["x-rate-limit-reset"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return time.time() + TWEET_RATE_LIMIT_FALLBACK
+
+
+def block_tweets_until(blocked_until: float):
+    get_shared_db().execute(
+        "INSERT INTO tweet_rate_limit (id, blocked_until) VALUES (1, ?) "
+        "ON CONFLICT(id) DO UPDATE SET blocked_until = MAX(blocked_until, excluded.blocked_until)",
+        (blocked_until,)
+    )
+    logger.warning(f"🐦 Twitter rate limit reached - sending paused for {blocked_until - time.time():.0f}s")
+
+
+def tweets_blocked_until() -> float:
+    row = get_shared_db().execute("SELECT blocked_until FROM tweet_rate_limit WHERE id = 1").fetchone()
+    return row[0] if row else 0.0
+
+
+def send_outbox_tweet(tweet_id: int, text: str, attempts: int) -> bool:
+    """Post one outbox row; returns False when the rate limit or the breaker closed and the batch must stop"""
+    import tweepy
+
+    twitter_api = get_twitter_api()
+    db = get_shared_db()
+    try:
+        with CIRCUIT_BREAKERS["twitter"].guard():
+            tweet = twitter_api.update_status(status=text)
+    except CircuitOpenError:
+        return False  # leave it pending, untouched, until Twitter recovers
+    except tweepy.TooManyRequests as e:
+        block_tweets_until(tweet_rate_limit_reset(e.response))
+        return False
+    except (tweepy.BadRequest, tweepy.Unauthorized, tweepy.Forbidden, tweepy.NotFound) as e:
+        # Permanent: duplicate status, suspended app, bad text... retrying will not help
+        logger.error(f"❌ Tweet #{tweet_id} rejected: {str(e)}")
+        db.execute(
+            "UPDATE tweet_outbox SET status = 'failed', attempts = ?, error = ? WHERE id = ?",
+            (attempts + 1, str(e)[:200], tweet_id)
+        )
+        return True
+    except Exception as e:
+        attempts += 1
+        if attempts >= TWEET_MAX_ATTEMPTS:
+            logger.error(f"❌ Tweet #{tweet_id} failed after {attempts} attempts: {str(e)}")
+            db.execute(
+                "UPDATE tweet_outbox SET status = 'failed', attempts = ?, error = ? WHERE id = ?",
+                (attempts, str(e)[:200], tweet_id)
+            )
+        else:
+            delay = min(TWEET_BACKOFF_MAX, TWEET_BACKOFF_BASE * 2 ** (attempts - 1)) * (0.5 + random.random() / 2)
+            logger.warning(f"⚠️ Tweet #{tweet_id} attempt {attempts} failed, retrying in {delay:.0f}s: {str(e)}")
+            db.execute(
+                "UPDATE tweet_outbox SET attempts = ?, next_attempt_at = ?, error = ? WHERE id = ?",
+                (attempts, time.time() + delay, str(e)[:200], tweet_id)
+            )
+        return True
+
+    db.execute(
+        "UPDATE tweet_outbox SET status = 'sent', attempts = ?, sent_at = ?, tweet_id = ?, error = NULL WHERE id = ?",
+        (attempts + 1, time.time(), str(tweet.id), tweet_id)
+    )
+    logger.info(f"🐦 Tweet posted successfully: {tweet.id}")
+
+    # Stop before the window runs dry rather than burning a request on a 429
+    headers = getattr(twitter_api.last_response, "headers", None) or {}
+    if headers.get("x-rate-limit-remaining") == "0":
+        block_tweets_until(tweet_rate_limit_reset(twitter_api.last_response))
+        return False
+    return True
+
+
+def drain_tweet_outbox() -> int:
+    """Send due tweets oldest-first, at most TWEET_BATCH_SIZE per call; returns how many were attempted"""
+    now = time.time()
+    if tweets_blocked_until() > now:
+        return 0
+    db = get_shared_db()
+    due = db.execute(
+        "SELECT id, text, attempts FROM tweet_outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+        (now, TWEET_BATCH_SIZE)
+    ).fetchall()
+    for attempted, (tweet_id, text, attempts) in enumerate(due, start=1):
+        if not send_outbox_tweet(tweet_id, text, attempts):
+            return attempted
+    db.execute(
+        "DELETE FROM tweet_outbox WHERE status IN ('sent', 'failed') AND created_at < ?",
+        (now - TWEET_DEDUPE_WINDOW,)
+    )
+    return len(due)
+
+
+def tweet_sender_loop():
+    """Background sender: only the worker holding the lease talks to Twitter"""
+    while True:
+        drained = 0
+        try:
+            if acquire_lease("tweet_sender", max(TWEET_OUTBOX_POLL * 5, 30)):
+                drained = drain_tweet_outbox()
+        except Exception as e:
+            logger.error(f"⚠️ Tweet sender error: {str(e)}", exc_info=True)
+        if drained < TWEET_BATCH_SIZE:
+            _tweet_outbox_wakeup.wait(TWEET_OUTBOX_POLL)
+            _tweet_outbox_wakeup.clear()
+
+
+def tweet_outbox_stats() -> dict:
+    """Outbox depth by status, oldest pending age and any active rate-limit pause"""
+    db = get_shared_db()
+    now = time.time()
+    counts = dict(db.execute("SELECT status, COUNT(*) FROM tweet_outbox GROUP BY status").fetchall())
+    (oldest,) = db.execute("SELECT MIN(created_at) FROM tweet_outbox WHERE status = 'pending'").fetchone()
+    blocked_until = tweets_blocked_until()
+    return {
+        "pending": counts.get("pending", 0),
+        "sent": counts.get("sent", 0),
+        "failed": counts.get("failed", 0),
+        "oldest_pending_age": round(now - oldest, 1) if oldest else None,
+        "rate_limited_for": round(blocked_until - now, 1) if blocked_until > now else 0
+    }
@@ -0,0 +1,170 @@
+"""Token accounting and per-session daily quotas.
+
+Usage per (day, session, personality) is summed in memory and flushed to
+the shared store in batches. Quotas are checked before any upstream call;
+other workers' last few seconds of usage may not be flushed yet, so a
+session can overshoot by about one flush interval.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from conversation_memory import estimate_tokens
+from shared_store import get_shared_db
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+USAGE_FLUSH_BATCH = 500  # pending rows that trigger a flush before the interval is up
+USAGE_RETENTION_DAYS = int(os.getenv("USAGE_RETENTION_DAYS", "90"))
+USAGE_SESSION_DAILY_TOKENS = int(os.getenv("USAGE_SESSION_DAILY_TOKENS", "200000"))  # 0 disables the quota
+
+
+class QuotaExceeded(Exception):
+    """The session has used up its daily token quota"""
+
+
+def usage_day(now: float = None) -> str:
+    """Accounting day (UTC) for a timestamp"""
+    return time.strftime("%Y-%m-%d", time.gmtime(now))
+
+
+class UsageLedger:
+    """Prompt/completion tokens per (day, session, personality), batched into the shared store"""
+
+    def __init__(self):
+        self.pending = {}  # (day, session_id, personality) -> [requests, prompt_tokens, completion_tokens, estimated]
+        self.pruned_at = 0.0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def record(self, session_id, personality: str, prompt_tokens: int, completion_tokens: int, estimated: bool = False):
+        """Count one upstream call; estimated when the stream was cut before the provider reported usage"""
+        key = (usage_day(), session_id or "anonymous", personality)
+        with self.lock:
+            counters = self.pending.setdefault(key, [0, 0, 0, 0])
+            counters[0] += 1
+            counters[1] += prompt_tokens or 0
+            counters[2] += completion_tokens or 0
+            counters[3] += int(estimated)
+            backlog = len(self.pending)
+        if backlog >= USAGE_FLUSH_BATCH:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"⚠️ Usage flush error: {str(e)}")
+
+    def flush(self) -> int:
+        """Write this worker's pending counters in one transaction; on failure they are kept for the next try"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return 0
+            rows = [(*key, *counters) for key, counters in batch.items()]
+            try:
+                self.write(rows)
+            except Exception:
+                with self.lock:
+                    for key, counters in batch.items():
+                        merged = self.pending.setdefault(key, [0, 0, 0, 0])
+                        for index, value in enumerate(counters):
+                            merged[index] += value
+                raise
+            return len(rows)
+
+    def write(self, rows: list):
+        db = get_shared_db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT INTO token_usage (day, session_id, personality, requests, prompt_tokens, completion_tokens, estimated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(day, session_id, personality) DO UPDATE SET "
+                "requests = requests + excluded.requests, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, estimated = estimated + excluded.estimated",
+                rows
+            )
+            now = time.time()
+            if now - self.pruned_at > 3600:
+                self.pruned_at = now
+                db.execute("DELETE FROM token_usage WHERE day < ?", (usage_day(now - USAGE_RETENTION_DAYS * 86400),))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def session_tokens(self, session_id: str, day: str = None) -> int:
+        """Tokens the session used on the day: flushed by any worker plus still pending here"""
+        day = day or usage_day()
+        (stored,) = get_shared_db().execute(
+            "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM token_usage WHERE day = ? AND session_id = ?",
+            (day, session_id)
+        ).fetchone()
+        with self.lock:
+            pending = sum(
+                counters[1] + counters[2] for (pending_day, sid, _), counters in self.pending.items()
+                if pending_day == day and sid == session_id
+            )
+        return stored + pending
+
+    def report(self, day: str, top: int) -> dict:
+        """Totals, per-personality sums and the heaviest sessions for one day (after flushing this worker)"""
+        self.flush()
+        db = get_shared_db()
+        columns = "SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), SUM(estimated)"
+
+        def summary(requests, prompt_tokens, completion_tokens, estimated):
+            return {
+                "requests": requests or 0,
+                "prompt_tokens": prompt_tokens or 0,
+                "completion_tokens": completion_tokens or 0,
+                "total_tokens": (prompt_tokens or 0) + (completion_tokens or 0),
+                "estimated_requests": estimated or 0
+            }
+
+        totals = db.execute(f"SELECT {columns} FROM token_usage WHERE day = ?", (day,)).fetchone()
+        personalities = db.execute(
+            f"SELECT personality, {columns} FROM token_usage WHERE day = ? GROUP BY personality ORDER BY personality", (day,)
+        ).fetchall()
+        sessions = db.execute(
+            f"SELECT session_id, {columns} FROM token_usage WHERE day = ? GROUP BY session_id "
+            "ORDER BY SUM(prompt_tokens + completion_tokens) DESC LIMIT ?",
+            (day, top)
+        ).fetchall()
+        return {
+            "day": day,
+            "session_daily_quota": USAGE_SESSION_DAILY_TOKENS or None,
+            "total": summary(*totals),
+            "personalities": {row[0]: summary(*row[1:]) for row in personalities},
+            "top_sessions": [{"session_id": row[0], **summary(*row[1:])} for row in sessions]
+        }
+
+
+usage_ledger = UsageLedger()
+atexit.register(usage_ledger.flush)  # a recycled worker keeps its last few seconds of usage
+
+
+def usage_flush_loop():
+    """Background flusher: push this worker's usage counters to the shared store every USAGE_FLUSH_INTERVAL"""
+    while True:
+        time.sleep(USAGE_FLUSH_INTERVAL)
+        try:
+            usage_ledger.flush()
+        except Exception as e:
+            logger.error(f"⚠️ Usage flush error: {str(e)}")
+
+
+def check_token_quota(session_id):
+    """Raise QuotaExceeded before an upstream call if the session has spent its tokens for today"""
+    if not USAGE_SESSION_DAILY_TOKENS or not session_id:
+        return
+    used = usage_ledger.session_tokens(session_id)
+    if used >= USAGE_SESSION_DAILY_TOKENS:
+        raise QuotaExceeded(f"session {session_id[:8]} used {used} of {USAGE_SESSION_DAILY_TOKENS} tokens today")
+
+
+def estimate_request_tokens(request_args: dict) -> int:
+    """Prompt tokens of a chat request, for calls cut off before the provider reported usage"""
+    return sum(estimate_tokens(message["content"]) for message in request_args["messages"])